@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+"""Benchmark project generation for each command line interface variant.
+
+Each variant is generated with `cookiecutter . --no-input` in three configurations:
+
+- render: files are rendered, post-generation hook only prunes CLI files
+- install: hook creates the virtual environment and installs the project
+- full: hook installs the project and initializes the git repository
+
+Wall time, CPU time (user + system of cookiecutter and every process it spawned)
+and peak RSS are measured for each configuration, along with the durations of
+the phases recorded by the post-generation hook. Results can be appended to the
+history file, and are compared against a baseline taken from this file.
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import typing as t
+from pathlib import Path
+
+TEMPLATE_ROOT = Path(__file__).parent.parent
+HISTORY_FILE = Path(__file__).parent / "history.jsonl"
+CLI_OPTIONS = ["No command-line interface", "Argparse", "Click", "Typer"]
+CONFIGS: t.Dict[str, t.Dict[str, t.Any]] = {
+    "render": {"env": {"TEMPLATE_RENDER_ONLY": "1"}, "init_git_repo": False},
+    "install": {"env": {}, "init_git_repo": False},
+    "full": {"env": {}, "init_git_repo": True},
+}
+# Differences below these values are considered as noise
+MIN_DELTA = {"wall": 0.1, "cpu": 0.1, "maxrss": 5.0}
+
+
+class Measure(t.NamedTuple):
+    wall: float
+    cpu: float
+    maxrss: float
+    phases: t.Dict[str, float]
+
+
+def run_measured(cmd: t.List[str], env: t.Dict[str, str]) -> Measure:
+    """Run command and measure resources used by the command and its children."""
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        cmd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE
+    )
+    assert process.stderr
+    stderr = process.stderr.read()
+    # Usage returned by wait4 covers the process and all its waited for descendants
+    _, status, usage = os.wait4(process.pid, 0)
+    wall = time.perf_counter() - start
+    process.returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else 1
+    if process.returncode:
+        sys.stderr.buffer.write(stderr)
+        raise subprocess.CalledProcessError(process.returncode, cmd)
+    # ru_maxrss is expressed in bytes on macOS and in kilobytes elsewhere
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return Measure(
+        wall=wall,
+        cpu=usage.ru_utime + usage.ru_stime,
+        maxrss=usage.ru_maxrss / scale,
+        phases={},
+    )
+
+
+def generate(cli: str, config: str, output_dir: Path, wheelhouse: str) -> Measure:
+    """Generate a project and return its measure."""
+    options = CONFIGS[config]
+    env = {**os.environ, **options["env"], "TEMPLATE_WHEELHOUSE": wheelhouse}
+    env.pop("TEMPLATE_OFFLINE", None)
+    cmd = [
+        sys.executable,
+        "-m",
+        "cookiecutter",
+        TEMPLATE_ROOT.as_posix(),
+        "--no-input",
+        "--output-dir",
+        output_dir.as_posix(),
+        f"command_line_interface={cli}",
+        f"init_git_repo={options['init_git_repo']}",
+    ]
+    measure = run_measured(cmd, env)
+    timings_file = output_dir / "demo-project" / "generation-timings.json"
+    if timings_file.is_file():
+        timings = json.loads(timings_file.read_text())
+        measure.phases.update(
+            {phase["phase"]: phase["duration"] for phase in timings["phases"]}
+        )
+    return measure
+
+
+def summarize(measures: t.List[Measure]) -> t.Dict[str, t.Any]:
+    """Take median of times and maximum of peak RSS over repeated measures."""
+    phases = sorted({phase for measure in measures for phase in measure.phases})
+    return {
+        "wall": round(statistics.median(measure.wall for measure in measures), 3),
+        "cpu": round(statistics.median(measure.cpu for measure in measures), 3),
+        "maxrss": round(max(measure.maxrss for measure in measures), 1),
+        "phases": {
+            phase: round(
+                statistics.median(
+                    measure.phases[phase]
+                    for measure in measures
+                    if phase in measure.phases
+                ),
+                3,
+            )
+            for phase in phases
+        },
+    }
+
+
+def machine() -> t.Dict[str, t.Any]:
+    """Describe the machine on which benchmarks run (baselines must match it)."""
+    return {
+        "platform": sys.platform,
+        "machine": platform.machine(),
+        "python": ".".join(str(part) for part in sys.version_info[:2]),
+        "cpus": os.cpu_count(),
+    }
+
+
+def git_revision() -> str:
+    """Get current commit, suffixed with '+dirty' when worktree has changes."""
+    revision = subprocess.check_output(
+        ["git", "rev-parse", "--short", "HEAD"], cwd=TEMPLATE_ROOT, text=True
+    ).strip()
+    status = subprocess.check_output(
+        ["git", "status", "--porcelain", "--untracked-files=no"],
+        cwd=TEMPLATE_ROOT,
+        text=True,
+    )
+    return revision + "+dirty" if status.strip() else revision
+
+
+def read_history() -> t.List[t.Dict[str, t.Any]]:
+    if not HISTORY_FILE.is_file():
+        return []
+    return [json.loads(line) for line in HISTORY_FILE.read_text().splitlines() if line]
+
+
+def find_baseline(
+    history: t.List[t.Dict[str, t.Any]], revision: t.Optional[str], wheelhouse: bool
+) -> t.Optional[t.Dict[str, t.Any]]:
+    """Find the most recent comparable run (recorded at given revision if any).
+
+    Runs are comparable when recorded on the same machine, with the wheel cache
+    enabled or disabled alike.
+    """
+    for run in reversed(history):
+        if run["machine"] != machine() or run["wheelhouse"] != wheelhouse:
+            continue
+        if revision is None or run["revision"].startswith(revision):
+            return run
+    return None
+
+
+def compare(
+    results: t.Dict[str, t.Any], baseline: t.Dict[str, t.Any], threshold: float
+) -> t.List[str]:
+    """Compare results against baseline and return regressions."""
+    regressions: t.List[str] = []
+
+    def check(name: str, metric: str, value: float, reference: float) -> None:
+        limit = reference * (1 + threshold)
+        if value > limit and value - reference > MIN_DELTA[metric]:
+            regressions.append(
+                f"{name}: {metric} {value:.2f} > {reference:.2f} "
+                f"(+{value - reference:.2f}, threshold {threshold:.0%})"
+            )
+
+    for key, result in results.items():
+        reference = baseline.get(key)
+        if reference is None:
+            continue
+        for metric in ("wall", "cpu", "maxrss"):
+            check(key, metric, result[metric], reference[metric])
+        for phase, duration in result["phases"].items():
+            if phase in reference["phases"]:
+                check(f"{key} [{phase}]", "wall", duration, reference["phases"][phase])
+    return regressions
+
+
+def print_results(
+    results: t.Dict[str, t.Any], baseline: t.Optional[t.Dict[str, t.Any]]
+) -> None:
+    print(f"{'Benchmark':<40}{'Wall':>10}{'CPU':>10}{'RSS (MB)':>10}{'Baseline':>10}")
+    for key, result in results.items():
+        reference = (baseline or {}).get(key)
+        print(
+            f"{key:<40}{result['wall']:>9.2f}s{result['cpu']:>9.2f}s"
+            f"{result['maxrss']:>10.1f}"
+            + (f"{reference['wall']:>9.2f}s" if reference else f"{'-':>10}")
+        )
+        for phase, duration in result["phases"].items():
+            print(f"  {phase:<38}{duration:>9.2f}s")
+
+
+def main(args: t.Optional[t.Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--cli",
+        action="append",
+        choices=CLI_OPTIONS,
+        help="Command line interface variant to benchmark (all by default)",
+    )
+    parser.add_argument(
+        "--config",
+        action="append",
+        choices=list(CONFIGS),
+        help="Configuration to benchmark (all by default)",
+    )
+    parser.add_argument(
+        "-r", "--repeat", type=int, default=3, help="Measures taken per benchmark"
+    )
+    parser.add_argument(
+        "--cold",
+        action="store_true",
+        help="Disable wheel cache so that every install downloads distributions",
+    )
+    parser.add_argument(
+        "--record", action="store_true", help="Append results to history file"
+    )
+    parser.add_argument(
+        "--baseline",
+        metavar="REVISION",
+        help="Compare against run recorded for this revision (latest run by default)",
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.2,
+        help="Fail when a metric exceeds baseline by more than this ratio",
+    )
+    options = parser.parse_args(args)
+    if os.name == "nt":
+        parser.error("Benchmarks rely on os.wait4 which is not available on Windows")
+
+    # Record revision before running since worktree may change meanwhile
+    revision = git_revision()
+    history = read_history()
+    baseline = find_baseline(history, options.baseline, not options.cold)
+    results: t.Dict[str, t.Any] = {}
+    with tempfile.TemporaryDirectory(prefix="template-bench-") as tmpdir:
+        # Wheel cache is warmed up by the first generation of each variant
+        wheelhouse = "" if options.cold else Path(tmpdir, "wheelhouse").as_posix()
+        for config in options.config or list(CONFIGS):
+            for cli in options.cli or CLI_OPTIONS:
+                key = f"{config}/{cli}"
+                print(f"Running {key}", file=sys.stderr)
+                measures: t.List[Measure] = []
+                # First generation is a warm-up run and is not measured
+                for index in range(options.repeat + 1):
+                    output_dir = Path(tmpdir, f"{len(results)}-{index}")
+                    measure = generate(cli, config, output_dir, wheelhouse)
+                    if index:
+                        measures.append(measure)
+                results[key] = summarize(measures)
+
+    print_results(results, baseline["results"] if baseline else None)
+    if options.record:
+        run = {
+            "revision": revision,
+            "date": datetime.datetime.now(datetime.timezone.utc).isoformat(
+                timespec="seconds"
+            ),
+            "machine": machine(),
+            "repeat": options.repeat,
+            "wheelhouse": not options.cold,
+            "results": results,
+        }
+        with HISTORY_FILE.open("a") as history_file:
+            history_file.write(json.dumps(run, sort_keys=True) + "\n")
+        print(f"Results appended to {HISTORY_FILE}", file=sys.stderr)
+    if baseline is None:
+        print("No comparable baseline recorded in history", file=sys.stderr)
+        return 0
+    regressions = compare(results, baseline["results"], options.threshold)
+    print(f"Compared against {baseline['revision']} ({baseline['date']})")
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
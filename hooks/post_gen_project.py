@@ -1,8 +1,18 @@
 """See: https://cookiecutter.readthedocs.io/en/latest/advanced/hooks.html#using-pre-post-generate-hooks-0-7-0"""
+import contextlib
+import hashlib
+import json
 import os
+import platform
+import re
 import shutil
 import subprocess
 import sys
+import tempfile
+import time
+import typing as t
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
 
 HELP = """
 ####### Next steps ##########
@@ -58,55 +68,434 @@ HELP = """
 """
 
 CLI = "{{ cookiecutter.command_line_interface }}".lower()
-
-if CLI == "no command-line interface":
-    shutil.rmtree("src/{{ cookiecutter.project_slug }}/cli")
-    os.remove("src/{{ cookiecutter.project_slug }}/__main__.py")
-    os.remove("tests/e2e/test_cli.py")
-elif CLI == "argparse":
-    os.remove("src/{{ cookiecutter.project_slug }}/cli/app.click.py")
-    os.remove("src/{{ cookiecutter.project_slug }}/cli/app.typer.py")
-    shutil.move(
-        "src/{{ cookiecutter.project_slug }}/cli/app.argparse.py",
-        "src/{{ cookiecutter.project_slug }}/cli/app.py",
+INIT_GIT_REPO = {{ cookiecutter.init_git_repo }}
+TIMINGS_FILE = Path("generation-timings.json")
+# Context used to render project, recorded so that project can later be updated
+CONTEXT = json.loads(r"""{{ cookiecutter | jsonify }}""")
+CONTEXT_FILE = Path(".cookiecutter.json")
+# Only render project files (used by tests which do not need a virtual environment)
+RENDER_ONLY = os.environ.get("TEMPLATE_RENDER_ONLY", "").lower() in ("1", "true", "yes")
+# Fail instead of reaching package index when wheel cache cannot be used
+OFFLINE = os.environ.get("TEMPLATE_OFFLINE", "").lower() in ("1", "true", "yes")
+# Requirements annotations name the project, cached requirements use a placeholder
+PROJECT_ANNOTATION = "{{ cookiecutter.project_name }} (pyproject.toml)"
+
+# Wheel cache shared by all generated projects (set to an empty string to disable)
+WHEELHOUSE_ROOT = os.environ.get(
+    "TEMPLATE_WHEELHOUSE",
+    os.path.join(
+        os.environ.get("XDG_CACHE_HOME", "~/.cache"), "python-template-oss", "wheelhouse"
+    ),
+)
+
+# Phases durations recorded by steps (appending to a list is thread-safe)
+TIMINGS: t.List[t.Dict[str, t.Any]] = []
+TIMINGS_DIR = Path(tempfile.mkdtemp())
+
+
+@contextlib.contextmanager
+def timed(phase: str) -> t.Iterator[None]:
+    """Record wall time spent within a phase."""
+    start = time.time()
+    counter = time.perf_counter()
+    try:
+        yield
+    finally:
+        TIMINGS.append(
+            {"phase": phase, "start": start, "duration": time.perf_counter() - counter}
+        )
+
+
+class Step(t.NamedTuple):
+    """A single step of the post-generation pipeline."""
+
+    name: str
+    action: t.Callable[[], None]
+    requires: t.Tuple[str, ...] = ()
+
+
+def run_pipeline(steps: t.List[Step]) -> None:
+    """Run steps concurrently, each step waiting for the steps it requires.
+
+    Steps must be listed after the steps they require. When a step fails, all
+    steps depending on it fail as well and the first error is raised once every
+    running step is done.
+    """
+    futures: t.Dict[str, "Future[None]"] = {}
+
+    def run_step(step: Step) -> None:
+        for name in step.requires:
+            futures[name].result()
+        step.action()
+
+    # Use one worker per step so that waiting steps never starve running ones
+    with ThreadPoolExecutor(max_workers=len(steps)) as executor:
+        for step in steps:
+            futures[step.name] = executor.submit(run_step, step)
+    for step in steps:
+        futures[step.name].result()
+
+
+def prune_cli_files() -> None:
+    """Remove files which do not belong to selected command line interface."""
+    with timed("prune"):
+        _prune_cli_files()
+
+
+def _prune_cli_files() -> None:
+    if CLI == "no command-line interface":
+        shutil.rmtree("src/{{ cookiecutter.project_slug }}/cli")
+        os.remove("src/{{ cookiecutter.project_slug }}/__main__.py")
+        os.remove("tests/e2e/test_cli.py")
+    elif CLI == "argparse":
+        os.remove("src/{{ cookiecutter.project_slug }}/cli/app.click.py")
+        os.remove("src/{{ cookiecutter.project_slug }}/cli/app.typer.py")
+        shutil.move(
+            "src/{{ cookiecutter.project_slug }}/cli/app.argparse.py",
+            "src/{{ cookiecutter.project_slug }}/cli/app.py",
+        )
+    elif CLI == "click":
+        os.remove("src/{{ cookiecutter.project_slug }}/cli/app.argparse.py")
+        os.remove("src/{{ cookiecutter.project_slug }}/cli/app.typer.py")
+        shutil.move(
+            "src/{{ cookiecutter.project_slug }}/cli/app.click.py",
+            "src/{{ cookiecutter.project_slug }}/cli/app.py",
+        )
+    elif CLI == "typer":
+        os.remove("src/{{ cookiecutter.project_slug }}/cli/app.argparse.py")
+        os.remove("src/{{ cookiecutter.project_slug }}/cli/app.click.py")
+        shutil.move(
+            "src/{{ cookiecutter.project_slug }}/cli/app.typer.py",
+            "src/{{ cookiecutter.project_slug }}/cli/app.py",
+        )
+
+
+def template_commit() -> t.Optional[str]:
+    """Get commit of the template repository from which project is rendered.
+
+    TEMPLATE_COMMIT environment variable takes precedence. Template directory
+    is otherwise relative to the directory from which cookiecutter was run.
+    """
+    if os.environ.get("TEMPLATE_COMMIT"):
+        return os.environ["TEMPLATE_COMMIT"]
+    repo_dir = Path(os.environ.get("PWD", os.getcwd()), CONTEXT["_repo_dir"]).resolve()
+    process = subprocess.run(
+        ["git", "-C", str(repo_dir), "rev-parse", "--show-toplevel", "HEAD"],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        text=True,
     )
-elif CLI == "click":
-    os.remove("src/{{ cookiecutter.project_slug }}/cli/app.argparse.py")
-    os.remove("src/{{ cookiecutter.project_slug }}/cli/app.typer.py")
-    shutil.move(
-        "src/{{ cookiecutter.project_slug }}/cli/app.click.py",
-        "src/{{ cookiecutter.project_slug }}/cli/app.py",
+    if process.returncode != 0:
+        return None
+    toplevel, commit = process.stdout.split()
+    # Template may be located within another repository (or not exist anymore)
+    return commit if Path(toplevel).resolve() == repo_dir else None
+
+
+def record_context() -> None:
+    """Write template commit and context to allow updating project from template."""
+    with timed("context"):
+        context = {
+            key: value for key, value in CONTEXT.items() if not key.startswith("_")
+        }
+        CONTEXT_FILE.write_text(
+            json.dumps({"commit": template_commit(), "context": context}, indent=2)
+            + "\n"
+        )
+
+
+def environment_key() -> str:
+    """Key identifying the interpreter, the platform and the options which affect dependencies.
+
+    Must be kept in sync with hooks/pre_gen_project.py.
+    """
+    parts = [
+        "{{ cookiecutter.command_line_interface }}",
+        "{{ cookiecutter.requires_python }}",
+        sys.implementation.name,
+        ".".join(str(part) for part in sys.version_info[:2]),
+        sys.platform,
+        platform.machine(),
+    ]
+    return hashlib.sha256("\n".join(parts).encode()).hexdigest()[:16]
+
+
+def dependencies_digest() -> str:
+    """Digest of build requirements, dependencies and extras declared in pyproject.toml.
+
+    Must be kept in sync with hooks/pre_gen_project.py.
+    """
+    declared = []
+    table = ""
+    in_dependencies = False
+    for line in Path("pyproject.toml").read_text().splitlines():
+        line = line.strip()
+        if re.match(r"^\[[\w.-]+\]$", line):
+            table = line
+        elif table == "[project]" and line.startswith("dependencies"):
+            in_dependencies = not line.endswith("]")
+            declared.append(line)
+        elif in_dependencies:
+            in_dependencies = line != "]"
+            declared.append(line)
+        elif table in ("[build-system]", "[project.optional-dependencies]"):
+            declared.append(line)
+    return hashlib.sha256("\n".join(declared).encode()).hexdigest()
+
+
+def wheelhouse_index() -> t.Optional[Path]:
+    """Path to the wheel cache index entry for current environment key."""
+    if not WHEELHOUSE_ROOT:
+        return None
+    return Path(WHEELHOUSE_ROOT).expanduser() / "index" / f"{environment_key()}.json"
+
+
+def find_wheelhouse() -> t.Optional[Path]:
+    """Find wheel cache entry holding every distribution required by project."""
+    index = wheelhouse_index()
+    if index is None or not index.is_file():
+        return None
+    entry = json.loads(index.read_text())
+    # Entries saved by earlier versions do not hold requirements
+    if entry["spec"] != dependencies_digest() or "requirements" not in entry:
+        return None
+    wheelhouse = index.parent.parent / entry["lock"]
+    return wheelhouse if wheelhouse.is_dir() else None
+
+
+def save_wheelhouse() -> None:
+    """Save wheels of all distributions installed in virtualenv into wheel cache.
+
+    Wheels are stored in a directory named after the digest of the resolved
+    dependency set, so that projects resolving to the same set share wheels.
+    Requirements are stored in the index entry instead, since projects sharing
+    wheels (development extras included) may not share runtime dependencies.
+    """
+    index = wheelhouse_index()
+    if index is None:
+        return
+    project_python = get_project_python()
+    frozen = subprocess.check_output(
+        [project_python, "-m", "pip", "freeze", "--all", "--exclude-editable"]
+    ).decode()
+    lock = hashlib.sha256(frozen.encode()).hexdigest()[:16]
+    wheelhouse = index.parent.parent / lock
+    if not wheelhouse.is_dir():
+        wheelhouse.parent.mkdir(parents=True, exist_ok=True)
+        # Populate a temporary directory first so that an entry is never partial
+        tmpdir = Path(tempfile.mkdtemp(dir=wheelhouse.parent, prefix=f".{lock}-"))
+        try:
+            tmpdir.joinpath("constraints.txt").write_text(frozen)
+            subprocess.check_call(
+                [
+                    project_python,
+                    "-m",
+                    "pip",
+                    "wheel",
+                    "--no-deps",
+                    "--quiet",
+                    "--wheel-dir",
+                    str(tmpdir),
+                    "-r",
+                    str(tmpdir / "constraints.txt"),
+                ]
+            )
+            tmpdir.rename(wheelhouse)
+        except OSError:
+            # Entry was saved concurrently by another generation
+            if not wheelhouse.is_dir():
+                raise
+        finally:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+    requirements = (
+        Path("requirements.txt").read_text().replace(PROJECT_ANNOTATION, "<project>")
     )
-elif CLI == "typer":
-    os.remove("src/{{ cookiecutter.project_slug }}/cli/app.argparse.py")
-    os.remove("src/{{ cookiecutter.project_slug }}/cli/app.click.py")
-    shutil.move(
-        "src/{{ cookiecutter.project_slug }}/cli/app.typer.py",
-        "src/{{ cookiecutter.project_slug }}/cli/app.py",
+    index.parent.mkdir(parents=True, exist_ok=True)
+    index.write_text(
+        json.dumps(
+            {"spec": dependencies_digest(), "lock": lock, "requirements": requirements}
+        )
     )
 
-subprocess.check_call([sys.executable, "./scripts/install.py", "--all"])
-project_python = subprocess.check_output([sys.executable, "./scripts/install.py", "--show-python-path"]).strip().decode()
-subprocess.check_call([project_python, "-m", "invoke", "requirements"])
 
-if {{cookiecutter.init_git_repo}}:
-    process = subprocess.run(
-        ["git", "init"], stdout=subprocess.DEVNULL, stderr=subprocess.PIPE
+def populate_wheelhouse() -> None:
+    """Save wheels into wheel cache without failing project generation on error."""
+    try:
+        with timed("wheelhouse"):
+            save_wheelhouse()
+    except Exception as exc:
+        print(f"Failed to save wheel cache: {exc}", file=sys.stderr)
+
+
+def run_install_script(name: str, *args: str) -> None:
+    """Run install script and collect durations of installation phases."""
+    timings = TIMINGS_DIR / f"{name}.json"
+    if WHEELHOUSE:
+        args += ("--wheelhouse", str(WHEELHOUSE))
+    try:
+        subprocess.check_call(
+            [sys.executable, "./scripts/install.py", "--timings", str(timings), *args]
+        )
+    finally:
+        if timings.is_file():
+            TIMINGS.extend(json.loads(timings.read_text()))
+
+
+def create_virtualenv() -> None:
+    """Create virtual environment without installing project."""
+    run_install_script("virtualenv", "--no-install")
+
+
+def install_build_extra() -> None:
+    """Install project with build extra only (provides invoke and pip-tools)."""
+    run_install_script("bootstrap", "--no-virtualenv")
+
+
+def install_project() -> None:
+    """Install project in editable mode with all extras."""
+    run_install_script("install", "--no-virtualenv", "--all")
+
+
+def get_project_python() -> str:
+    """Get path to virtual environment python."""
+    return (
+        subprocess.check_output(
+            [sys.executable, "./scripts/install.py", "--show-python-path"]
+        )
+        .strip()
+        .decode()
     )
-    if process.returncode != 0:
-        print(process.stderr.decode(), file=sys.stderr)
-        sys.exit(1)
-    subprocess.check_call(["git", "checkout", "-b", "main"], stdout=subprocess.DEVNULL)
-    subprocess.check_call(["git", "add", "."], stdout=subprocess.DEVNULL)
-    subprocess.check_call(
-        [
-            "git",
-            "commit",
-            "-m",
-            "chore(project): initialize project layout and configured development tools",
-        ],
-        stdout=subprocess.DEVNULL,
+
+
+def generate_requirements() -> None:
+    """Generate requirements.txt using pip-tools or copy it from wheel cache."""
+    index = wheelhouse_index()
+    if WHEELHOUSE and index:
+        with timed("requirements-cache"):
+            requirements = json.loads(index.read_text())["requirements"]
+            Path("requirements.txt").write_text(
+                requirements.replace("<project>", PROJECT_ANNOTATION)
+            )
+        return
+    project_python = get_project_python()
+    with timed("pip-compile"):
+        subprocess.check_call([project_python, "-m", "invoke", "requirements"])
+
+
+def init_git_repo() -> None:
+    """Initialize git repository on main branch."""
+    with timed("git-init"):
+        process = subprocess.run(
+            ["git", "init"], stdout=subprocess.DEVNULL, stderr=subprocess.PIPE
+        )
+        if process.returncode != 0:
+            raise RuntimeError(process.stderr.decode())
+        subprocess.check_call(
+            ["git", "checkout", "-b", "main"], stdout=subprocess.DEVNULL
+        )
+
+
+def commit_project() -> None:
+    """Commit generated project then create next branch."""
+    with timed("git-add"):
+        subprocess.check_call(["git", "add", "."], stdout=subprocess.DEVNULL)
+    with timed("git-commit"):
+        subprocess.check_call(
+            [
+                "git",
+                "commit",
+                "-m",
+                "chore(project): initialize project layout and configured development tools",
+            ],
+            stdout=subprocess.DEVNULL,
+        )
+        subprocess.check_call(
+            ["git", "checkout", "-b", "next"], stdout=subprocess.DEVNULL
+        )
+
+
+def report_timings(start: float, total: float) -> None:
+    """Write phases durations to JSON file and print a summary on stderr."""
+    phases = [
+        {
+            "phase": timing["phase"],
+            "start": round(timing["start"] - start, 3),
+            "duration": round(timing["duration"], 3),
+        }
+        for timing in sorted(TIMINGS, key=lambda timing: timing["start"])
+    ]
+    TIMINGS_FILE.write_text(
+        json.dumps(
+            {
+                "command_line_interface": "{{ cookiecutter.command_line_interface }}",
+                "python": ".".join(str(part) for part in sys.version_info[:3]),
+                "wheelhouse": str(WHEELHOUSE) if WHEELHOUSE else None,
+                "total": round(total, 3),
+                "phases": phases,
+            },
+            indent=2,
+        )
     )
-    subprocess.check_call(["git", "checkout", "-b", "next"], stdout=subprocess.DEVNULL)
-    subprocess.check_call(["git", "--no-pager", "log", "--stat"])
-    print(HELP)
+    print(f"\n{'Phase':<32}{'Start':>10}{'Duration':>10}", file=sys.stderr)
+    for phase in phases:
+        print(
+            f"{phase['phase']:<32}{phase['start']:>9.2f}s{phase['duration']:>9.2f}s",
+            file=sys.stderr,
+        )
+    print(f"{'Total':<32}{'':>10}{total:>9.2f}s", file=sys.stderr)
+    print(f"Timings written to {TIMINGS_FILE.resolve()}\n", file=sys.stderr)
+
+
+# Install offline when wheel cache holds every distribution required by project
+WHEELHOUSE = None if RENDER_ONLY else find_wheelhouse()
+# Git initialisation and CLI files pruning overlap with virtualenv creation,
+# and requirements are resolved while remaining extras are being installed.
+# Commit waits for every file tracked by git to be in its final state.
+STEPS = [Step("prune", prune_cli_files), Step("context", record_context)]
+if not RENDER_ONLY:
+    STEPS += [
+        Step("virtualenv", create_virtualenv),
+        Step("bootstrap", install_build_extra, requires=("prune", "virtualenv")),
+        Step("install", install_project, requires=("bootstrap",)),
+        Step("requirements", generate_requirements, requires=("bootstrap",)),
+    ]
+if not RENDER_ONLY and not WHEELHOUSE:
+    STEPS += [
+        Step("wheelhouse", populate_wheelhouse, requires=("install", "requirements"))
+    ]
+if not RENDER_ONLY and INIT_GIT_REPO:
+    STEPS += [
+        Step("git-init", init_git_repo),
+        Step(
+            "git-commit",
+            commit_project,
+            requires=("git-init", "prune", "context", "requirements"),
+        ),
+    ]
+
+
+if __name__ == "__main__":
+    if OFFLINE and not RENDER_ONLY and not WHEELHOUSE:
+        print(
+            "Wheel cache does not hold dependencies declared by project. "
+            "Generate a project once with network access or unset TEMPLATE_OFFLINE.",
+            file=sys.stderr,
+        )
+        sys.exit(1)
+    start = time.time()
+    counter = time.perf_counter()
+    try:
+        run_pipeline(STEPS)
+    except subprocess.CalledProcessError:
+        # No need to print traceback, error will be printed from subprocess stderr
+        sys.exit(1)
+    except Exception as exc:
+        print(exc, file=sys.stderr)
+        sys.exit(1)
+    finally:
+        if not RENDER_ONLY:
+            report_timings(start, time.perf_counter() - counter)
+        shutil.rmtree(TIMINGS_DIR, ignore_errors=True)
+    if not RENDER_ONLY and INIT_GIT_REPO:
+        subprocess.check_call(["git", "--no-pager", "log", "--stat"])
+        print(HELP)
@@ -1 +1,105 @@
 """See: https://cookiecutter.readthedocs.io/en/latest/advanced/hooks.html#using-pre-post-generate-hooks-0-7-0"""
+import hashlib
+import json
+import os
+import platform
+import re
+import sys
+import typing as t
+from pathlib import Path
+
+# Wheel cache shared by all generated projects (set to an empty string to disable)
+WHEELHOUSE_ROOT = os.environ.get(
+    "TEMPLATE_WHEELHOUSE",
+    os.path.join(
+        os.environ.get("XDG_CACHE_HOME", "~/.cache"), "python-template-oss", "wheelhouse"
+    ),
+)
+# Fail before rendering project when wheel cache cannot be used
+OFFLINE = os.environ.get("TEMPLATE_OFFLINE", "").lower() in ("1", "true", "yes")
+# Project is only rendered, wheel cache is not needed
+RENDER_ONLY = os.environ.get("TEMPLATE_RENDER_ONLY", "").lower() in ("1", "true", "yes")
+# Context used to render project
+CONTEXT = json.loads(r"""{{ cookiecutter | jsonify }}""")
+
+
+def environment_key() -> str:
+    """Key identifying the interpreter, the platform and the options which affect dependencies.
+
+    Must be kept in sync with hooks/post_gen_project.py.
+    """
+    parts = [
+        "{{ cookiecutter.command_line_interface }}",
+        "{{ cookiecutter.requires_python }}",
+        sys.implementation.name,
+        ".".join(str(part) for part in sys.version_info[:2]),
+        sys.platform,
+        platform.machine(),
+    ]
+    return hashlib.sha256("\n".join(parts).encode()).hexdigest()[:16]
+
+
+def render_pyproject() -> str:
+    """Render pyproject.toml of project template, which is not rendered yet."""
+    from cookiecutter.utils import create_env_with_context
+
+    repo_dir = Path(os.environ.get("PWD", os.getcwd()), CONTEXT["_repo_dir"])
+    source = repo_dir / "{% raw %}{{ cookiecutter.repo_name }}{% endraw %}" / "pyproject.toml"
+    environment = create_env_with_context({"cookiecutter": CONTEXT})
+    return environment.from_string(source.read_text()).render(cookiecutter=CONTEXT)
+
+
+def dependencies_digest(content: str) -> str:
+    """Digest of build requirements, dependencies and extras declared in pyproject.toml.
+
+    Must be kept in sync with hooks/post_gen_project.py.
+    """
+    declared = []
+    table = ""
+    in_dependencies = False
+    for line in content.splitlines():
+        line = line.strip()
+        if re.match(r"^\[[\w.-]+\]$", line):
+            table = line
+        elif table == "[project]" and line.startswith("dependencies"):
+            in_dependencies = not line.endswith("]")
+            declared.append(line)
+        elif in_dependencies:
+            in_dependencies = line != "]"
+            declared.append(line)
+        elif table in ("[build-system]", "[project.optional-dependencies]"):
+            declared.append(line)
+    return hashlib.sha256("\n".join(declared).encode()).hexdigest()
+
+
+def find_wheelhouse() -> t.Optional[Path]:
+    """Find wheel cache entry holding every distribution required by project.
+
+    Same entry is used by hooks/post_gen_project.py.
+    """
+    if not WHEELHOUSE_ROOT:
+        return None
+    root = Path(WHEELHOUSE_ROOT).expanduser()
+    index = root / "index" / f"{environment_key()}.json"
+    if not index.is_file():
+        return None
+    entry = json.loads(index.read_text())
+    # Entries saved by earlier versions do not hold requirements
+    if entry["spec"] != dependencies_digest(render_pyproject()) or "requirements" not in entry:
+        return None
+    wheelhouse = root / entry["lock"]
+    return wheelhouse if wheelhouse.is_dir() else None
+
+
+if __name__ == "__main__" and not RENDER_ONLY:
+    wheelhouse = find_wheelhouse()
+    if wheelhouse:
+        print(f"Found wheel cache: {wheelhouse}", file=sys.stderr)
+    elif OFFLINE:
+        print(
+            "Wheel cache does not hold dependencies of selected options for current "
+            "interpreter. "
+            "Generate a project once with network access or unset TEMPLATE_OFFLINE.",
+            file=sys.stderr,
+        )
+        sys.exit(1)
@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+"""Generate many projects at once from a manifest of cookiecutter contexts.
+
+Manifest is a JSON file holding either a list of contexts, or an object with
+a "projects" list of contexts and optional "defaults" applied to every project:
+
+    {
+        "defaults": {"repo_org": "quara-dev", "init_git_repo": false},
+        "projects": [
+            {"project_title": "Orders Service", "command_line_interface": "Click"},
+            {"project_title": "Billing Service", "command_line_interface": "Click"}
+        ]
+    }
+
+Contexts may only hold keys found in cookiecutter.json. Projects are generated
+concurrently, and share a single wheel cache, pip download cache and requirements
+resolution cache. Projects which install the same dependencies (same command
+line interface and requires_python options) form a group: the first project of
+each group is generated first, so that remaining projects of the group are
+installed from the wheel cache and restore their requirements from it instead of
+resolving them again (requirements annotations name each project, not the first
+one of the group).
+
+A failure never stops the batch. Timings and failures of each project are
+printed once all projects are done, and written to bulk-report.json within
+output directory.
+"""
+
+import argparse
+import concurrent.futures
+import json
+import os
+import subprocess
+import sys
+import time
+import typing as t
+from pathlib import Path
+
+TEMPLATE_ROOT = Path(__file__).parent.parent
+# Options which determine dependencies installed by post-generation hook
+DEPENDENCY_OPTIONS = ("command_line_interface", "requires_python")
+
+
+class Job(t.NamedTuple):
+    index: int
+    context: t.Dict[str, t.Any]
+    group: str
+
+
+class Result(t.NamedTuple):
+    index: int
+    project: str
+    group: str
+    status: str
+    duration: float
+    log: t.Optional[str]
+    error: t.Optional[str]
+
+
+def template_defaults() -> t.Dict[str, t.Any]:
+    """Default context of the template (first choice of each list option)."""
+    context = json.loads(TEMPLATE_ROOT.joinpath("cookiecutter.json").read_text())
+    return {
+        key: value[0] if isinstance(value, list) else value
+        for key, value in context.items()
+    }
+
+
+def read_manifest(path: Path) -> t.List[t.Dict[str, t.Any]]:
+    data = json.loads(path.read_text())
+    if isinstance(data, list):
+        return data
+    defaults = data.get("defaults", {})
+    return [{**defaults, **context} for context in data["projects"]]
+
+
+def dependency_group(context: t.Dict[str, t.Any], defaults: t.Dict[str, t.Any]) -> str:
+    return " | ".join(
+        str(context.get(key, defaults[key])) for key in DEPENDENCY_OPTIONS
+    )
+
+
+def project_label(job: Job) -> str:
+    context = job.context
+    return str(
+        context.get("repo_name")
+        or context.get("project_name")
+        or context.get("project_title")
+        or f"project-{job.index}"
+    )
+
+
+def generate(job: Job, output_dir: Path, env: t.Dict[str, str]) -> Result:
+    """Generate a single project, capturing hooks output into a log file."""
+    label = project_label(job)
+    log = output_dir / ".bulk-logs" / f"{job.index:03d}.log"
+    cmd = [
+        sys.executable,
+        "-m",
+        "cookiecutter",
+        TEMPLATE_ROOT.as_posix(),
+        "--no-input",
+        "--output-dir",
+        output_dir.as_posix(),
+        *(f"{key}={value}" for key, value in job.context.items()),
+    ]
+    start = time.perf_counter()
+    with log.open("wb") as log_file:
+        process = subprocess.run(cmd, env=env, stdout=log_file, stderr=log_file)
+    duration = time.perf_counter() - start
+    if process.returncode:
+        lines = log.read_text(errors="replace").strip().splitlines()
+        return Result(
+            job.index,
+            label,
+            job.group,
+            "failed",
+            duration,
+            log.as_posix(),
+            lines[-1] if lines else f"exit code {process.returncode}",
+        )
+    return Result(job.index, label, job.group, "ok", duration, log.as_posix(), None)
+
+
+def run_batch(
+    jobs: t.List[Job], output_dir: Path, env: t.Dict[str, str], workers: int
+) -> t.List[Result]:
+    """Generate projects, starting the first project of each group first.
+
+    Remaining projects of a group are submitted once the first one is done,
+    whatever its outcome, so that they benefit from caches it populated.
+    """
+    leaders: t.Dict[str, Job] = {}
+    followers: t.Dict[str, t.List[Job]] = {}
+    for job in jobs:
+        if job.group in leaders:
+            followers[job.group].append(job)
+        else:
+            leaders[job.group] = job
+            followers[job.group] = []
+    results: t.List[Result] = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = {
+            executor.submit(generate, job, output_dir, env): job
+            for job in leaders.values()
+        }
+        while pending:
+            done, _ = concurrent.futures.wait(
+                pending, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            for future in done:
+                job = pending.pop(future)
+                result = future.result()
+                results.append(result)
+                print(
+                    f"[{len(results)}/{len(jobs)}] {result.project}: {result.status}"
+                    f" ({result.duration:.1f}s)",
+                    file=sys.stderr,
+                )
+                if job is leaders[job.group]:
+                    for follower in followers[job.group]:
+                        pending[
+                            executor.submit(generate, follower, output_dir, env)
+                        ] = follower
+    return sorted(results, key=lambda result: result.index)
+
+
+def main(args: t.Optional[t.Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("manifest", type=Path, help="JSON manifest of project contexts")
+    parser.add_argument(
+        "-o",
+        "--output-dir",
+        type=Path,
+        default=Path("."),
+        help="Directory into which projects are generated",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Number of projects generated concurrently (number of CPUs by default)",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        type=Path,
+        help="Directory holding caches shared by projects (user cache by default)",
+    )
+    options = parser.parse_args(args)
+
+    defaults = template_defaults()
+    jobs: t.List[Job] = []
+    results: t.List[Result] = []
+    for index, context in enumerate(read_manifest(options.manifest)):
+        unknown = sorted(set(context) - set(defaults))
+        job = Job(index, context, dependency_group(context, defaults))
+        if unknown:
+            results.append(
+                Result(
+                    index,
+                    project_label(job),
+                    job.group,
+                    "invalid",
+                    0.0,
+                    None,
+                    f"Unknown keys: {', '.join(unknown)}",
+                )
+            )
+        else:
+            jobs.append(job)
+
+    output_dir = options.output_dir.resolve()
+    output_dir.joinpath(".bulk-logs").mkdir(parents=True, exist_ok=True)
+    env = dict(os.environ)
+    if options.cache_dir:
+        cache_dir = options.cache_dir.resolve()
+        env.update(
+            TEMPLATE_WHEELHOUSE=(cache_dir / "wheelhouse").as_posix(),
+            PIP_CACHE_DIR=(cache_dir / "pip").as_posix(),
+            TASKS_CACHE_DIR=(cache_dir / "invoke-tasks").as_posix(),
+        )
+    # Offline mode would fail projects generated before their group leader
+    env.pop("TEMPLATE_OFFLINE", None)
+
+    start = time.perf_counter()
+    results = sorted(
+        results + run_batch(jobs, output_dir, env, max(options.jobs, 1)),
+        key=lambda result: result.index,
+    )
+    total = time.perf_counter() - start
+
+    print(f"\n{'Project':<40}{'Status':>10}{'Duration':>10}")
+    for result in results:
+        print(f"{result.project:<40}{result.status:>10}{result.duration:>9.1f}s")
+    print(f"{'Total':<40}{'':>10}{total:>9.1f}s")
+    failures = [result for result in results if result.status != "ok"]
+    for result in failures:
+        print(f"\n{result.project} {result.status}: {result.error}", file=sys.stderr)
+        if result.log:
+            print(f"  See {result.log}", file=sys.stderr)
+    report = output_dir / "bulk-report.json"
+    report.write_text(
+        json.dumps(
+            {
+                "total": round(total, 3),
+                "projects": [
+                    {**result._asdict(), "duration": round(result.duration, 3)}
+                    for result in results
+                ],
+            },
+            indent=2,
+        )
+    )
+    print(f"Report written to {report}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
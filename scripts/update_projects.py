@@ -0,0 +1,425 @@
+#!/usr/bin/env python3
+"""Update generated projects with changes made to the template since their generation.
+
+Each project records in .cookiecutter.json the context and the template commit
+it was rendered from. For each project, the template is rendered twice with the
+recorded context: once at the recorded commit (base) and once at the target
+revision. Changes between both renders are then merged into project files with a
+three-way merge (git merge-file), so that changes made within project are kept.
+
+Projects are processed concurrently and are never modified unless --apply is
+used. For each project, the report directory receives:
+
+- <project>.patch: changes which merged cleanly (apply with `git apply`)
+- <project>.conflicts: files which could not be merged, with conflict markers
+
+A summary of all projects is written to update-report.json.
+"""
+
+import argparse
+import concurrent.futures
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tarfile
+import tempfile
+import threading
+import time
+import typing as t
+from pathlib import Path
+
+TEMPLATE_ROOT = Path(__file__).parent.parent
+CONTEXT_FILE = ".cookiecutter.json"
+
+
+class UpdateError(Exception):
+    """Raised when a project cannot be updated."""
+
+
+class Conflict(t.NamedTuple):
+    path: str
+    reason: str
+    content: t.Optional[str]
+
+
+class Report(t.NamedTuple):
+    project: str
+    path: str
+    status: str
+    base: t.Optional[str]
+    changed: t.List[str]
+    conflicts: t.List[str]
+    duration: float
+    error: t.Optional[str]
+
+
+class TemplateCache:
+    """Extract template files at given commits, once per commit."""
+
+    def __init__(self, template: Path, root: Path) -> None:
+        self.template = template
+        self.root = root
+        self._locks: t.Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def resolve(self, revision: str) -> str:
+        process = subprocess.run(
+            ["git", "-C", str(self.template), "rev-parse", "--verify", "-q"]
+            + [f"{revision}^{{commit}}"],
+            stdout=subprocess.PIPE,
+            text=True,
+        )
+        if process.returncode != 0:
+            raise UpdateError(f"Unknown template revision: {revision}")
+        return process.stdout.strip()
+
+    def extract(self, commit: str) -> Path:
+        with self._lock:
+            lock = self._locks.setdefault(commit, threading.Lock())
+        with lock:
+            directory = self.root / commit
+            if directory.is_dir():
+                return directory
+            archive = subprocess.run(
+                ["git", "-C", str(self.template), "archive", "--format=tar", commit],
+                stdout=subprocess.PIPE,
+                check=True,
+            ).stdout
+            tmpdir = Path(tempfile.mkdtemp(dir=self.root))
+            with tarfile.open(fileobj=io.BytesIO(archive)) as tar:
+                tar.extractall(tmpdir)
+            hook = tmpdir / "hooks" / "post_gen_project.py"
+            if "TEMPLATE_RENDER_ONLY" not in hook.read_text():
+                raise UpdateError(f"Template at {commit} cannot be rendered only")
+            tmpdir.rename(directory)
+            return directory
+
+
+def render(
+    template: Path, commit: str, context: t.Dict[str, t.Any], output: Path
+) -> Path:
+    """Render template with recorded context, without installing project."""
+    env = {**os.environ, "TEMPLATE_RENDER_ONLY": "1", "TEMPLATE_COMMIT": commit}
+    cmd = [
+        sys.executable,
+        "-m",
+        "cookiecutter",
+        template.as_posix(),
+        "--no-input",
+        "--output-dir",
+        output.as_posix(),
+        *(f"{key}={value}" for key, value in context.items()),
+    ]
+    process = subprocess.run(
+        cmd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True
+    )
+    if process.returncode != 0:
+        raise UpdateError(f"Rendering template at {commit} failed:\n{process.stderr}")
+    return output / context["repo_name"]
+
+
+def read_files(root: Path) -> t.Dict[str, bytes]:
+    return {
+        path.relative_to(root).as_posix(): path.read_bytes()
+        for path in root.rglob("*")
+        if path.is_file()
+    }
+
+
+def read_file(path: Path) -> t.Optional[bytes]:
+    return path.read_bytes() if path.is_file() else None
+
+
+def is_binary(content: bytes) -> bool:
+    """Guess whether content is binary the way git does (NUL byte in first 8000)."""
+    return b"\0" in content[:8000]
+
+
+def merge_file(
+    current: bytes, base: bytes, other: bytes, workdir: Path
+) -> t.Tuple[bytes, bool]:
+    """Merge changes from base to other into current and return (content, clean).
+
+    Exit code of git merge-file is the number of conflicts (at most 127), greater
+    codes report an error.
+    """
+    workdir.mkdir(parents=True, exist_ok=True)
+    files = []
+    for name, content in (("current", current), ("base", base), ("other", other)):
+        path = workdir / name
+        path.write_bytes(content)
+        files.append(path.as_posix())
+    process = subprocess.run(
+        ["git", "merge-file", "-p", "-L", "project", "-L", "base", "-L", "template"]
+        + files,
+        stdout=subprocess.PIPE,
+    )
+    if not 0 <= process.returncode <= 127:
+        raise UpdateError(f"git merge-file failed with code {process.returncode}")
+    return process.stdout, process.returncode == 0
+
+
+def three_way_merge(
+    project: Path, base: Path, new: Path, workdir: Path
+) -> t.Tuple[t.Dict[str, t.Optional[bytes]], t.List[Conflict]]:
+    """Merge template changes into project files.
+
+    Return the new content of each file changed by the merge (None when the file
+    must be removed), along with conflicts.
+    """
+    base_files = read_files(base)
+    new_files = read_files(new)
+    changes: t.Dict[str, t.Optional[bytes]] = {}
+    conflicts: t.List[Conflict] = []
+    for index, name in enumerate(sorted(set(base_files) | set(new_files))):
+        before = base_files.get(name)
+        after = new_files.get(name)
+        current = read_file(project / name)
+        if before == after or current == after:
+            continue
+        if current == before:
+            changes[name] = after
+        elif before is None:
+            conflicts.append(Conflict(name, "added by template and by project", None))
+        elif after is None:
+            conflicts.append(
+                Conflict(name, "removed by template, changed by project", None)
+            )
+        elif current is None:
+            conflicts.append(
+                Conflict(name, "changed by template, removed by project", None)
+            )
+        elif any(is_binary(content) for content in (current, before, after)):
+            conflicts.append(
+                Conflict(name, "binary file changed by template and by project", None)
+            )
+        else:
+            merged, clean = merge_file(current, before, after, workdir / str(index))
+            if clean:
+                changes[name] = merged
+            else:
+                conflicts.append(
+                    Conflict(
+                        name,
+                        "changed by template and by project",
+                        merged.decode(errors="replace"),
+                    )
+                )
+    return changes, conflicts
+
+
+def make_patch(
+    project: Path, new: Path, changes: t.Dict[str, t.Optional[bytes]], workdir: Path
+) -> str:
+    """Build a git patch from current project files to changed files."""
+    for side in ("a", "b"):
+        workdir.joinpath(side).mkdir(parents=True)
+    for name, content in changes.items():
+        source = project / name
+        if source.is_file():
+            target = workdir / "a" / name
+            target.parent.mkdir(parents=True, exist_ok=True)
+            shutil.copy2(source, target)
+        if content is not None:
+            target = workdir / "b" / name
+            target.parent.mkdir(parents=True, exist_ok=True)
+            target.write_bytes(content)
+            # Keep file mode from template (executable scripts)
+            shutil.copymode(new / name, target)
+    # Without prefix, paths relative to a/ and b/ directories match git default prefixes
+    process = subprocess.run(
+        ["git", "diff", "--no-index", "--no-prefix", "--binary", "a", "b"],
+        cwd=workdir,
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    if process.returncode > 1:
+        raise UpdateError("git diff failed")
+    return process.stdout
+
+
+def update_project(
+    project: Path,
+    templates: TemplateCache,
+    target: str,
+    base_revision: t.Optional[str],
+    report_dir: Path,
+    apply: bool,
+) -> Report:
+    start = time.perf_counter()
+    base: t.Optional[str] = None
+    try:
+        context_file = project / CONTEXT_FILE
+        if not context_file.is_file():
+            raise UpdateError(f"{CONTEXT_FILE} not found")
+        record = json.loads(context_file.read_text())
+        revision = base_revision or record.get("commit")
+        if not revision:
+            raise UpdateError("Template commit is unknown, use --base option")
+        base = templates.resolve(revision)
+        name = record["context"]["repo_name"]
+        for suffix in (".patch", ".conflicts"):
+            report_dir.joinpath(name + suffix).unlink(missing_ok=True)
+        if base == target:
+            return Report(
+                name,
+                str(project),
+                "up-to-date",
+                base,
+                [],
+                [],
+                time.perf_counter() - start,
+                None,
+            )
+        with tempfile.TemporaryDirectory(prefix="template-update-") as tmpdir:
+            workdir = Path(tmpdir)
+            context = record["context"]
+            base_render = render(
+                templates.extract(base), base, context, workdir / "base"
+            )
+            new_render = render(
+                templates.extract(target), target, context, workdir / "new"
+            )
+            changes, conflicts = three_way_merge(
+                project, base_render, new_render, workdir / "merge"
+            )
+            patch = make_patch(project, new_render, changes, workdir / "patch")
+        if patch:
+            report_dir.joinpath(f"{name}.patch").write_text(patch)
+        if conflicts:
+            report_dir.joinpath(f"{name}.conflicts").write_text(
+                "".join(
+                    f"=== {conflict.path}: {conflict.reason}\n{conflict.content or ''}\n"
+                    for conflict in conflicts
+                )
+            )
+            status = "conflicts"
+        elif patch:
+            status = "updated"
+            if apply:
+                subprocess.run(
+                    ["git", "apply", report_dir.joinpath(f"{name}.patch").resolve()],
+                    cwd=project,
+                    check=True,
+                )
+                status = "applied"
+        else:
+            status = "up-to-date"
+        return Report(
+            name,
+            str(project),
+            status,
+            base,
+            sorted(changes),
+            [conflict.path for conflict in conflicts],
+            time.perf_counter() - start,
+            None,
+        )
+    except Exception as exc:
+        # A failure of a project never stops the batch
+        return Report(
+            project.name,
+            str(project),
+            "error",
+            base,
+            [],
+            [],
+            time.perf_counter() - start,
+            str(exc),
+        )
+
+
+def main(args: t.Optional[t.Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("projects", nargs="+", type=Path, help="Project directories")
+    parser.add_argument(
+        "--template",
+        type=Path,
+        default=TEMPLATE_ROOT,
+        help="Template git repository (this repository by default)",
+    )
+    parser.add_argument(
+        "--ref", default="HEAD", help="Template revision to update projects to"
+    )
+    parser.add_argument(
+        "--base",
+        help="Template revision projects were generated from (overrides recorded commit)",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Number of projects updated concurrently (number of CPUs by default)",
+    )
+    parser.add_argument(
+        "--report-dir",
+        type=Path,
+        default=Path("template-update"),
+        help="Directory receiving patches, conflicts and summary",
+    )
+    parser.add_argument(
+        "--apply",
+        action="store_true",
+        help="Apply patches to projects which have no conflict",
+    )
+    options = parser.parse_args(args)
+
+    report_dir = options.report_dir.resolve()
+    report_dir.mkdir(parents=True, exist_ok=True)
+    start = time.perf_counter()
+    with tempfile.TemporaryDirectory(prefix="template-revisions-") as tmpdir:
+        templates = TemplateCache(options.template.resolve(), Path(tmpdir))
+        try:
+            target = templates.resolve(options.ref)
+        except UpdateError as exc:
+            parser.error(str(exc))
+        with concurrent.futures.ThreadPoolExecutor(max(options.jobs, 1)) as executor:
+            reports = list(
+                executor.map(
+                    lambda project: update_project(
+                        project.resolve(),
+                        templates,
+                        target,
+                        options.base,
+                        report_dir,
+                        options.apply,
+                    ),
+                    options.projects,
+                )
+            )
+    total = time.perf_counter() - start
+
+    print(f"{'Project':<40}{'Status':>12}{'Changed':>10}{'Conflicts':>10}")
+    for report in reports:
+        print(
+            f"{report.project:<40}{report.status:>12}"
+            f"{len(report.changed):>10}{len(report.conflicts):>10}"
+        )
+        if report.error:
+            print(f"  {report.error}", file=sys.stderr)
+    print(f"Updated {len(reports)} projects to {target[:12]} in {total:.1f}s")
+    report_dir.joinpath("update-report.json").write_text(
+        json.dumps(
+            {
+                "target": target,
+                "total": round(total, 3),
+                "projects": [
+                    {**report._asdict(), "duration": round(report.duration, 3)}
+                    for report in reports
+                ],
+            },
+            indent=2,
+        )
+    )
+    print(f"Patches and conflicts written to {report_dir}", file=sys.stderr)
+    return (
+        1 if any(report.status in ("conflicts", "error") for report in reports) else 0
+    )
+
+
+if __name__ == "__main__":
+    sys.exit(main())
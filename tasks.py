@@ -1,12 +1,187 @@
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import typing as t
+from pathlib import Path
+from shlex import quote
+
 from invoke import Context, task
 
+try:
+    import tomllib
+except ModuleNotFoundError:  # Python < 3.11
+    import tomli as tomllib  # type: ignore[no-redef]
+
+SANDBOX_DIR = Path("sandbox")
+# Digests of files rendered into sandbox projects by previous runs
+MANIFEST_DIR = SANDBOX_DIR / ".manifests"
+# Interpreter of sandbox virtual environments, relative to the project
+if os.name == "nt":
+    VENV_PYTHON = Path(".venv", "Scripts", "python.exe")
+else:
+    VENV_PYTHON = Path(".venv", "bin", "python")
+
+
+def render_template(output_dir: Path) -> Path:
+    """Render template without installing project and return project directory."""
+    from cookiecutter.main import cookiecutter
+
+    # Hooks inherit environment, post-generation hook then only prunes CLI files
+    os.environ["TEMPLATE_RENDER_ONLY"] = "1"
+    try:
+        return Path(cookiecutter(".", no_input=True, output_dir=output_dir.as_posix()))
+    finally:
+        del os.environ["TEMPLATE_RENDER_ONLY"]
+
+
+def file_digests(root: Path) -> t.Dict[str, str]:
+    return {
+        path.relative_to(root).as_posix(): hashlib.sha256(path.read_bytes()).hexdigest()
+        for path in sorted(root.rglob("*"))
+        if path.is_file()
+    }
+
+
+def dependencies_digest(pyproject: Path) -> str:
+    """Digest of pyproject.toml sections which affect project virtual environment."""
+    data = tomllib.loads(pyproject.read_text())
+    project = data.get("project", {})
+    dependencies = {
+        "build-system": data.get("build-system", {}),
+        "dependencies": project.get("dependencies", []),
+        "optional-dependencies": project.get("optional-dependencies", {}),
+    }
+    return hashlib.sha256(json.dumps(dependencies, sort_keys=True).encode()).hexdigest()
+
+
+def sync_project(
+    rendered: Path, project: Path, previous: t.Dict[str, str]
+) -> t.List[str]:
+    """Copy files whose rendered content changed since previous render.
+
+    Other files are left untouched (as well as their modification times), so
+    files modified by hooks (such as requirements.txt) or by hand are kept as
+    long as their template does not change. Files which are no longer rendered
+    are removed.
+    """
+    changed: t.List[str] = []
+    digests = file_digests(rendered)
+    for name, digest in digests.items():
+        target = project / name
+        if previous.get(name) == digest and target.exists():
+            continue
+        target.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copyfile(rendered / name, target)
+        shutil.copymode(rendered / name, target)
+        changed.append(name)
+    for name in sorted(set(previous) - set(digests)):
+        project.joinpath(name).unlink(missing_ok=True)
+        changed.append(name)
+    return changed
+
+
+@task
+def test(c: Context, workers: str = "auto", render_only: bool = False):
+    # Each command line interface variant (or options combination when rendering
+    # only) runs on its own worker. Render and script tests do not install projects.
+    tests = "tests/render/ tests/scripts/" if render_only else "tests/"
+    c.run(
+        "PIP_CONFIG_FILE=/dev/null pytest -x -vvvv"
+        f" -n {workers} --dist loadgroup {tests}"
+    )
+
+
+@task(iterable=["cli", "config"])
+def bench(
+    c: Context,
+    cli=None,
+    config=None,
+    repeat: int = 3,
+    record: bool = False,
+    baseline: str = "",
+    threshold: float = 0.2,
+):
+    """Benchmark project generation and compare against recorded baseline."""
+    cmd = f"PIP_CONFIG_FILE=/dev/null python benchmarks/generation.py -r {repeat}"
+    cmd += "".join(f" --cli {quote(option)}" for option in cli or [])
+    cmd += "".join(f" --config {option}" for option in config or [])
+    cmd += f" --threshold {threshold}"
+    if baseline:
+        cmd += f" --baseline {baseline}"
+    if record:
+        cmd += " --record"
+    c.run(cmd, pty=True)
 
 
 @task
-def test(c: Context):
-    c.run("PIP_CONFIG_FILE=/dev/null pytest -x -vvvv -s tests/")
+def bulk(
+    c: Context, manifest: str, output_dir: str = ".", jobs: int = 0, cache_dir=None
+):
+    """Generate projects listed in a JSON manifest of cookiecutter contexts."""
+    cmd = f"python scripts/bulk_generate.py {quote(manifest)} -o {quote(output_dir)}"
+    if jobs:
+        cmd += f" -j {jobs}"
+    if cache_dir:
+        cmd += f" --cache-dir {quote(cache_dir)}"
+    c.run(cmd, pty=True)
+
+
+@task(iterable=["project"])
+def update(c: Context, project, ref: str = "HEAD", jobs: int = 0, apply: bool = False):
+    """Merge template changes into generated projects (patches are written by default)."""
+    cmd = "python scripts/update_projects.py"
+    cmd += "".join(f" {quote(path)}" for path in project)
+    cmd += f" --ref {quote(ref)}"
+    if jobs:
+        cmd += f" -j {jobs}"
+    if apply:
+        cmd += " --apply"
+    c.run(cmd, pty=True)
 
 
 @task
-def default(c: Context):
-    c.run("PIP_CONFIG_FILE=/dev/null cookiecutter . --output-dir sandbox/ --no-input")
+def default(c: Context, clean: bool = False):
+    """Generate sandbox project, or update it with template changes when it exists.
+
+    Only files whose rendered content changed are written, and the virtual
+    environment is updated only when pyproject.toml dependencies changed.
+    """
+    start = time.perf_counter()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        rendered = render_template(Path(tmpdir))
+        project = SANDBOX_DIR / rendered.name
+        manifest_file = MANIFEST_DIR / f"{rendered.name}.json"
+        manifest = {
+            "dependencies": dependencies_digest(rendered / "pyproject.toml"),
+            "files": file_digests(rendered),
+        }
+        if clean or not project.is_dir():
+            shutil.rmtree(project, ignore_errors=True)
+            c.run(
+                "PIP_CONFIG_FILE=/dev/null cookiecutter . --output-dir sandbox/ --no-input"
+            )
+        else:
+            # Projects generated without manifest are entirely re-rendered
+            previous = (
+                json.loads(manifest_file.read_text())
+                if manifest_file.is_file()
+                else {"dependencies": None, "files": {}}
+            )
+            changed = sync_project(rendered, project, previous["files"])
+            for name in changed:
+                print(f"Updated {project / name}")
+            if manifest["dependencies"] != previous["dependencies"]:
+                print("Dependencies changed, updating virtual environment")
+                with c.cd(project.as_posix()):
+                    c.run(f"{sys.executable} scripts/install.py --all")
+                    c.run(f"{quote(str(VENV_PYTHON))} -m invoke requirements")
+            print(
+                f"Sandbox updated in {time.perf_counter() - start:.2f}s"
+                f" ({len(changed)} files changed)"
+            )
+    MANIFEST_DIR.mkdir(parents=True, exist_ok=True)
+    manifest_file.write_text(json.dumps(manifest, indent=2))
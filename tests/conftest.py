@@ -0,0 +1,33 @@
+import typing as t
+
+import pytest
+
+# Fixtures providing the options of generated or rendered projects. Tests using
+# the same project must run on the same worker so that it is created only once.
+PROJECT_FIXTURES = ("options", "cli_option")
+
+
+def pytest_configure(config: pytest.Config) -> None:
+    # Marker is registered by pytest-xdist when installed
+    config.addinivalue_line("markers", "xdist_group(name): run tests on same worker")
+
+
+def xdist_group_name(value: t.Any) -> str:
+    if isinstance(value, dict):
+        return "-".join(str(option) for option in value.values())
+    return str(value)
+
+
+def pytest_collection_modifyitems(items: t.List[pytest.Item]) -> None:
+    """Run all tests of a project on the same worker when using pytest-xdist.
+
+    Projects are generated once per cli option (or rendered once per options
+    combination), so tests must be distributed with "--dist loadgroup" in order
+    to create each project on its own worker only.
+    """
+    for item in items:
+        callspec = getattr(item, "callspec", None)
+        for name in PROJECT_FIXTURES:
+            if callspec and name in callspec.params:
+                group = xdist_group_name(callspec.params[name])
+                item.add_marker(pytest.mark.xdist_group(group))
@@ -1,11 +1,20 @@
-import subprocess
+import shutil
 import tempfile
 import typing as t
 from pathlib import Path
 
 import pytest
 
-from .utils import ProjectValidator
+from .utils import (
+    ProjectValidator,
+    clone_project,
+    generate_project,
+    project_cache_key,
+    relocate_project,
+    template_digest,
+)
+
+TEMPLATE_ROOT = Path(__file__).parent.parent.parent
 
 
 @pytest.fixture(scope="module")
@@ -34,26 +43,69 @@ def cli_option(request):
     return request.param
 
 
+@pytest.fixture(scope="session")
+def wheelhouse(request: pytest.FixtureRequest) -> Path:
+    """Wheel cache shared by projects generated during tests"""
+    # Kept along with cached projects since offline generation relies on it
+    return Path(request.config.cache.mkdir("wheelhouse"))
+
+
+@pytest.fixture(scope="session")
+def template_key() -> str:
+    """Digest of template files used to invalidate cached projects"""
+    return template_digest(TEMPLATE_ROOT)
+
+
 @pytest.fixture(scope="module")
 def project(
-    project_name: str, project_version: str, cli_option: str
+    project_name: str,
+    project_version: str,
+    cli_option: str,
+    wheelhouse: Path,
+    template_key: str,
+    request: pytest.FixtureRequest,
+    tmp_path_factory: pytest.TempPathFactory,
 ) -> t.Iterator[Path]:
-    """Create a project and install it in order to run unit tests."""
-    with tempfile.TemporaryDirectory() as directory:
-        subprocess.check_call(
-            [
-                "cookiecutter",
-                ".",
-                "--no-input",
-                "--output-dir",
-                directory,
-                f"command_line_interface={cli_option}",
-                f"project_name={project_name}",
-                f"version={project_version}",
-            ]
+    """Create a project and install it in order to run unit tests.
+
+    Generated projects are cached (run pytest with --cache-clear to drop them)
+    until template files or options change, and each test module receives its
+    own copy. Projects cached from previous template files are removed when a
+    new project is cached.
+    """
+    options = [
+        f"command_line_interface={cli_option}",
+        f"project_name={project_name}",
+        f"version={project_version}",
+    ]
+    projects = Path(request.config.cache.mkdir("projects"))
+    # Projects generated from the same template files share a directory
+    cache = projects / template_key[:16]
+    cached = cache / project_cache_key(template_key, *options)
+    if not cached.is_dir():
+        # Projects generated from other template files are never used again
+        for entry in projects.iterdir():
+            if entry != cache:
+                shutil.rmtree(entry, ignore_errors=True)
+        cache.mkdir(exist_ok=True)
+        # Generate in a temporary directory so that cache never holds partial projects
+        tmpdir = Path(tempfile.mkdtemp(dir=cache, prefix=".tmp-"))
+        generate_project(
+            tmpdir.as_posix(), *options, TEMPLATE_WHEELHOUSE=wheelhouse.as_posix()
+        )
+        relocate_project(
+            tmpdir / project_name, tmpdir / project_name, cached / project_name
         )
-        output = Path(directory) / project_name
-        yield output
+        try:
+            tmpdir.rename(cached)
+        except OSError:
+            # Project was cached concurrently by another worker
+            shutil.rmtree(tmpdir, ignore_errors=True)
+    # Temporary directories are distinct for each pytest-xdist worker
+    directory = tmp_path_factory.mktemp("project")
+    clone_project(cached / project_name, directory / project_name)
+    yield directory / project_name
+    shutil.rmtree(directory, ignore_errors=True)
 
 
 @pytest.fixture(scope="module")
@@ -0,0 +1,44 @@
+import json
+import os
+import pathlib
+import subprocess
+import sys
+
+
+def test_projects_of_same_group_get_their_own_requirements(
+    tmp_path: pathlib.Path, wheelhouse: pathlib.Path
+):
+    # Both projects install the same dependencies, second one reuses caches
+    names = ["bulk-orders", "bulk-billing"]
+    manifest = tmp_path / "manifest.json"
+    manifest.write_text(
+        json.dumps(
+            {
+                "defaults": {
+                    "command_line_interface": "Click",
+                    "init_git_repo": False,
+                },
+                "projects": [{"project_name": name} for name in names],
+            }
+        )
+    )
+    output_dir = tmp_path / "projects"
+    subprocess.check_call(
+        [
+            sys.executable,
+            "scripts/bulk_generate.py",
+            manifest.as_posix(),
+            "--output-dir",
+            output_dir.as_posix(),
+            "--jobs",
+            "2",
+        ],
+        env={**os.environ, "TEMPLATE_WHEELHOUSE": wheelhouse.as_posix()},
+    )
+    report = json.loads(output_dir.joinpath("bulk-report.json").read_text())
+    assert [project["status"] for project in report["projects"]] == ["ok", "ok"]
+    # Requirements annotations must name the project they belong to
+    for name, other in (names, names[::-1]):
+        requirements = output_dir.joinpath(name, "requirements.txt").read_text()
+        assert f"# via {name} (pyproject.toml)" in requirements
+        assert f"{other} (pyproject.toml)" not in requirements
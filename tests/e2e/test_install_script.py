@@ -0,0 +1,180 @@
+import errno
+import json
+import os
+import pathlib
+import subprocess
+import sys
+import types
+import typing as t
+
+import pytest
+
+from .utils import load_module
+
+
+@pytest.fixture
+def install(
+    project: pathlib.Path, tmp_path: pathlib.Path, monkeypatch: pytest.MonkeyPatch
+) -> types.ModuleType:
+    """Install script of project, managing a small fake virtual environment"""
+    module = load_module(project / "scripts" / "install.py")
+    venv = tmp_path / "venv"
+    monkeypatch.setattr(module, "VENV_DIR", venv)
+    monkeypatch.setattr(module, "VENV_LIB", venv / "lib")
+    site = venv / "lib" / "site-packages"
+    site.joinpath("__pycache__").mkdir(parents=True)
+    site.joinpath("first.py").write_text("VALUE = 1\n")
+    site.joinpath("second.py").write_text("VALUE = 1\n")
+    site.joinpath("empty.py").write_text("")
+    site.joinpath("__pycache__", "first.pyc").write_bytes(b"bytecode")
+    site.joinpath("script").write_text("#!/bin/sh\n")
+    site.joinpath("script").chmod(0o755)
+    return module
+
+
+def site_file(install: types.ModuleType, name: str) -> pathlib.Path:
+    return t.cast(pathlib.Path, install.VENV_LIB / "site-packages" / name)
+
+
+def store_objects(store: pathlib.Path) -> t.List[pathlib.Path]:
+    return sorted(store.glob("objects/*/*"))
+
+
+def count_digests(
+    install: types.ModuleType, monkeypatch: pytest.MonkeyPatch
+) -> t.List[pathlib.Path]:
+    """Record files hashed by install script"""
+    hashed: t.List[pathlib.Path] = []
+    file_digest = install.file_digest
+
+    def digest(path: pathlib.Path, mode: int) -> str:
+        hashed.append(path)
+        return t.cast(str, file_digest(path, mode))
+
+    monkeypatch.setattr(install, "file_digest", digest)
+    return hashed
+
+
+def test_installed_files_are_linked_to_store(
+    install: types.ModuleType, tmp_path: pathlib.Path, monkeypatch: pytest.MonkeyPatch
+):
+    store = tmp_path / "store"
+    install.link_to_store(store)
+    first, second = site_file(install, "first.py"), site_file(install, "second.py")
+    # Identical files share a single store object, executable files are stored apart
+    assert first.stat().st_ino == second.stat().st_ino
+    assert first.stat().st_nlink == 3
+    assert len(store_objects(store)) == 2
+    assert [path.name[-2:] for path in store_objects(store)].count(".x") == 1
+    # Empty files and bytecode are never linked
+    assert site_file(install, "empty.py").stat().st_nlink == 1
+    assert site_file(install, "__pycache__/first.pyc").stat().st_nlink == 1
+    # Only files replaced since last run are hashed again
+    hashed = count_digests(install, monkeypatch)
+    install.link_to_store(store)
+    assert hashed == []
+    second.unlink()
+    second.write_text("VALUE = 2\n")
+    install.link_to_store(store)
+    assert hashed == [second]
+    assert len(store_objects(store)) == 3
+
+
+@pytest.mark.parametrize("code", [errno.EXDEV, errno.EPERM])
+def test_files_are_kept_when_links_are_not_possible(
+    install: types.ModuleType,
+    tmp_path: pathlib.Path,
+    monkeypatch: pytest.MonkeyPatch,
+    code: int,
+):
+    def link(source: str, target: str) -> None:
+        raise OSError(code, os.strerror(code))
+
+    # Store located on another filesystem, or hard links not permitted (in which
+    # case files are cloned when filesystem supports it)
+    monkeypatch.setattr(install.os, "link", link)
+    store = tmp_path / "store"
+    install.link_to_store(store)
+    first = site_file(install, "first.py")
+    assert first.read_text() == "VALUE = 1\n"
+    assert first.stat().st_nlink == 1
+    # Store never holds partial objects
+    for path in store_objects(store):
+        assert path.stat().st_size > 0
+    # Files kept as private copies are not hashed again
+    hashed = count_digests(install, monkeypatch)
+    install.link_to_store(store)
+    assert hashed == []
+
+
+def test_unused_files_are_removed_from_store(
+    project: pathlib.Path, install: types.ModuleType, tmp_path: pathlib.Path
+):
+    store = tmp_path / "store"
+    install.link_to_store(store)
+    used = store_objects(store)
+    # Object only used by a virtual environment which no longer exists
+    unused = store / "objects" / "00" / "unused"
+    unused.parent.mkdir(exist_ok=True)
+    unused.write_text("unused")
+    removed = store / "venvs" / "removed.json"
+    removed.write_text('{"venv": "/removed/.venv", "files": {"lib/x": "00unused"}}')
+    output = subprocess.check_output(
+        [sys.executable, "scripts/install.py", "--gc-store", "--store", store],
+        cwd=project,
+        text=True,
+    )
+    assert output == f"Removed 1 unused files from {store}\n"
+    assert store_objects(store) == used
+    assert not removed.exists()
+
+
+def run_install_script(
+    project: pathlib.Path, timings: pathlib.Path, *args: str
+) -> t.Tuple[str, t.List[str]]:
+    """Run install script and return its output along with phases it ran"""
+    output = subprocess.check_output(
+        [sys.executable, "scripts/install.py", "--timings", timings, *args],
+        cwd=project,
+        text=True,
+    )
+    return output, [timing["phase"] for timing in json.loads(timings.read_text())]
+
+
+def test_installation_is_skipped_when_inputs_did_not_change(
+    project: pathlib.Path, tmp_path: pathlib.Path
+):
+    # Project was installed with all extras by post-generation hook
+    timings = tmp_path / "timings.json"
+    output, phases = run_install_script(project, timings, "--all")
+    assert output.splitlines() == [
+        "Virtual environment is up to date",
+        "Project installation is up to date",
+    ]
+    assert phases == []
+    # Installing fewer extras than previously installed does nothing
+    output, phases = run_install_script(project, timings, "--no-build")
+    assert "Project installation is up to date" in output
+    assert phases == []
+
+
+def test_project_is_installed_again_when_inputs_change(
+    project: pathlib.Path, tmp_path: pathlib.Path
+):
+    options = ("--no-virtualenv", "--all")
+    timings = tmp_path / "timings.json"
+    pyproject = project / "pyproject.toml"
+    content = pyproject.read_text()
+    pyproject.write_text(content + "\n# Changed\n")
+    try:
+        output, phases = run_install_script(project, timings, *options)
+        assert "Installing project (changed: pyproject.toml)" in output
+        assert phases == ["install[build,dev,docs]"]
+    finally:
+        pyproject.write_text(content)
+    output, phases = run_install_script(project, timings, *options, "-e", "extra")
+    assert "Installing project (changed: extras, pyproject.toml)" in output
+    assert phases == ["install[build,dev,docs,extra]"]
+    output, phases = run_install_script(project, timings, *options)
+    assert "Project installation is up to date" in output
+    assert phases == []
@@ -1,7 +1,26 @@
+import contextlib
+import io
+import json
+import os
 import pathlib
+import re
+import shutil
+import sqlite3
+import subprocess
 import tempfile
+import time
+import typing as t
 
-from .utils import NEXT_PORT, ProjectValidator
+from invoke import Context
+
+from .utils import (
+    ProjectValidator,
+    free_port,
+    generate_project,
+    inv,
+    load_tasks_module,
+    python,
+)
 
 
 def test_project_layout(project_slug: str, validator: ProjectValidator):
@@ -46,6 +65,122 @@ def test_project_layout(project_slug: str, validator: ProjectValidator):
     validator.expect_file_exists("src", project_slug, "__about__.py")
 
 
+def test_generation_timings_are_recorded(validator: ProjectValidator):
+    # Expect timings report to be written but not committed
+    validator.expect_file_exists("generation-timings.json")
+    validator.expect_git_output(
+        "check-ignore", "generation-timings.json", match="generation-timings.json"
+    )
+    report = json.loads(
+        validator.project.joinpath("generation-timings.json").read_text()
+    )
+    phases = [phase["phase"] for phase in report["phases"]]
+    for phase in [
+        "prune",
+        "virtualenv",
+        "pip-upgrade",
+        "install[build]",
+        "install[build,dev,docs]",
+        "requirements-cache" if report["wheelhouse"] else "pip-compile",
+        "git-init",
+        "git-add",
+        "git-commit",
+    ]:
+        assert phase in phases, f"Expected phase '{phase}' in {phases}"
+    assert report["total"] >= max(phase["duration"] for phase in report["phases"])
+
+
+def test_git_repository_is_initialized(validator: ProjectValidator):
+    # Expect main and next branches, next being checked out
+    validator.expect_git_output("branch", "--list", match="main\n* next")
+    # Expect a single commit shared by both branches
+    validator.expect_git_output(
+        "log",
+        "--format=%s",
+        "main",
+        match="chore(project): initialize project layout and configured development tools",
+    )
+    validator.expect_git_output("rev-list", "main..next", match="")
+    # Expect generated files (including requirements) to be committed
+    validator.expect_git_output("status", "--porcelain", match="")
+    validator.expect_git_output(
+        "ls-files", "requirements.txt", match="requirements.txt"
+    )
+
+
+def test_project_can_be_generated_offline(
+    project: pathlib.Path,
+    project_name: str,
+    project_version: str,
+    cli_option: str,
+    wheelhouse: pathlib.Path,
+):
+    # Wheel cache was populated when generating project for the first time
+    offline_name = f"{project_name}-offline"
+    with tempfile.TemporaryDirectory(dir=project.parent) as directory:
+        generate_project(
+            directory,
+            f"command_line_interface={cli_option}",
+            f"project_name={offline_name}",
+            f"version={project_version}",
+            TEMPLATE_WHEELHOUSE=wheelhouse.as_posix(),
+            TEMPLATE_OFFLINE="1",
+            # Make sure package index cannot be reached
+            PIP_INDEX_URL="http://127.0.0.1:9/simple",
+            PIP_EXTRA_INDEX_URL="http://127.0.0.1:9/simple",
+        )
+        validator = ProjectValidator(pathlib.Path(directory, offline_name))
+        report = json.loads(
+            validator.project.joinpath("generation-timings.json").read_text()
+        )
+        assert report["wheelhouse"] is not None
+        # Expect same pinned requirements as project generated online
+        requirements = validator.project.joinpath("requirements.txt").read_text()
+        online = project.joinpath("requirements.txt").read_text()
+        # Projects without runtime dependencies hold no annotation
+        if f"# via {project_name} (pyproject.toml)" in online:
+            assert f"# via {offline_name} (pyproject.toml)" in requirements
+        assert f"# via {project_name} (pyproject.toml)" not in requirements
+        assert requirements == online.replace(
+            f"{project_name} (pyproject.toml)", f"{offline_name} (pyproject.toml)"
+        )
+        validator.expect_git_output("status", "--porcelain", match="")
+
+
+def test_offline_generation_fails_early_when_dependencies_changed(
+    project: pathlib.Path, cli_option: str, wheelhouse: pathlib.Path
+):
+    with tempfile.TemporaryDirectory(dir=project.parent) as directory:
+        # Wheel cache entries recorded for other declared dependencies
+        stale = pathlib.Path(directory, "wheelhouse")
+        shutil.copytree(wheelhouse, stale)
+        for index in stale.joinpath("index").glob("*.json"):
+            entry = json.loads(index.read_text())
+            index.write_text(json.dumps({**entry, "spec": "outdated"}))
+        process = subprocess.run(
+            [
+                "cookiecutter",
+                ".",
+                "--no-input",
+                "--output-dir",
+                directory,
+                f"command_line_interface={cli_option}",
+                "project_name=stale-project",
+            ],
+            env={
+                **os.environ,
+                "TEMPLATE_WHEELHOUSE": stale.as_posix(),
+                "TEMPLATE_OFFLINE": "1",
+            },
+            stderr=subprocess.PIPE,
+        )
+        assert process.returncode != 0
+        stderr = process.stderr.decode()
+        assert "Wheel cache does not hold dependencies" in stderr
+        # Pre-generation hook fails before post-generation hook installs anything
+        assert "Found wheel cache" not in stderr
+
+
 def test_pytest_can_be_invoked(validator: ProjectValidator, project_slug: str):
     # Check command that would be executed by "test" task
     validator.expect_dry_run_output("test", match="{python} -m pytest tests/unit/")
@@ -76,6 +211,161 @@ def test_pytest_can_be_invoked(validator: ProjectValidator, project_slug: str):
     validator.expect_file_exists("junit.xml")
 
 
+def test_affected_tests_can_be_selected(validator: ProjectValidator):
+    # Coverage data recorded by "test --cov" maps tests to source files
+    validator.expect_task_successful("test", "--cov")
+    validator.expect_file_exists(".test-impact.json")
+    validator.expect_dry_run_output(
+        "test", "--affected", match="No test affected by changes"
+    )
+    module = validator.project / "tests" / "unit" / "test_affected.py"
+    module.write_text("def test_affected():\n    pass\n")
+    try:
+        validator.expect_dry_run_output(
+            "test",
+            "--affected",
+            match="{python} -m pytest tests/unit/test_affected.py",
+        )
+    finally:
+        module.unlink()
+
+
+def test_import_time_changes_affect_all_tests(
+    validator: ProjectValidator, project_slug: str
+):
+    # Module-level statements run during collection, outside of any test
+    constants = validator.project / "src" / project_slug / "constants.py"
+    constants.write_text("VALUE = 1\n")
+    module = validator.project / "tests" / "unit" / "test_constants.py"
+    module.write_text(
+        f"from {project_slug}.constants import VALUE\n\n\n"
+        "def test_value():\n    assert VALUE == 1\n"
+    )
+    tasks = load_tasks_module(validator.project)
+    cwd = os.getcwd()
+    try:
+        validator.expect_task_successful("test", "--cov")
+        validator.expect_dry_run_output(
+            "test", "--affected", match="No test affected by changes"
+        )
+        constants.write_text("VALUE = 2\n")
+        validator.expect_dry_run_output(
+            "test", "--affected", match="{python} -m pytest tests/unit/"
+        )
+        os.chdir(validator.project)
+        changed = {f"src/{project_slug}/constants.py"}
+        (name, command), *_ = tasks.watch_commands(
+            changed, ["tests/unit/"], False, True
+        )
+        assert (name, command.rsplit(" ", 1)[-1]) == ("test", "tests/unit/")
+    finally:
+        os.chdir(cwd)
+        constants.unlink()
+        module.unlink()
+        # Record impact again so that removed modules do not affect other tests
+        validator.expect_task_successful("test", "--cov")
+
+
+def test_test_helpers_affect_all_tests(validator: ProjectValidator):
+    # Helper modules are not measured by coverage
+    helper = validator.project / "tests" / "unit" / "helpers.py"
+    helper.write_text("VALUE = 1\n")
+    try:
+        validator.expect_task_successful("test", "--cov")
+        helper.write_text("VALUE = 2\n")
+        validator.expect_dry_run_output(
+            "test", "--affected", match="{python} -m pytest tests/unit/"
+        )
+    finally:
+        helper.unlink()
+        validator.expect_task_successful("test", "--cov")
+
+
+def test_coverage_can_be_measured_with_sysmon_and_served(validator: ProjectValidator):
+    # sys.monitoring is only used on Python 3.12+, line tracing is used otherwise
+    validator.expect_task_successful("test", "--sysmon")
+    validator.expect_file_exists("coverage.xml")
+    port = free_port()
+    process = validator.expect_task_started("coverage", "--port", str(port))
+    try:
+        validator.expect_file_server(
+            process, address=f"http://localhost:{port}/", method="GET", status=200
+        )
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def test_tests_can_be_run_in_parallel(validator: ProjectValidator):
+    # Tests are not collected on dry run, tests of each shard are shown as placeholders
+    options = "-o addopts='-vvv --cov-branch --cov-context=test'"
+    validator.expect_dry_run_output(
+        "test",
+        "--workers",
+        "2",
+        match=(
+            "{python} -m pytest --collect-only -q -o addopts= tests/unit/\n"
+            f"{{python}} -m pytest {options} --junitxml=.test-shards/junit-1.xml"
+            " <tests of worker 1/2>\n"
+            f"{{python}} -m pytest {options} --junitxml=.test-shards/junit-2.xml"
+            " <tests of worker 2/2>"
+        ),
+    )
+    validator.expect_dry_run_output(
+        "test",
+        "--shard",
+        "2/3",
+        match=(
+            "{python} -m pytest --collect-only -q -o addopts= tests/unit/\n"
+            "{python} -m pytest <tests of shard 2/3>"
+        ),
+    )
+    # Reports of shards are merged as if tests were run by a single process
+    validator.expect_task_successful("test", "--workers", "2", "--cov")
+    validator.expect_file_exists("junit.xml")
+    validator.expect_file_exists("coverage.xml")
+    validator.expect_file_exists(".test-durations.json")
+    # Durations are recorded by shards too, and only change when tests get slower
+    durations = validator.project / ".test-durations.json"
+    recorded = durations.read_text()
+    durations.unlink()
+    validator.expect_task_successful("test", "--shard", "1/2")
+    assert json.loads(durations.read_text())
+    durations.write_text(recorded)
+    validator.expect_task_successful("test", "--workers", "2")
+    assert durations.read_text() == recorded
+
+
+def test_checks_run_when_files_change(validator: ProjectValidator):
+    # Nothing is watched on dry run, checks of all watched files are shown instead
+    output = validator.run_task_in_process("watch", "--dry-run").splitlines()
+    assert output[0] == "Watch src/ and tests/ for changes, then run:"
+    # Tests are selected using impact recorded by previous tests when it exists
+    assert output[1].startswith(f"{python(validator.project)} -m pytest ")
+    process = validator.expect_task_started("watch")
+    module = validator.project / "tests" / "unit" / "test_watched.py"
+    try:
+        assert "Watching src/ and tests/" in process.stderr.readline().decode()
+        module.write_text("def test_watched():\n    pass\n")
+        output = ""
+        while "watching for changes" not in output and process.poll() is None:
+            output = process.stderr.readline().decode()
+        assert output.startswith("Checks passed")
+    finally:
+        process.terminate()
+        process.wait()
+        module.unlink()
+        # Daemon started by watch task keeps running
+        validator.expect_task_successful("check", "--stop-daemon")
+
+
+def test_benchmarks_can_be_compared_to_baseline(validator: ProjectValidator):
+    validator.expect_task_successful("bench", "--repeat", "2", "--save", "baseline")
+    validator.expect_file_exists(".benchmarks", "baseline.json")
+    # Threshold is high enough for noise not to be reported as a regression
+    validator.expect_task_successful("bench", "--repeat", "2", "--threshold", "100")
+
+
 def test_mypy_can_be_invoked(validator: ProjectValidator, cli_option: str):
     # Check command that would be executed by "check" task
     validator.expect_dry_run_output("check", match="{python} -m mypy src/")
@@ -90,7 +380,7 @@ def test_mypy_can_be_invoked(validator: ProjectValidator, cli_option: str):
         validator.expect_task_output(
             "check",
             "--include-tests",
-            match="Success: no issues found in 7 source files",
+            match="Success: no issues found in 10 source files",
         )
     else:
         validator.expect_task_output(
@@ -99,10 +389,29 @@ def test_mypy_can_be_invoked(validator: ProjectValidator, cli_option: str):
         validator.expect_task_output(
             "check",
             "--include-tests",
-            match="Success: no issues found in 11 source files",
+            match="Success: no issues found in 14 source files",
         )
 
 
+def test_mypy_daemon_can_be_invoked(validator: ProjectValidator, cli_option: str):
+    # Check commands that would be executed by "check" task in daemon mode
+    validator.expect_dry_run_output(
+        "check", "--daemon", match="{python} -m mypy.dmypy check src/"
+    )
+    validator.expect_dry_run_output(
+        "check", "--stop-daemon", match="{python} -m mypy.dmypy stop"
+    )
+    files = 2 if cli_option == "No command-line interface" else 5
+    # Daemon is started by first check, and reports same results as mypy
+    for _ in range(2):
+        validator.expect_task_output(
+            "check",
+            "--daemon",
+            match=f"Success: no issues found in {files} source files",
+        )
+    validator.expect_task_output("check", "--stop-daemon", match="Daemon stopped")
+
+
 def test_flake8_can_be_invoked(validator: ProjectValidator):
     # Check command that would be executed by "lint" task
     validator.expect_dry_run_output("lint", match="{python} -m flake8 .")
@@ -110,6 +419,32 @@ def test_flake8_can_be_invoked(validator: ProjectValidator):
     validator.expect_task_output("lint", match="")
 
 
+def test_changed_files_can_be_linted(validator: ProjectValidator, project_slug: str):
+    # Generated project has no change compared to main branch
+    validator.expect_dry_run_output("lint", "--changed", match="")
+    validator.expect_dry_run_output("format", "--staged", match="")
+    module = f"src/{project_slug}/changed.py"
+    validator.project.joinpath(module).write_text('"""Changed module."""\n')
+    try:
+        validator.expect_dry_run_output(
+            "lint", "--changed", match=f"{{python}} -m flake8 {module}"
+        )
+        validator.expect_dry_run_output(
+            "format",
+            "--check",
+            "--changed",
+            "--jobs",
+            "2",
+            match=(
+                f"{{python}} -m isort --filter-files --jobs 2 {module} --check\n"
+                f"{{python}} -m black --workers 2 {module} --check"
+            ),
+        )
+        validator.expect_task_output("lint", "--changed", match="")
+    finally:
+        validator.project.joinpath(module).unlink()
+
+
 def test_isort_and_black_can_be_invoked(validator: ProjectValidator, cli_option: str):
     # Check command that would be executed by "format" task
     validator.expect_dry_run_output(
@@ -131,6 +466,208 @@ def test_isort_and_black_can_be_invoked(validator: ProjectValidator, cli_option:
         )
 
 
+def test_task_results_are_replayed_from_cache(
+    validator: ProjectValidator, tmp_path: pathlib.Path
+):
+    project = validator.project
+    marker = tmp_path / "runs"
+    env = {**os.environ, "TASKS_CACHE_DIR": str(tmp_path), "TASKS_HISTORY_FILE": ""}
+    env.pop("TASKS_NO_CACHE", None)
+
+    def run_tests(**extra_env: str) -> subprocess.CompletedProcess:
+        return subprocess.run(
+            inv(project, "test", "--cov"),
+            cwd=project,
+            env={**env, **extra_env},
+            stdout=subprocess.PIPE,
+            text=True,
+        )
+
+    # Each run of tests appends to marker file, which is not an input of tests
+    module = project / "tests" / "unit" / "test_cached.py"
+    module.write_text(
+        "def test_cached():\n"
+        f"    with open({str(marker)!r}, 'a') as marker:\n"
+        "        marker.write('.')\n"
+    )
+    try:
+        first = run_tests()
+        assert first.returncode == 0
+        junit = project.joinpath("junit.xml").read_text()
+        for name in ("junit.xml", "coverage.xml", ".coverage"):
+            project.joinpath(name).unlink()
+        # Output is replayed and reports are restored
+        second = run_tests()
+        assert (second.returncode, second.stdout) == (0, first.stdout)
+        assert project.joinpath("junit.xml").read_text() == junit
+        validator.expect_file_exists("coverage.xml")
+        validator.expect_file_exists(".coverage")
+        assert marker.read_text() == "."
+        # Environment variables read by tools are part of cache key
+        assert run_tests(PYTEST_ADDOPTS="-p no:cacheprovider").returncode == 0
+        assert marker.read_text() == ".."
+        # Failures are never cached
+        module.write_text(module.read_text() + "    assert False\n")
+        assert run_tests().returncode != 0
+        assert run_tests().returncode != 0
+        assert marker.read_text() == "...."
+    finally:
+        module.unlink()
+
+
+def test_task_history_is_recorded(validator: ProjectValidator, tmp_path: pathlib.Path):
+    validator.expect_task_successful("lint", "--no-cache")
+    # Stopping mypy daemon is not a type check (whether a daemon was running or not)
+    subprocess.run(
+        inv(validator.project, "check", "--stop-daemon"), cwd=validator.project
+    )
+    history = validator.project / ".tasks-history.sqlite"
+    with contextlib.closing(sqlite3.connect(history)) as connection:
+        runs = connection.execute(
+            "SELECT task, arguments, exit_code, cached FROM runs"
+        ).fetchall()
+        # Peak memory is known for the first task run by a process
+        [maxrss] = connection.execute(
+            "SELECT maxrss FROM runs WHERE task = 'lint' ORDER BY started DESC"
+        ).fetchone()
+    assert ("lint", "--no-cache", 0, 0) in runs
+    assert [run for run in runs if run[1] == "--stop-daemon"] == []
+    assert maxrss > 0
+    # Dry run does not need any recorded history
+    missing = tmp_path / "history.sqlite"
+    output = subprocess.check_output(
+        inv(validator.project, "stats", "--dry-run"),
+        cwd=validator.project,
+        env={**os.environ, "TASKS_HISTORY_FILE": missing.as_posix()},
+        text=True,
+    )
+    assert output == f"Show statistics of runs recorded in {missing}\n"
+    # Percentiles and trends are computed from recorded history
+    validator.expect_dry_run_output(
+        "stats",
+        "--name",
+        "lint",
+        match=f"Show statistics of lint runs recorded in {history}",
+    )
+    validator.expect_task_successful("stats", "--name", "lint")
+
+
+def test_pre_push_checks_can_be_invoked(validator: ProjectValidator):
+    # Check commands that would be executed by "pre-push" task, in declaration order
+    validator.expect_dry_run_output(
+        "pre-push",
+        match=(
+            "{python} -m isort . --check\n"
+            "{python} -m black . --check\n"
+            "{python} -m flake8 .\n"
+            "{python} -m mypy src/ tests/\n"
+            "{python} -m pytest tests/unit/"
+        ),
+    )
+
+
+def run_tasks(
+    project: pathlib.Path, *tasks: str, in_process: bool, black_cache: pathlib.Path
+) -> subprocess.CompletedProcess:
+    """Run tasks without cache, with tools running in process or in subprocesses."""
+    env = {
+        **os.environ,
+        "TASKS_NO_CACHE": "1",
+        "TASKS_HISTORY_FILE": "",
+        # Black only uses multiple workers for files missing from its cache
+        "BLACK_CACHE_DIR": black_cache.as_posix(),
+    }
+    env.pop("TASKS_IN_PROCESS", None)
+    if in_process:
+        env["TASKS_IN_PROCESS"] = "1"
+    return subprocess.run(
+        inv(project, *tasks),
+        cwd=project,
+        env=env,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+
+
+def step_outputs(output: str) -> t.Dict[str, str]:
+    """Status and output of each step printed by pre-push task, without duration."""
+    steps: t.Dict[str, str] = {}
+    name = ""
+    for line in output.splitlines():
+        match = re.fullmatch(r"--- (\w+): (\w+) \([\d.]+s\)", line)
+        if match:
+            name = match.group(1)
+            steps[name] = match.group(2)
+        elif name:
+            steps[name] += "\n" + line
+    return steps
+
+
+def test_tools_can_run_in_process(
+    validator: ProjectValidator, project_slug: str, tmp_path: pathlib.Path
+):
+    # Steps run concurrently by pre-push report same results in both modes
+    results = [
+        run_tasks(
+            validator.project,
+            "pre-push",
+            in_process=in_process,
+            black_cache=tmp_path / f"black-{in_process}",
+        )
+        for in_process in (False, True)
+    ]
+    assert results[1].returncode == results[0].returncode
+    expected, steps = (step_outputs(result.stdout) for result in results)
+    assert sorted(steps) == ["check", "format", "lint", "test"]
+    # Output of tests holds durations
+    assert steps.pop("test").split("\n")[0] == expected.pop("test").split("\n")[0]
+    assert steps == expected
+    # Tasks invoked at once produce same output, whether they succeed or fail
+    module = validator.project / "src" / project_slug / "unused.py"
+    for content in ('"""Formatted module."""\n', "import os\n"):
+        module.write_text(content)
+        try:
+            expected, result = (
+                run_tasks(
+                    validator.project,
+                    "lint",
+                    "check",
+                    "format",
+                    "--check",
+                    in_process=in_process,
+                    black_cache=tmp_path / f"black-{content!r}-{in_process}",
+                )
+                for in_process in (False, True)
+            )
+        finally:
+            module.unlink()
+        assert result.returncode == expected.returncode
+        assert result.stdout == expected.stdout
+        assert result.stderr == expected.stderr
+    assert expected.returncode != 0
+
+
+def test_pre_push_checks_run_concurrently(validator: ProjectValidator):
+    tasks = load_tasks_module(validator.project)
+    cwd = os.getcwd()
+    os.chdir(validator.project)
+    try:
+        # Simulate checks taking one second, keeping paths they read and write
+        steps = [
+            step._replace(action=lambda c: time.sleep(1))
+            for step in tasks.pre_push_steps()
+        ]
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            tasks.run_steps(Context(), steps, jobs=len(steps))
+        duration = time.perf_counter() - start
+    finally:
+        os.chdir(cwd)
+    # No step waits for another one
+    assert duration < 1.5
+
+
 def test_project_can_be_built(
     validator: ProjectValidator,
     project_name: str,
@@ -180,6 +717,38 @@ def test_requirements_can_be_generated(validator: ProjectValidator):
     validator.expect_task_successful("requirements")
 
 
+def test_requirements_are_restored_from_resolution_cache(
+    validator: ProjectValidator, tmp_path: pathlib.Path
+):
+    project = validator.project
+    requirements = project / "requirements.txt"
+    requirements.unlink(missing_ok=True)
+    env = {**os.environ, "TASKS_CACHE_DIR": str(tmp_path), "TASKS_HISTORY_FILE": ""}
+    first = subprocess.run(
+        inv(project, "requirements"), cwd=project, env=env, stdout=subprocess.PIPE
+    )
+    assert first.returncode == 0
+    assert b"Restored requirements.txt" not in first.stdout
+    resolved = requirements.read_text()
+    mtime = requirements.stat().st_mtime_ns
+    # pip-compile fails if it is invoked again
+    fake = tmp_path / "fake" / "piptools"
+    fake.mkdir(parents=True)
+    fake.joinpath("__init__.py").write_text("")
+    fake.joinpath("__main__.py").write_text("raise SystemExit('pip-compile invoked')")
+    second = subprocess.run(
+        inv(project, "requirements"),
+        cwd=project,
+        env={**env, "PYTHONPATH": fake.parent.as_posix()},
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    assert second.returncode == 0
+    assert "Restored requirements.txt from resolution cache" in second.stdout
+    assert requirements.read_text() == resolved
+    assert requirements.stat().st_mtime_ns == mtime
+
+
 def test_wheelhouse_can_be_created(validator: ProjectValidator):
     # Check command that would be executed by "wheelhouse" task
     validator.expect_dry_run_output(
@@ -217,19 +786,16 @@ def test_docs_can_be_built(validator: ProjectValidator):
 
 
 def test_docs_can_be_served_in_development_mode(validator: ProjectValidator):
-    global NEXT_PORT
-    process = validator.expect_task_started(
-        "docs", "--no-watch", "--port", str(NEXT_PORT)
-    )
+    port = free_port()
+    process = validator.expect_task_started("docs", "--no-watch", "--port", str(port))
     try:
         validator.expect_file_server(
-            process, address=f"http://localhost:{NEXT_PORT}", method="GET", status=200
+            process, address=f"http://localhost:{port}", method="GET", status=200
         )
     finally:
         # Terminate process
         process.terminate()
         process.wait()
-        NEXT_PORT += 1
 
 
 def test_docker_task_command(project_name: str, validator: ProjectValidator):
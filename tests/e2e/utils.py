@@ -1,11 +1,26 @@
+import contextlib
+import hashlib
+import importlib.util
+import io
 import os
+import shutil
+import socket
 import subprocess
+import sys
+import types
 import typing as t
 from pathlib import Path
 
 import urllib3
+from invoke import Collection, Program
 
-NEXT_PORT = 8000
+
+def free_port() -> int:
+    """Get a TCP port which is not used by any process (safe across test workers)."""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        # Let the operating system pick an available port
+        sock.bind(("localhost", 0))
+        return int(sock.getsockname()[1])
 
 
 def python(project: Path) -> str:
@@ -16,14 +31,130 @@ def python(project: Path) -> str:
         return f"{project}/.venv/bin/python"
 
 
+def generate_project(output_dir: str, *options: str, **env: str) -> None:
+    """Generate a project from the template found in current directory."""
+    subprocess.check_call(
+        ["cookiecutter", ".", "--no-input", "--output-dir", output_dir, *options],
+        env={**os.environ, **env},
+    )
+
+
+def template_digest(root: Path) -> str:
+    """Digest of template files (hooks, cookiecutter.json and project template)."""
+    digest = hashlib.sha256()
+    paths = [root / "cookiecutter.json"]
+    for directory in ("hooks", "{{ cookiecutter.repo_name }}"):
+        paths.extend(
+            sorted(
+                path
+                for path in root.joinpath(directory).rglob("*")
+                if path.is_file() and "__pycache__" not in path.parts
+            )
+        )
+    for path in paths:
+        digest.update(path.relative_to(root).as_posix().encode())
+        digest.update(path.read_bytes())
+    return digest.hexdigest()
+
+
+def project_cache_key(digest: str, *options: str) -> str:
+    """Key of a generated project within cache."""
+    key = hashlib.sha256(digest.encode())
+    key.update(sys.version.encode())
+    for option in options:
+        key.update(option.encode())
+    return key.hexdigest()[:16]
+
+
+def clone_project(source: Path, target: Path) -> None:
+    """Copy a generated project along with its virtual environment.
+
+    Copy-on-write is used when supported by filesystem.
+    """
+    if os.name == "nt":
+        shutil.copytree(source, target, symlinks=True)
+    else:
+        subprocess.check_call(["cp", "-a", "--reflink=auto", str(source), str(target)])
+    relocate_project(target, source, target)
+
+
+def relocate_project(project: Path, source: Path, target: Path) -> None:
+    """Rewrite paths within a project moved or copied from source to target.
+
+    Virtual environments are not relocatable, so absolute paths to source project
+    found in scripts, path configuration files and editable install metadata are
+    rewritten.
+    """
+    venv = project / ".venv"
+    paths = [venv / "pyvenv.cfg", *venv.glob("bin/*"), *venv.glob("Scripts/*")]
+    for site_packages in venv.glob("[lL]ib/**/site-packages"):
+        paths.extend(site_packages.glob("*.pth"))
+        paths.extend(site_packages.glob("__editable__*.py"))
+        paths.extend(site_packages.glob("*.dist-info/direct_url.json"))
+    old, new = str(source).encode(), str(target).encode()
+    for path in paths:
+        if path.is_symlink() or not path.is_file():
+            continue
+        content = path.read_bytes()
+        if old in content:
+            # Replace file instead of writing in place since it may be a hard link
+            tmp = path.with_name(f".{path.name}.relocate")
+            tmp.write_bytes(content.replace(old, new))
+            shutil.copymode(path, tmp)
+            os.replace(tmp, path)
+
+
 def inv(project: Path, task: str, *opts: str) -> t.List[str]:
     """Invoke a python task;"""
     return [python(project), "-m", "invoke", task, *opts]
 
 
+def load_module(path: Path) -> types.ModuleType:
+    """Import a python file of a project as a module."""
+    name = f"{path.stem}_" + hashlib.sha256(str(path).encode()).hexdigest()[:8]
+    spec = importlib.util.spec_from_file_location(name, path)
+    assert spec and spec.loader, f"Cannot load {path}"
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def load_tasks_module(project: Path) -> types.ModuleType:
+    """Import project tasks file as a module."""
+    return load_module(project / "tasks.py")
+
+
+def load_tasks(project: Path) -> Program:
+    """Load project tasks file and return an invoke program running its tasks."""
+    return Program(namespace=Collection.from_module(load_tasks_module(project)))
+
+
 class ProjectValidator:
-    def __init__(self, project: Path) -> None:
+    def __init__(self, project: Path, in_process: bool = True) -> None:
         self.project = project
+        # Run dry-run tasks within test process instead of a python subprocess
+        self.in_process = in_process
+        self._program: t.Optional[Program] = None
+
+    @property
+    def program(self) -> Program:
+        """Invoke program loaded once from project tasks file."""
+        if self._program is None:
+            self._program = load_tasks(self.project)
+        return self._program
+
+    def run_task_in_process(self, task: str, *opts: str) -> str:
+        """Run a task within test process and return its standard output."""
+        stdout = io.StringIO()
+        cwd = os.getcwd()
+        # Tasks expect to be run from project root directory
+        os.chdir(self.project)
+        try:
+            with contextlib.redirect_stdout(stdout):
+                self.program.run(["invoke", task, *opts])
+        finally:
+            os.chdir(cwd)
+        return stdout.getvalue().strip()
 
     def expect_file_exists(self, *file: str) -> None:
         assert self.project.joinpath(*file).is_file()
@@ -37,6 +168,12 @@ class ProjectValidator:
     def expect_directory_does_not_exist(self, *directory: str) -> None:
         assert not self.project.joinpath(*directory).exists()
 
+    def expect_git_output(self, *args: str, match: str) -> None:
+        output = (
+            subprocess.check_output(["git", *args], cwd=self.project).strip().decode()
+        )
+        assert output == match, f"Expected: '{match}'. Got: '{output}'"
+
     def expect_task_output(self, task: str, *opts: str, match: str) -> None:
         match = match.format(python=python(self.project))
         output = (
@@ -75,7 +212,10 @@ class ProjectValidator:
 
     def expect_dry_run_output(self, task: str, *opts: str, match: str) -> None:
         match = match.format(python=python(self.project))
-        self.expect_task_output(task, *opts, "--dry-run", match=match)
+        if not self.in_process:
+            return self.expect_task_output(task, *opts, "--dry-run", match=match)
+        output = self.run_task_in_process(task, *opts, "--dry-run")
+        assert output == match, f"Expected: '{match}'. Got: '{output}'"
 
     def expect_file_server(
         self,
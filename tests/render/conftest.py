@@ -0,0 +1,53 @@
+import itertools
+import typing as t
+from pathlib import Path
+
+import pytest
+
+from .utils import render_project
+
+TEMPLATE_ROOT = Path(__file__).parent.parent.parent
+
+# Values tested for each template option which affects rendered files or hooks
+# (init_git_repo is left out since projects are never installed when rendering)
+OPTIONS: t.Dict[str, t.List[t.Any]] = {
+    "command_line_interface": [
+        "No command-line interface",
+        "Argparse",
+        "Click",
+        "Typer",
+    ],
+    "publish_to_pypi": [False, True],
+    "requires_python": [">=3.8,<4.0", ">=3.11"],
+    "license": ["Apache-2.0", "MIT"],
+}
+
+
+def options_id(options: t.Dict[str, t.Any]) -> str:
+    return "-".join(
+        [
+            options["command_line_interface"],
+            "pypi" if options["publish_to_pypi"] else "no-pypi",
+            options["requires_python"],
+            options["license"],
+        ]
+    )
+
+
+OPTIONS_MATRIX = [
+    dict(zip(OPTIONS, values)) for values in itertools.product(*OPTIONS.values())
+]
+
+
+@pytest.fixture(scope="module", params=OPTIONS_MATRIX, ids=options_id)
+def options(request: pytest.FixtureRequest) -> t.Dict[str, t.Any]:
+    """Parametrized fixture providing every combination of template options"""
+    return request.param
+
+
+@pytest.fixture(scope="module")
+def project(
+    options: t.Dict[str, t.Any], tmp_path_factory: pytest.TempPathFactory
+) -> Path:
+    """Render a project without installing it"""
+    return render_project(TEMPLATE_ROOT, tmp_path_factory.mktemp("render"), **options)
@@ -0,0 +1,109 @@
+import importlib
+import json
+import typing as t
+from pathlib import Path
+
+import yaml
+
+from .utils import (
+    import_file,
+    isolated_imports,
+    load_toml,
+    module_name,
+    parse_dockerfile,
+)
+
+
+def test_cli_files_are_pruned(project: Path, options: t.Dict[str, t.Any]):
+    cli = project / "src" / project.name.replace("-", "_") / "cli"
+    if options["command_line_interface"] == "No command-line interface":
+        assert not cli.exists()
+        assert not project.joinpath("tests", "e2e", "test_cli.py").exists()
+    else:
+        assert sorted(path.name for path in cli.glob("*.py")) == [
+            "__init__.py",
+            "app.py",
+        ]
+
+
+def test_no_project_is_installed(project: Path):
+    assert not project.joinpath(".venv").exists()
+    assert not project.joinpath(".git").exists()
+
+
+def test_context_is_recorded(project: Path, options: t.Dict[str, t.Any]):
+    record = json.loads(project.joinpath(".cookiecutter.json").read_text())
+    assert record["commit"]
+    assert {key: record["context"][key] for key in options} == options
+    assert not any(key.startswith("_") for key in record["context"])
+
+
+def test_python_files_compile(project: Path):
+    for path in sorted(project.rglob("*.py")):
+        compile(path.read_text(), path.as_posix(), "exec")
+
+
+def test_package_modules_can_be_imported(project: Path):
+    src = project / "src"
+    with isolated_imports(src):
+        for path in sorted(src.rglob("*.py")):
+            importlib.import_module(module_name(src, path))
+
+
+def test_scripts_and_tests_can_be_imported(project: Path):
+    # Documentation scripts are only compiled since they run mkdocs plugins on import
+    paths = [
+        project / "tasks.py",
+        *sorted(project.joinpath("scripts").glob("*.py")),
+        *sorted(project.joinpath("tests").rglob("*.py")),
+    ]
+    with isolated_imports(project / "src"):
+        for path in paths:
+            name = "_".join(
+                ("rendered", *path.relative_to(project).with_suffix("").parts)
+            )
+            import_file(path, name)
+
+
+def test_pyproject_is_valid(project: Path, options: t.Dict[str, t.Any]):
+    pyproject = load_toml(project / "pyproject.toml")
+    metadata = pyproject["project"]
+    assert metadata["name"] == project.name
+    assert metadata["requires-python"] == options["requires_python"]
+    assert metadata["license"] == {"text": options["license"]}
+    cli = options["command_line_interface"]
+    if cli in ("Click", "Typer"):
+        assert metadata["dependencies"] == [cli.lower()]
+    else:
+        assert metadata["dependencies"] == []
+    if cli == "No command-line interface":
+        assert "scripts" not in metadata
+    else:
+        assert list(metadata["scripts"]) == [project.name]
+    assert pyproject["build-system"]["build-backend"] == "setuptools.build_meta"
+
+
+def test_workflows_are_valid(project: Path, options: t.Dict[str, t.Any]):
+    workflows = sorted(project.joinpath(".github", "workflows").glob("*.yml"))
+    assert workflows
+    for path in workflows:
+        workflow = yaml.safe_load(path.read_text())
+        assert isinstance(workflow, dict), path
+        assert workflow["jobs"], path
+        for name, job in workflow["jobs"].items():
+            assert "runs-on" in job, f"{path}: job {name} has no runner"
+            for step in job["steps"]:
+                assert "uses" in step or "run" in step, f"{path}: invalid step {step}"
+    cd = yaml.safe_load(project.joinpath(".github", "workflows", "cd.yml").read_text())
+    uses = [
+        step.get("uses", "") for job in cd["jobs"].values() for step in job["steps"]
+    ]
+    publish = any(action.startswith("pypa/gh-action-pypi-publish") for action in uses)
+    assert publish is options["publish_to_pypi"]
+
+
+def test_dockerfile_is_valid(project: Path):
+    instructions = parse_dockerfile(project / "Dockerfile")
+    assert instructions[0][0] in ("ARG", "FROM")
+    assert any(instruction == "FROM" for instruction, _ in instructions)
+    assert any(f"/opt/{project.name}" in arguments for _, arguments in instructions)
@@ -0,0 +1,140 @@
+import contextlib
+import importlib.util
+import os
+import shlex
+import sys
+import typing as t
+from pathlib import Path
+from types import ModuleType
+
+from cookiecutter.main import cookiecutter
+
+try:
+    import tomllib
+except ModuleNotFoundError:  # Python < 3.11
+    import tomli as tomllib  # type: ignore[no-redef]
+
+# Instructions allowed in a Dockerfile (parser directives and comments excluded)
+DOCKERFILE_INSTRUCTIONS = {
+    "ADD",
+    "ARG",
+    "CMD",
+    "COPY",
+    "ENTRYPOINT",
+    "ENV",
+    "EXPOSE",
+    "FROM",
+    "HEALTHCHECK",
+    "LABEL",
+    "ONBUILD",
+    "RUN",
+    "SHELL",
+    "STOPSIGNAL",
+    "USER",
+    "VOLUME",
+    "WORKDIR",
+}
+
+
+def render_project(template: Path, output_dir: Path, **options: t.Any) -> Path:
+    """Render a project without creating its virtual environment.
+
+    Hooks still run in order to prune files, but the post-generation hook skips
+    every step which installs the project or initializes a git repository.
+    """
+    with temporary_environ(TEMPLATE_RENDER_ONLY="1"):
+        return Path(
+            cookiecutter(
+                template.as_posix(),
+                no_input=True,
+                extra_context=options,
+                output_dir=output_dir.as_posix(),
+            )
+        )
+
+
+@contextlib.contextmanager
+def temporary_environ(**env: str) -> t.Iterator[None]:
+    """Set environment variables (inherited by hooks) until context exits."""
+    previous = {key: os.environ.get(key) for key in env}
+    os.environ.update(env)
+    try:
+        yield
+    finally:
+        for key, value in previous.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+
+
+@contextlib.contextmanager
+def isolated_imports(*paths: Path) -> t.Iterator[None]:
+    """Make paths importable and forget modules imported from them on exit.
+
+    Every rendered project holds a package with the same name, so modules must
+    be dropped from sys.modules before the next project is imported.
+    """
+    modules = set(sys.modules)
+    sys.path[:0] = [path.as_posix() for path in paths]
+    try:
+        yield
+    finally:
+        del sys.path[: len(paths)]
+        for name in set(sys.modules) - modules:
+            module = sys.modules[name]
+            origin = getattr(module, "__file__", None) or ""
+            if any(origin.startswith(path.as_posix()) for path in paths):
+                del sys.modules[name]
+
+
+def module_name(root: Path, path: Path) -> str:
+    """Get dotted name of module located at path relative to root."""
+    parts = path.relative_to(root).with_suffix("").parts
+    if parts[-1] == "__init__":
+        parts = parts[:-1]
+    return ".".join(parts)
+
+
+def import_file(path: Path, name: str) -> ModuleType:
+    """Import a python file which does not belong to a package."""
+    spec = importlib.util.spec_from_file_location(name, path)
+    assert spec and spec.loader, f"Cannot import {path}"
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def load_toml(path: Path) -> t.Dict[str, t.Any]:
+    return tomllib.loads(path.read_text())
+
+
+def parse_dockerfile(path: Path) -> t.List[t.Tuple[str, str]]:
+    """Parse a Dockerfile into a list of (instruction, arguments) tuples.
+
+    Raise a ValueError on unknown instructions, unterminated line continuations
+    and unbalanced quotes in shell form commands.
+    """
+    instructions: t.List[t.Tuple[str, str]] = []
+    logical_line = ""
+    for lineno, line in enumerate(path.read_text().splitlines(), start=1):
+        stripped = line.strip()
+        if not stripped or stripped.startswith("#"):
+            continue
+        if stripped.endswith("\\"):
+            logical_line += stripped[:-1] + " "
+            continue
+        logical_line += stripped
+        instruction, _, arguments = logical_line.partition(" ")
+        if instruction.upper() not in DOCKERFILE_INSTRUCTIONS:
+            raise ValueError(f"{path}:{lineno}: unknown instruction {instruction!r}")
+        if not arguments.strip():
+            raise ValueError(f"{path}:{lineno}: missing arguments for {instruction}")
+        if not arguments.lstrip().startswith("["):
+            # Shell form: make sure quotes are balanced
+            shlex.split(arguments, comments=False, posix=True)
+        instructions.append((instruction.upper(), arguments.strip()))
+        logical_line = ""
+    if logical_line:
+        raise ValueError(f"{path}: unterminated line continuation")
+    return instructions
@@ -0,0 +1,131 @@
+import importlib.util
+import json
+import subprocess
+import typing as t
+from pathlib import Path
+from types import ModuleType
+
+import pytest
+
+TEMPLATE_ROOT = Path(__file__).parent.parent.parent
+
+
+def load_script(name: str) -> ModuleType:
+    """Import a script of template repository as a module."""
+    path = TEMPLATE_ROOT / "scripts" / f"{name}.py"
+    spec = importlib.util.spec_from_file_location(name, path)
+    assert spec and spec.loader, f"Cannot load {path}"
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+update_projects = load_script("update_projects")
+
+
+def write_files(root: Path, files: t.Dict[str, bytes]) -> Path:
+    for name, content in files.items():
+        root.joinpath(name).parent.mkdir(parents=True, exist_ok=True)
+        root.joinpath(name).write_bytes(content)
+    return root
+
+
+def merge(
+    tmp_path: Path,
+    project: t.Dict[str, bytes],
+    base: t.Dict[str, bytes],
+    new: t.Dict[str, bytes],
+) -> t.Tuple[t.Dict[str, t.Optional[bytes]], t.List[t.Any]]:
+    return update_projects.three_way_merge(
+        write_files(tmp_path / "project", project),
+        write_files(tmp_path / "base", base),
+        write_files(tmp_path / "new", new),
+        tmp_path / "merge",
+    )
+
+
+def record_project(project: Path, commit: str, context: t.Dict[str, t.Any]) -> Path:
+    project.mkdir(parents=True)
+    project.joinpath(".cookiecutter.json").write_text(
+        json.dumps({"commit": commit, "context": context})
+    )
+    return project
+
+
+@pytest.fixture(scope="module")
+def head() -> str:
+    return subprocess.check_output(
+        ["git", "-C", TEMPLATE_ROOT.as_posix(), "rev-parse", "HEAD"], text=True
+    ).strip()
+
+
+def test_changes_are_merged_cleanly(tmp_path: Path):
+    changes, conflicts = merge(
+        tmp_path,
+        project={"setup.cfg": b"project\nb\nc\n", "README.md": b"readme\n"},
+        base={"setup.cfg": b"a\nb\nc\n", "README.md": b"readme\n"},
+        new={"setup.cfg": b"a\nb\ntemplate\n", "README.md": b"readme\n"},
+    )
+    assert changes == {"setup.cfg": b"project\nb\ntemplate\n"}
+    assert conflicts == []
+
+
+def test_conflicting_changes_are_reported(tmp_path: Path):
+    changes, conflicts = merge(
+        tmp_path,
+        project={"setup.cfg": b"a\nproject\nc\n"},
+        base={"setup.cfg": b"a\nb\nc\n"},
+        new={"setup.cfg": b"a\ntemplate\nc\n"},
+    )
+    assert changes == {}
+    [conflict] = conflicts
+    assert (conflict.path, conflict.reason) == (
+        "setup.cfg",
+        "changed by template and by project",
+    )
+    assert "<<<<<<< project\nproject\n=======\ntemplate\n>>>>>>> template" in (
+        conflict.content
+    )
+
+
+def test_binary_files_changed_on_both_sides_are_conflicts(tmp_path: Path):
+    changes, conflicts = merge(
+        tmp_path,
+        project={"docs/logo.png": b"\x89PNG\0project\xff"},
+        base={"docs/logo.png": b"\x89PNG\0base\xff"},
+        new={"docs/logo.png": b"\x89PNG\0template\xff"},
+    )
+    assert changes == {}
+    assert conflicts == [
+        update_projects.Conflict(
+            "docs/logo.png", "binary file changed by template and by project", None
+        )
+    ]
+
+
+def test_unchanged_project_is_up_to_date(tmp_path: Path, head: str):
+    # Project generated from target revision is not rendered again
+    project = record_project(tmp_path / "project", head, {"repo_name": "project"})
+    templates = update_projects.TemplateCache(TEMPLATE_ROOT, tmp_path / "templates")
+    report = update_projects.update_project(
+        project, templates, head, None, tmp_path, apply=False
+    )
+    assert (report.status, report.changed, report.conflicts) == ("up-to-date", [], [])
+    assert not tmp_path.joinpath("project.patch").exists()
+
+
+def test_failed_project_does_not_stop_batch(tmp_path: Path, head: str):
+    broken = tmp_path / "broken"
+    broken.mkdir()
+    broken.joinpath(".cookiecutter.json").write_text("{")
+    project = record_project(tmp_path / "project", head, {"repo_name": "project"})
+    report_dir = tmp_path / "reports"
+    code = update_projects.main(
+        [broken.as_posix(), project.as_posix(), "--report-dir", report_dir.as_posix()]
+    )
+    assert code == 1
+    report = json.loads(report_dir.joinpath("update-report.json").read_text())
+    assert [project["status"] for project in report["projects"]] == [
+        "error",
+        "up-to-date",
+    ]
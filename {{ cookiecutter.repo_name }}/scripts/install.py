@@ -3,66 +3,308 @@
 """Install the project in editable mode."""
 
 import argparse
+import contextlib
+import errno
+import hashlib
+import json
 import os
 import pathlib
+import stat
 import subprocess
 import sys
+import time
+import typing as t
 import venv
 
 PROJECT_DIR = pathlib.Path(__file__).parent.parent.resolve(True)
 VENV_DIR = PROJECT_DIR / ".venv"
+FINGERPRINT_FILE = VENV_DIR / "install-fingerprint.json"
+# Files which affect project installation
+INSTALL_INPUTS = [
+    "pyproject.toml",
+    "src/{{ cookiecutter.project_slug }}/__about__.py",
+]
 
 
 if os.name == "nt":
     VENV_PYTHON = VENV_DIR / "Scripts" / "python.exe"
+    VENV_LIB = VENV_DIR / "Lib"
 else:
     VENV_PYTHON = VENV_DIR / "bin" / "python"
+    VENV_LIB = VENV_DIR / "lib"
 
+# Linux ioctl request used to clone a file (reflink) on copy-on-write filesystems
+FICLONE = 0x40049409
 
-def install_virtualenv() -> None:
-    """Create a virtualenv and install dependencies"""
-    venv.create(
-        VENV_DIR,
-        system_site_packages=False,
-        clear=False,
-        with_pip=True,
-        prompt=None,
-    )
+# Phases durations recorded during installation
+TIMINGS: t.List[t.Dict[str, t.Any]] = []
+
+
+@contextlib.contextmanager
+def timed(phase: str) -> t.Iterator[None]:
+    """Record wall time spent within a phase"""
+    start = time.time()
+    counter = time.perf_counter()
     try:
-        subprocess.run(
-            [
-                VENV_PYTHON,
-                "-m",
-                "pip",
-                "install",
-                "-U",
-                "pip",
-                "setuptools",
-                "wheel",
-            ]
+        yield
+    finally:
+        TIMINGS.append(
+            {
+                "phase": phase,
+                "start": start,
+                "duration": time.perf_counter() - counter,
+            }
+        )
+
+
+def write_timings(path: pathlib.Path) -> None:
+    """Write recorded phases durations as JSON"""
+    path.write_text(json.dumps(TIMINGS, indent=2))
+
+
+def interpreter_fingerprint() -> str:
+    """Identify the interpreter used to create the virtualenv"""
+    return f"{os.path.realpath(sys.executable)} {sys.version}"
+
+
+def install_fingerprint(extras: t.Set[str]) -> t.Dict[str, t.Any]:
+    """Identify the inputs of project installation"""
+    fingerprint: t.Dict[str, t.Any] = {
+        "interpreter": interpreter_fingerprint(),
+        "extras": sorted(extras),
+    }
+    for name in INSTALL_INPUTS:
+        path = PROJECT_DIR / name
+        fingerprint[name] = (
+            hashlib.sha256(path.read_bytes()).hexdigest() if path.is_file() else None
         )
+    return fingerprint
+
+
+def read_fingerprint() -> t.Dict[str, t.Any]:
+    """Read fingerprint of the inputs of the last successful installation steps"""
+    try:
+        return t.cast(t.Dict[str, t.Any], json.loads(FINGERPRINT_FILE.read_text()))
+    except (OSError, ValueError):
+        return {}
+
+
+def write_fingerprint(step: str, value: t.Any) -> None:
+    """Record fingerprint of the inputs of a successful installation step"""
+    fingerprint = read_fingerprint()
+    fingerprint[step] = value
+    FINGERPRINT_FILE.write_text(json.dumps(fingerprint, indent=2))
+
+
+def changed_inputs(
+    previous: t.Optional[t.Dict[str, t.Any]], current: t.Dict[str, t.Any]
+) -> t.List[str]:
+    """List inputs which changed since last run of an installation step"""
+    if previous is None:
+        return ["never installed"]
+    changed = []
+    for key, value in current.items():
+        # Installing fewer extras than previously installed is a no-op
+        if key == "extras" and set(value).issubset(previous.get(key, [])):
+            continue
+        if previous.get(key) != value:
+            changed.append(key)
+    return changed
+
+
+def index_options(wheelhouse: t.Optional[pathlib.Path] = None) -> t.List[str]:
+    """Pip options used to install distributions from wheelhouse without accessing package index"""
+    if wheelhouse is None:
+        return []
+    return ["--no-index", "--find-links", wheelhouse.as_posix()]
+
+
+def install_virtualenv(wheelhouse: t.Optional[pathlib.Path] = None) -> None:
+    """Create a virtualenv and install dependencies"""
+    with timed("virtualenv"):
+        venv.create(
+            VENV_DIR,
+            system_site_packages=False,
+            clear=False,
+            with_pip=True,
+            prompt=None,
+        )
+    try:
+        with timed("pip-upgrade"):
+            subprocess.run(
+                [
+                    VENV_PYTHON,
+                    "-m",
+                    "pip",
+                    "install",
+                    "-U",
+                    "pip",
+                    "setuptools",
+                    "wheel",
+                    *index_options(wheelhouse),
+                ],
+                check=True,
+            )
     except Exception:
         # No need to print traceback, error will be printed from subprocess stderr
         sys.exit(1)
 
 
-def install_project(extras: str = "") -> None:
+def install_project(
+    extras: str = "", wheelhouse: t.Optional[pathlib.Path] = None
+) -> None:
     """Installing project in editable mode using pip"""
     cmd = [
         VENV_PYTHON,
         "-m",
         "pip",
         "install",
+        *index_options(wheelhouse),
         "-e",
         PROJECT_DIR.as_posix() + (f"[{extras}]" if extras else ""),
     ]
     try:
-        subprocess.run(cmd)
+        with timed(f"install[{extras}]"):
+            subprocess.run(cmd, check=True)
     except Exception:
         # No need to print traceback, error will be printed from subprocess stderr
         sys.exit(1)
 
 
+def clone_file(source: pathlib.Path, target: pathlib.Path) -> None:
+    """Create target as a hard link to source, or as a reflink when hard link is not possible"""
+    try:
+        os.link(source, target)
+    except OSError as exc:
+        # Too many links or hard links not permitted
+        if exc.errno not in (errno.EMLINK, errno.EPERM) or os.name == "nt":
+            raise
+        import fcntl
+
+        try:
+            with source.open("rb") as src, target.open("wb") as dst:
+                fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        except OSError:
+            # Never leave an empty target behind (for example an empty store object)
+            target.unlink()
+            raise
+        os.chmod(target, source.stat().st_mode)
+
+
+def file_digest(path: pathlib.Path, mode: int) -> str:
+    """Content digest of a file (executable files are stored apart)"""
+    digest = hashlib.sha256()
+    with path.open("rb") as fileobj:
+        for chunk in iter(lambda: fileobj.read(1 << 20), b""):
+            digest.update(chunk)
+    suffix = ".x" if mode & stat.S_IXUSR else ""
+    return digest.hexdigest() + suffix
+
+
+def store_object(store: pathlib.Path, digest: str) -> pathlib.Path:
+    """Path to the store object holding file content"""
+    return store / "objects" / digest[:2] / digest[2:]
+
+
+def store_registry(store: pathlib.Path) -> pathlib.Path:
+    """File listing store objects used by the virtualenv"""
+    key = hashlib.sha256(VENV_DIR.as_posix().encode()).hexdigest()[:16]
+    return store / "venvs" / f"{key}.json"
+
+
+def file_stat(path: pathlib.Path) -> t.List[int]:
+    """Size, modification time and inode identifying an unchanged file"""
+    st = path.stat()
+    return [st.st_size, st.st_mtime_ns, st.st_ino]
+
+
+def link_to_store(store: pathlib.Path) -> None:
+    """Replace files installed in virtualenv by links to identical files in store.
+
+    Files are stored once in the content-addressed store, so disk usage grows with
+    the number of distinct files rather than the number of virtual environments.
+    Files whose size, modification time and inode did not change since last run
+    (either linked to store or kept as private copies) are not hashed again.
+    """
+    registry = store_registry(store)
+    previous: t.Dict[str, str] = {}
+    previous_stats: t.Dict[str, t.List[int]] = {}
+    if registry.is_file():
+        content = json.loads(registry.read_text())
+        previous = content["files"]
+        previous_stats = content.get("stats", {})
+    files: t.Dict[str, str] = {}
+    stats: t.Dict[str, t.List[int]] = {}
+    for root, dirs, filenames in os.walk(VENV_LIB):
+        # Bytecode embeds paths of source files and is rewritten on import
+        dirs[:] = [name for name in dirs if name != "__pycache__"]
+        for filename in filenames:
+            path = pathlib.Path(root, filename)
+            st = path.lstat()
+            if not stat.S_ISREG(st.st_mode) or st.st_size == 0:
+                continue
+            relpath = path.relative_to(VENV_DIR).as_posix()
+            # Skip hashing files which did not change since last run
+            if previous_stats.get(relpath) == [st.st_size, st.st_mtime_ns, st.st_ino]:
+                stats[relpath] = previous_stats[relpath]
+                if relpath in previous:
+                    files[relpath] = previous[relpath]
+                continue
+            digest = file_digest(path, st.st_mode)
+            target = store_object(store, digest)
+            target.parent.mkdir(parents=True, exist_ok=True)
+            try:
+                if not target.exists():
+                    try:
+                        clone_file(path, target)
+                    except FileExistsError:
+                        # Object was added concurrently
+                        pass
+                    else:
+                        files[relpath] = digest
+                        stats[relpath] = file_stat(path)
+                        continue
+                tmp = path.with_name(f".{filename}.store")
+                with contextlib.suppress(FileNotFoundError):
+                    tmp.unlink()
+                clone_file(target, tmp)
+                os.replace(tmp, path)
+            except OSError:
+                # Keep a private copy when file cannot be linked (for example
+                # when store is located on another filesystem)
+                stats[relpath] = file_stat(path)
+                continue
+            files[relpath] = digest
+            stats[relpath] = file_stat(path)
+    registry.parent.mkdir(parents=True, exist_ok=True)
+    tmp = registry.with_name(f".{registry.name}.{os.getpid()}")
+    tmp.write_text(
+        json.dumps({"venv": VENV_DIR.as_posix(), "files": files, "stats": stats})
+    )
+    os.replace(tmp, registry)
+
+
+def collect_store_garbage(store: pathlib.Path) -> None:
+    """Remove store objects which are not used by any existing virtualenv.
+
+    Removing an object which is still linked from a virtualenv only loses sharing,
+    since the virtualenv keeps its own link to the file content.
+    """
+    used: t.Set[str] = set()
+    for registry in store.glob("venvs/*.json"):
+        content = json.loads(registry.read_text())
+        if pathlib.Path(content["venv"]).is_dir():
+            used.update(content["files"].values())
+        else:
+            registry.unlink()
+    removed = 0
+    for path in store.glob("objects/*/*"):
+        if path.parent.name + path.name not in used:
+            path.unlink()
+            removed += 1
+    print(f"Removed {removed} unused files from {store}")
+
+
 cli_parser = argparse.ArgumentParser(
     description=(
         "Create or update virtual environment in project root directory then "
@@ -113,6 +355,58 @@ cli_parser.add_argument(
     default=False,
     help="Show path to python interpreter within virtual environment and exit",
 )
+cli_parser.add_argument(
+    "--no-install",
+    action="store_true",
+    required=False,
+    default=False,
+    help="Create or update virtual environment and exit without installing project",
+)
+cli_parser.add_argument(
+    "--no-virtualenv",
+    action="store_true",
+    required=False,
+    default=False,
+    help="Install project within existing virtual environment without updating it",
+)
+cli_parser.add_argument(
+    "--wheelhouse",
+    type=pathlib.Path,
+    required=False,
+    default=None,
+    help="Install from wheels found in given directory without accessing package index",
+)
+cli_parser.add_argument(
+    "--store",
+    type=pathlib.Path,
+    required=False,
+    default=os.environ.get("INSTALL_STORE"),
+    help=(
+        "Link files installed in virtual environment to identical files found in "
+        "this shared directory (defaults to INSTALL_STORE environment variable)"
+    ),
+)
+cli_parser.add_argument(
+    "--gc-store",
+    action="store_true",
+    required=False,
+    default=False,
+    help="Remove files from store which are no longer used by any virtual environment and exit",
+)
+cli_parser.add_argument(
+    "--force",
+    action="store_true",
+    required=False,
+    default=False,
+    help="Run every installation step even when its inputs did not change",
+)
+cli_parser.add_argument(
+    "--timings",
+    type=pathlib.Path,
+    required=False,
+    default=None,
+    help="Write duration of each installation phase into given JSON file",
+)
 
 if __name__ == "__main__":
     args = cli_parser.parse_args()
@@ -120,10 +414,32 @@ if __name__ == "__main__":
     if args.show_python_path:
         print(VENV_PYTHON.as_posix())
         sys.exit(0)
+    # Collect store garbage
+    if args.gc_store:
+        if not args.store:
+            cli_parser.error("--gc-store requires --store or INSTALL_STORE")
+        collect_store_garbage(pathlib.Path(args.store).expanduser())
+        sys.exit(0)
     # Parse arguments
     extras = set(args.extras.split(",")) if args.extras else set()
+    # Steps are skipped when their inputs did not change since last successful run
+    previous = {} if args.force else read_fingerprint()
     # First make sure virtualenv exists
-    install_virtualenv()
+    if not args.no_virtualenv:
+        current = {"interpreter": interpreter_fingerprint()}
+        changed = changed_inputs(previous.get("virtualenv"), current)
+        if not VENV_PYTHON.exists():
+            changed = ["virtualenv missing"]
+        if changed:
+            print(f"Updating virtual environment (changed: {', '.join(changed)})")
+            install_virtualenv(args.wheelhouse)
+            write_fingerprint("virtualenv", current)
+        else:
+            print("Virtual environment is up to date")
+    if args.no_install:
+        if args.timings:
+            write_timings(args.timings)
+        sys.exit(0)
     # Gather extras
     if not args.no_build:
         extras = extras.union(set(["build"]))
@@ -134,4 +450,22 @@ if __name__ == "__main__":
     if args.all:
         extras = extras.union(set(["dev", "docs", "build"]))
     # Install project in development mode
-    install_project(",".join(extras))
+    current = install_fingerprint(extras)
+    changed = changed_inputs(previous.get("install"), current)
+    if changed:
+        print(f"Installing project (changed: {', '.join(changed)})")
+        install_project(",".join(sorted(extras)), args.wheelhouse)
+        # Record inputs read before installing, so that inputs updated while
+        # installing trigger a new installation on next run
+        write_fingerprint("install", current)
+    else:
+        print("Project installation is up to date")
+    # Deduplicate installed files
+    if args.store:
+        store = pathlib.Path(args.store).expanduser().resolve()
+        if changed or previous.get("store") != store.as_posix():
+            with timed("store"):
+                link_to_store(store)
+            write_fingerprint("store", store.as_posix())
+    if args.timings:
+        write_timings(args.timings)
@@ -1,12 +1,87 @@
+import abc
+import configparser
+import contextlib
+import ctypes
+import functools
+import hashlib
+import inspect
+import io
+import json
+import math
 import os
+import platform
+import re
+import select
+import sqlite3
+import statistics
+import struct
+import sys
+import tempfile
+import threading
+import time
 import typing as t
+import xml.etree.ElementTree as ET
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
 from pathlib import Path
-from shlex import quote
-from shutil import rmtree
+from shlex import quote, split
+from shutil import copy2, rmtree
 
 from invoke import Context, task
+from invoke.exceptions import Exit, UnexpectedExit
+from invoke.runners import Result
 
 VENV_DIR = Path(__file__).parent.resolve(True) / ".venv"
+# Cache shared by all projects (point TASKS_CACHE_DIR to a shared path in CI)
+CACHE_DIR = Path(
+    os.environ.get(
+        "TASKS_CACHE_DIR",
+        Path(os.environ.get("XDG_CACHE_HOME", "~/.cache"), "invoke-tasks"),
+    )
+).expanduser()
+# Results of tasks, replayed when task inputs did not change (set TASKS_NO_CACHE=1
+# to disable). Least recently used results are evicted once cache exceeds
+# TASKS_CACHE_MAX_SIZE (MiB) or when they were not used for TASKS_CACHE_MAX_AGE days.
+RESULTS_DIR = CACHE_DIR / "results"
+RESULTS_MAX_SIZE = int(os.environ.get("TASKS_CACHE_MAX_SIZE", "512")) * 1024 * 1024
+RESULTS_MAX_AGE = float(os.environ.get("TASKS_CACHE_MAX_AGE", "30")) * 24 * 3600
+# Running total size of stored results and time of last eviction
+RESULTS_USAGE_FILE = RESULTS_DIR / "usage.json"
+# Duration and resources used by each task run (set TASKS_HISTORY_FILE to an empty
+# string to disable)
+HISTORY_FILE = os.environ.get(
+    "TASKS_HISTORY_FILE",
+    Path(__file__).parent.joinpath(".tasks-history.sqlite").as_posix(),
+)
+# Environment variables read by tools which may change their results, as prefixes
+TOOL_ENV_PREFIXES = (
+    "PYTEST_",
+    "COVERAGE_",
+    "MYPY",
+    "PYTHON",
+    "NO_COLOR",
+    "FORCE_COLOR",
+)
+# Configuration files which may affect any tool
+CONFIG_FILES = ("pyproject.toml", "setup.cfg", ".coveragerc")
+# Directories never holding task inputs (in addition to hidden directories)
+IGNORED_DIRS = {"build", "dist", "coverage-report", "site", "__pycache__"}
+# Source files executed by each test, recorded from coverage data
+IMPACT_FILE = Path(".test-impact.json")
+# Durations of tests used to balance shards (commit it to balance CI jobs)
+DURATIONS_FILE = Path(".test-durations.json")
+# Reports of shards run concurrently, merged once all shards are done
+SHARDS_DIR = Path(".test-shards")
+# Baselines of benchmarks (commit them), and results of last runs in runs/ directory
+BENCH_DIR = Path(".benchmarks")
+# Number of results replayed from cache by current thread
+REPLAYED = threading.local()
+# Run isort, black, flake8 and mypy within the interpreter running tasks instead of
+# spawning a process for each command (set TASKS_IN_PROCESS=1 to enable)
+IN_PROCESS = bool(os.environ.get("TASKS_IN_PROCESS"))
+# Held while standard streams are redirected by tools run in process, or written
+# to by concurrent tasks
+OUTPUT_LOCK = threading.Lock()
 
 if os.name == "nt":
     VENV_PYTHON = VENV_DIR.joinpath("Scripts/python.exe").as_posix()
@@ -14,11 +89,1299 @@ else:
     VENV_PYTHON = VENV_DIR.joinpath("bin/python").as_posix()
 
 
-def run_or_display(c: Context, cmd: str, dry_run: bool):
+def run_or_display(
+    c: Context, cmd: str, dry_run: bool, env: t.Optional[t.Dict[str, str]] = None
+):
     if dry_run:
         print(cmd)
     else:
-        c.run(cmd)
+        run_command(c, cmd, env=env)
+
+
+class BufferedContext(Context):
+    """Context collecting output of commands instead of printing it.
+
+    Used to run tasks concurrently without interleaving their output.
+    """
+
+    def __init__(self, c: Context) -> None:
+        super().__init__(config=c.config)
+        self._set(output=io.StringIO())
+
+    def run(self, command: str, **kwargs: t.Any) -> t.Any:
+        kwargs.setdefault("hide", True)
+        kwargs.setdefault("in_stream", False)
+        try:
+            result = super().run(command, **kwargs)
+        except UnexpectedExit as exc:
+            self.output.write(exc.result.stdout + exc.result.stderr)
+            raise
+        self.output.write(result.stdout + result.stderr)
+        return result
+
+
+class Step(t.NamedTuple):
+    """A task run by the scheduler along with its dependencies and effects.
+
+    Paths read and written by a step are relative to project root. Steps
+    writing a path never run concurrently with steps reading or writing it.
+    """
+
+    name: str
+    action: t.Callable[[Context], t.Any]
+    requires: t.Tuple[str, ...] = ()
+    reads: t.Tuple[str, ...] = (".",)
+    writes: t.Tuple[str, ...] = ()
+
+
+def overlaps(paths: t.Iterable[str], others: t.Iterable[str]) -> bool:
+    """Check if any path contains or is contained by any other path."""
+    for path in paths:
+        for other in others:
+            if path == "." or other == "." or path == other:
+                return True
+            if path.startswith(other + "/") or other.startswith(path + "/"):
+                return True
+    return False
+
+
+def conflicts(step: Step, other: Step) -> bool:
+    return overlaps(step.writes, other.reads + other.writes) or overlaps(
+        other.writes, step.reads + step.writes
+    )
+
+
+def run_steps(c: Context, steps: t.List[Step], jobs: int = 0) -> None:
+    """Run steps concurrently, at most `jobs` at once (number of CPUs by default).
+
+    A step starts once the steps it requires succeeded and no running step
+    conflicts with it, in the order of the list. Output of each step is printed
+    as a whole once it is done. Steps requiring a failed step are skipped, other
+    steps still run, and Exit is raised when any step failed.
+    """
+    jobs = jobs or os.cpu_count() or 1
+    pending = list(steps)
+    running: t.Dict["Future[t.Any]", t.Tuple[Step, BufferedContext, float]] = {}
+    succeeded: t.Set[str] = set()
+    failed: t.List[str] = []
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        while pending or running:
+            for step in list(pending):
+                if len(running) >= jobs:
+                    break
+                if any(name in failed for name in step.requires):
+                    print(f"--- {step.name}: skipped (requires failed step)")
+                    pending.remove(step)
+                    failed.append(step.name)
+                elif set(step.requires) <= succeeded and not any(
+                    conflicts(step, other) for other, _, _ in running.values()
+                ):
+                    context = BufferedContext(c)
+                    future = executor.submit(step.action, context)
+                    running[future] = (step, context, time.perf_counter())
+                    pending.remove(step)
+            if not running:
+                if pending:
+                    raise Exit(f"Cannot schedule steps: {[s.name for s in pending]}")
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                step, context, start = running.pop(future)
+                error = future.exception()
+                status = "failed" if error else "ok"
+                duration = time.perf_counter() - start
+                with OUTPUT_LOCK:
+                    print(f"--- {step.name}: {status} ({duration:.2f}s)")
+                    sys.stdout.write(context.output.getvalue())
+                    if error and not isinstance(error, UnexpectedExit):
+                        print(f"{type(error).__name__}: {error}")
+                    sys.stdout.flush()
+                if error:
+                    failed.append(step.name)
+                else:
+                    succeeded.add(step.name)
+    if failed:
+        raise Exit(f"Failed steps: {', '.join(failed)}", code=1)
+
+
+def is_ignored_directory(name: str) -> bool:
+    return name.startswith(".") or name in IGNORED_DIRS or name.endswith(".egg-info")
+
+
+def project_files(*roots: str, suffixes: t.Tuple[str, ...] = ()) -> t.List[Path]:
+    """List files found under roots, optionally filtered by suffix.
+
+    Hidden directories (such as .venv or .git) and build artifacts are ignored.
+    """
+    files: t.List[Path] = []
+    for root in roots:
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames[:] = [name for name in dirnames if not is_ignored_directory(name)]
+            files.extend(
+                Path(os.path.normpath(os.path.join(dirpath, name)))
+                for name in filenames
+                if not suffixes or name.endswith(suffixes)
+            )
+    return files
+
+
+def config_files(*names: str) -> t.List[Path]:
+    return [Path(name) for name in CONFIG_FILES + names if Path(name).is_file()]
+
+
+def installed_distributions() -> t.List[str]:
+    """Names of distributions installed in virtual environment (including versions)."""
+    return sorted(
+        path.name
+        for pattern in ("lib/python*/site-packages", "Lib/site-packages")
+        for path in VENV_DIR.glob(f"{pattern}/*.dist-info")
+    )
+
+
+def result_key(
+    cmd: str, inputs: t.Iterable[Path], env: t.Optional[t.Dict[str, str]] = None
+) -> str:
+    """Hash of command, tool environment variables, installed tools and input files.
+
+    Only environment variables read by tools (see TOOL_ENV_PREFIXES) and variables
+    added to the environment of the command are part of the key.
+    """
+    digest = hashlib.sha256()
+    environment = {
+        name: value
+        for name, value in os.environ.items()
+        if name.startswith(TOOL_ENV_PREFIXES)
+    }
+    header = {
+        "command": cmd.replace(VENV_PYTHON, "python"),
+        "environment": {**environment, **(env or {})},
+        "python": venv_python_version(),
+        "platform": [platform.system(), platform.machine()],
+        "distributions": installed_distributions(),
+    }
+    digest.update(json.dumps(header, sort_keys=True).encode())
+    for path in sorted(set(inputs)):
+        digest.update(path.as_posix().encode() + b"\0")
+        digest.update(hashlib.sha256(path.read_bytes()).digest())
+    return digest.hexdigest()
+
+
+def evict_results() -> int:
+    """Remove results unused for too long, then least recently used results.
+
+    Return total size of remaining results.
+    """
+    entries = []
+    for result_file in RESULTS_DIR.glob("*/result.json"):
+        entry = result_file.parent
+        size = sum(path.stat().st_size for path in entry.rglob("*") if path.is_file())
+        entries.append((result_file.stat().st_mtime, size, entry))
+    entries.sort()
+    total = sum(size for _, size, _ in entries)
+    now = time.time()
+    for used, size, entry in entries:
+        if now - used < RESULTS_MAX_AGE and total <= RESULTS_MAX_SIZE:
+            break
+        rmtree(entry, ignore_errors=True)
+        total -= size
+    return total
+
+
+def track_results_size(added: int) -> None:
+    """Add size of a stored result to running total, evicting results when needed.
+
+    Results directory is only walked when total may exceed maximum size, or
+    once a day to evict results unused for too long.
+    """
+    try:
+        usage = json.loads(RESULTS_USAGE_FILE.read_text())
+    except (OSError, ValueError):
+        usage = {"total": 0, "evicted": 0}
+    usage["total"] += added
+    now = time.time()
+    if usage["total"] > RESULTS_MAX_SIZE or now - usage["evicted"] > 24 * 3600:
+        usage = {"total": evict_results(), "evicted": now}
+    RESULTS_USAGE_FILE.write_text(json.dumps(usage))
+
+
+def write_output(c: Context, stdout: str, stderr: str) -> None:
+    if isinstance(c, BufferedContext):
+        c.output.write(stdout + stderr)
+    else:
+        sys.stdout.write(stdout)
+        sys.stderr.write(stderr)
+
+
+def run_isort(args: t.List[str]) -> t.Optional[int]:
+    import isort.main
+
+    isort.main.main(args)
+    return 0
+
+
+def run_black(args: t.List[str]) -> t.Optional[int]:
+    import black
+
+    # Click commands always exit in standalone mode
+    black.main.main(args=args, prog_name="black")
+
+
+def run_flake8(args: t.List[str]) -> t.Optional[int]:
+    import flake8.main.cli
+
+    return int(flake8.main.cli.main(args))
+
+
+def run_mypy(args: t.List[str]) -> t.Optional[int]:
+    from mypy import api
+
+    stdout, stderr, exit_status = api.run(args)
+    sys.stdout.write(stdout)
+    sys.stderr.write(stderr)
+    return exit_status
+
+
+# Entrypoints of tools which can run in process, taking command line arguments
+IN_PROCESS_TOOLS: t.Dict[str, t.Callable[[t.List[str]], t.Optional[int]]] = {
+    "isort": run_isort,
+    "black": run_black,
+    "flake8": run_flake8,
+    "mypy": run_mypy,
+}
+
+
+def run_in_process(tool: str, args: t.List[str]) -> t.Tuple[str, str, int]:
+    """Run tool within current interpreter and return its output and exit code.
+
+    Tool modules are imported once and reused by later commands.
+    """
+    # Some tools write bytes to the underlying buffer of standard streams
+    buffers = io.BytesIO(), io.BytesIO()
+    stdout, stderr = (
+        io.TextIOWrapper(buffer, encoding="utf-8", write_through=True)
+        for buffer in buffers
+    )
+    with OUTPUT_LOCK:
+        with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+            try:
+                code = IN_PROCESS_TOOLS[tool](args) or 0
+            except SystemExit as exc:
+                if exc.code is None or isinstance(exc.code, int):
+                    code = exc.code or 0
+                else:
+                    # Interpreter prints message of SystemExit and exits with code 1
+                    print(exc.code, file=sys.stderr)
+                    code = 1
+    return buffers[0].getvalue().decode(), buffers[1].getvalue().decode(), code
+
+
+def run_command(
+    c: Context,
+    cmd: str,
+    warn: bool = False,
+    env: t.Optional[t.Dict[str, str]] = None,
+) -> Result:
+    """Run command, within current interpreter when possible in in-process mode.
+
+    Commands running a tool found in IN_PROCESS_TOOLS with `python -m` are run
+    in process when the interpreter running tasks is the one of the virtual
+    environment, and produce same output and exit code as a subprocess.
+    Commands requiring additional environment variables, or run by steps of the
+    scheduler (tools such as black install signal handlers, which only works in
+    main thread), always run in a subprocess.
+    """
+    prefix = f"{VENV_PYTHON} -m "
+    if (
+        env
+        or not IN_PROCESS
+        or threading.current_thread() is not threading.main_thread()
+        or not cmd.startswith(prefix)
+        or Path(sys.prefix).resolve() != VENV_DIR
+    ):
+        return c.run(cmd, warn=warn, env=env or {})
+    tool, *args = split(cmd[len(prefix) :])
+    if tool not in IN_PROCESS_TOOLS:
+        return c.run(cmd, warn=warn)
+    stdout, stderr, exited = run_in_process(tool, args)
+    write_output(c, stdout, stderr)
+    result = Result(stdout=stdout, stderr=stderr, command=cmd, exited=exited)
+    if exited and not warn:
+        raise UnexpectedExit(result)
+    return result
+
+
+def cached_run(
+    c: Context,
+    cmd: str,
+    inputs: t.Iterable[Path],
+    outputs: t.Iterable[str] = (),
+    dry_run: bool = False,
+    no_cache: bool = False,
+    cache_failures: bool = True,
+    env: t.Optional[t.Dict[str, str]] = None,
+) -> None:
+    """Run command, or replay its result when it already ran with same inputs.
+
+    Output and exit code of command are stored in cache, along with files
+    matching `outputs` glob patterns, which are restored when result is replayed.
+    Failures are not stored when `cache_failures` is False (for commands which
+    may fail for reasons other than their inputs, such as flaky tests).
+    Variables found in `env` are added to the environment of the command.
+    """
+    if dry_run or no_cache or os.environ.get("TASKS_NO_CACHE"):
+        run_or_display(c, cmd, dry_run=dry_run, env=env)
+        return
+    entry = RESULTS_DIR / result_key(cmd, inputs, env)
+    result_file = entry / "result.json"
+    if result_file.is_file():
+        stored = json.loads(result_file.read_text())
+        for name in stored["artifacts"]:
+            Path(name).parent.mkdir(parents=True, exist_ok=True)
+            copy2(entry / "artifacts" / name, name)
+        # Mark result as recently used
+        os.utime(result_file)
+        REPLAYED.count = getattr(REPLAYED, "count", 0) + 1
+        write_output(c, stored["stdout"], stored["stderr"])
+        if stored["exited"]:
+            raise UnexpectedExit(
+                Result(
+                    stdout=stored["stdout"],
+                    stderr=stored["stderr"],
+                    command=cmd,
+                    exited=stored["exited"],
+                )
+            )
+        return
+    result = run_command(c, cmd, warn=True, env=env)
+    if result.exited and not cache_failures:
+        raise UnexpectedExit(result)
+    artifacts = sorted(
+        {path for pattern in outputs for path in Path().glob(pattern) if path.is_file()}
+    )
+    # Store result into a temporary directory first so that entries are never partial
+    RESULTS_DIR.mkdir(parents=True, exist_ok=True)
+    tmpdir = Path(tempfile.mkdtemp(dir=RESULTS_DIR, prefix=".tmp-"))
+    for path in artifacts:
+        target = tmpdir / "artifacts" / path
+        target.parent.mkdir(parents=True, exist_ok=True)
+        copy2(path, target)
+    tmpdir.joinpath("result.json").write_text(
+        json.dumps(
+            {
+                "command": cmd,
+                "exited": result.exited,
+                "stdout": result.stdout,
+                "stderr": result.stderr,
+                "artifacts": [path.as_posix() for path in artifacts],
+            }
+        )
+    )
+    size = sum(path.stat().st_size for path in tmpdir.rglob("*") if path.is_file())
+    try:
+        tmpdir.rename(entry)
+    except OSError:
+        # Result was stored concurrently
+        rmtree(tmpdir, ignore_errors=True)
+    else:
+        track_results_size(size)
+    if result.exited:
+        raise UnexpectedExit(result)
+
+
+def children_usage() -> t.Tuple[float, float]:
+    """CPU time (seconds) and peak RSS (MiB) of child processes waited for so far."""
+    if sys.platform == "win32":
+        return 0.0, 0.0
+    import resource
+
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    # ru_maxrss is expressed in bytes on macOS and in kilobytes elsewhere
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return usage.ru_utime + usage.ru_stime, usage.ru_maxrss / scale
+
+
+def open_history() -> sqlite3.Connection:
+    connection = sqlite3.connect(HISTORY_FILE, timeout=5)
+    connection.execute(
+        "CREATE TABLE IF NOT EXISTS runs ("
+        " started REAL, task TEXT, arguments TEXT,"
+        " wall REAL, cpu REAL, maxrss REAL, exit_code INTEGER, cached INTEGER"
+        ")"
+    )
+    return connection
+
+
+def format_arguments(arguments: t.Dict[str, t.Any]) -> str:
+    """Format task arguments as command line options."""
+    options = []
+    for name, value in sorted(arguments.items()):
+        flag = "--" + name.replace("_", "-")
+        if value is True:
+            options.append(flag)
+        elif value is False:
+            options.append(f"--no-{flag[2:]}")
+        else:
+            options.append(f"{flag}={value}")
+    return " ".join(options)
+
+
+def recorded(func: t.Callable[..., t.Any]) -> t.Callable[..., t.Any]:
+    """Record duration and resources used by a task into history.
+
+    Dry runs and runs stopping the mypy daemon are not recorded, nor are tasks run
+    by other tasks from worker threads (such as pre-push checks) since usage of
+    child processes is only available for the whole process. For the same reason,
+    peak memory is only recorded when a child process of the task exceeded the
+    peak of all child processes waited for before the task (it is unknown
+    otherwise). Only arguments which differ from their default value are
+    recorded. Runs which replayed results from cache are flagged as cached.
+    """
+    signature = inspect.signature(func)
+
+    @functools.wraps(func)
+    def wrapper(c: Context, *args: t.Any, **kwargs: t.Any) -> t.Any:
+        bound = signature.bind(c, *args, **kwargs)
+        if (
+            not HISTORY_FILE
+            or bound.arguments.get("dry_run")
+            or bound.arguments.get("stop_daemon")
+            or threading.current_thread() is not threading.main_thread()
+        ):
+            return func(c, *args, **kwargs)
+        arguments = {
+            name: value
+            for name, value in list(bound.arguments.items())[1:]
+            if value != signature.parameters[name].default
+        }
+        started = time.time()
+        start = time.perf_counter()
+        cpu_before, maxrss_before = children_usage()
+        replayed = getattr(REPLAYED, "count", 0)
+        exit_code = 1
+        try:
+            result = func(c, *args, **kwargs)
+            exit_code = 0
+            return result
+        except UnexpectedExit as exc:
+            exit_code = exc.result.exited
+            raise
+        except Exit as exc:
+            exit_code = exc.code
+            raise
+        except KeyboardInterrupt:
+            exit_code = 130
+            raise
+        finally:
+            wall = time.perf_counter() - start
+            cpu, maxrss = children_usage()
+            try:
+                with contextlib.closing(open_history()) as connection, connection:
+                    connection.execute(
+                        "INSERT INTO runs VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                        (
+                            started,
+                            func.__name__,
+                            format_arguments(arguments),
+                            wall,
+                            cpu - cpu_before,
+                            maxrss if maxrss > maxrss_before else None,
+                            exit_code,
+                            getattr(REPLAYED, "count", 0) > replayed,
+                        ),
+                    )
+            except sqlite3.Error as exc:
+                print(f"Failed to record task history: {exc}", file=sys.stderr)
+
+    return wrapper
+
+
+def percentile(values: t.List[float], percent: float) -> float:
+    """Nearest-rank percentile of values."""
+    ordered = sorted(values)
+    return ordered[max(math.ceil(percent / 100 * len(ordered)) - 1, 0)]
+
+
+def trend(values: t.List[float]) -> str:
+    """Relative change of median between latest runs and runs preceding them."""
+    window = min(len(values) // 2, 10)
+    if window < 2:
+        return "-"
+    previous = statistics.median(values[-2 * window : -window])
+    latest = statistics.median(values[-window:])
+    if not previous:
+        return "-"
+    return f"{(latest - previous) / previous:+.0%}"
+
+
+def mypy_cache_dir() -> Path:
+    """Cache directory shared by worktrees of project using the same mypy version.
+
+    Cache entries are keyed on module names, so projects holding modules with
+    the same name (such as their top-level package) never share a cache.
+    """
+    versions = [name for name in installed_distributions() if name.startswith("mypy-")]
+    version = versions[0][:-10] if versions else "default"
+    return CACHE_DIR / "mypy" / (project_name() or "default") / version
+
+
+def start_mypy_daemon(c: Context) -> bool:
+    """Start mypy daemon unless it is running, and return whether it is available.
+
+    Daemon does not reload configuration, so it is restarted when configuration
+    files changed after it started.
+    """
+    dmypy = f"{VENV_PYTHON} -m mypy.dmypy"
+    status_file = Path(".dmypy.json")
+    if status_file.is_file() and any(
+        path.stat().st_mtime > status_file.stat().st_mtime for path in config_files()
+    ):
+        c.run(f"{dmypy} stop", hide=True, warn=True)
+    if c.run(f"{dmypy} status", hide=True, warn=True).ok:
+        return True
+    return bool(c.run(f"{dmypy} start", hide=True, warn=True).ok)
+
+
+def changed_files(
+    c: Context,
+    base: str = "",
+    staged: bool = False,
+    patterns: t.Tuple[str, ...] = ("*.py", "*.pyi"),
+    deleted: bool = False,
+) -> t.List[str]:
+    """List files matching patterns changed since base ref, or staged files.
+
+    Base ref defaults to the merge-base of HEAD and main branch. Changes of
+    worktree and untracked files are included unless only staged files are
+    requested. Deleted files are only listed when `deleted` is True.
+    """
+
+    def git(args: str) -> Result:
+        return c.run(f"git {args}", hide=True, warn=True, in_stream=False)
+
+    pathspec = "-- " + " ".join(quote(pattern) for pattern in patterns)
+    diff = "diff --name-only --relative --diff-filter=ACMR" + ("D" if deleted else "")
+    if staged:
+        commands = [f"{diff} --cached {pathspec}"]
+    else:
+        if base:
+            result = git(f"rev-parse -q --verify {quote(base)}")
+            if result.failed:
+                raise Exit(f"Unknown base ref: {base}")
+        else:
+            result = git("merge-base HEAD main")
+            if result.failed:
+                raise Exit("Cannot find merge-base with main branch, use --base option")
+        commands = [
+            f"{diff} {result.stdout.strip()} {pathspec}",
+            f"ls-files --others --exclude-standard {pathspec}",
+        ]
+    files: t.Set[str] = set()
+    for args in commands:
+        result = git(args)
+        if result.failed:
+            raise UnexpectedExit(result)
+        files.update(name for name in result.stdout.splitlines() if name)
+    return sorted(files)
+
+
+def file_digest(path: Path) -> t.Optional[str]:
+    if not path.is_file():
+        return None
+    return hashlib.sha256(path.read_bytes()).hexdigest()
+
+
+def impact_config_files() -> t.List[Path]:
+    """Files affecting every test: configuration, conftest and test helper modules.
+
+    Coverage is only measured for source files, so modules found under tests
+    which are not test modules are never attributed to tests.
+    """
+    helpers = [
+        path
+        for path in project_files("tests", suffixes=(".py",))
+        if not is_test_file(path)
+    ]
+    return config_files("conftest.py") + helpers
+
+
+def is_test_file(path: Path) -> bool:
+    return path.suffix == ".py" and (
+        path.name.startswith("test_") or path.stem.endswith("_test")
+    )
+
+
+def covered_files(data_file: Path) -> t.Tuple[t.Dict[str, t.Set[str]], t.Set[str]]:
+    """Map tests to source files they executed, according to coverage data.
+
+    Coverage must be measured with test contexts (pytest --cov-context=test).
+    Files executed outside of tests (such as modules imported during collection)
+    are returned separately since they may affect any test.
+    """
+    query = (
+        "SELECT context.context, file.path FROM {table}"
+        " JOIN context ON context.id = {table}.context_id"
+        " JOIN file ON file.id = {table}.file_id"
+    )
+    tests: t.Dict[str, t.Set[str]] = {}
+    imported: t.Set[str] = set()
+    with contextlib.closing(sqlite3.connect(data_file)) as connection:
+        for table in ("line_bits", "arc"):
+            for context, path in connection.execute(query.format(table=table)):
+                if context:
+                    # Contexts are node ids suffixed with test phase
+                    nodeid = context.rsplit("|", 1)[0]
+                    tests.setdefault(nodeid, set()).add(path)
+                else:
+                    imported.add(path)
+    return tests, imported
+
+
+def record_test_impact(tests: t.List[str], roots: t.List[str]) -> None:
+    """Record source files executed by tests which just ran with coverage.
+
+    Each test is recorded along with the digests of the files it executed, so
+    that it is only affected by later changes of these files. Digests of test
+    modules which ran entirely and of files executed outside of tests are
+    recorded as well, and configuration digests are only recorded after a full
+    run.
+    """
+    data_file = Path(".coverage")
+    if not data_file.is_file():
+        return
+    impact = json.loads(IMPACT_FILE.read_text()) if IMPACT_FILE.is_file() else {}
+    covered, imported = covered_files(data_file)
+    for nodeid, paths in covered.items():
+        impact.setdefault("tests", {})[nodeid] = {
+            path: file_digest(Path(path)) for path in sorted(paths)
+        }
+    full = tests == roots
+    digests = {path: file_digest(Path(path)) for path in sorted(imported)}
+    if full:
+        impact["imports"] = digests
+    else:
+        impact.setdefault("imports", {}).update(digests)
+    modules = project_files(*roots) if full else [Path(name) for name in tests]
+    impact.setdefault("modules", {}).update(
+        {path.as_posix(): file_digest(path) for path in modules if is_test_file(path)}
+    )
+    if full or "config" not in impact:
+        impact["config"] = {
+            path.as_posix(): file_digest(path) for path in impact_config_files()
+        }
+    IMPACT_FILE.write_text(json.dumps(impact, indent=2, sort_keys=True))
+
+
+def affected_tests(c: Context, roots: t.List[str], since: str) -> t.List[str]:
+    """Select tests affected by changes since they were recorded, or since a git ref.
+
+    Tests executing changed files, new or changed test modules and tests which
+    failed during last run are selected. Roots are returned (all tests are run)
+    when no impact data is recorded, when configuration, conftest or test helper
+    modules changed, or when files executed outside of tests (such as module
+    level statements run while tests are collected) changed.
+    """
+    if not IMPACT_FILE.is_file():
+        print("No test impact recorded yet, running all tests", file=sys.stderr)
+        return roots
+    impact = json.loads(IMPACT_FILE.read_text())
+    tests: t.Dict[str, t.Dict[str, t.Optional[str]]] = impact.get("tests", {})
+    modules: t.Dict[str, t.Optional[str]] = impact.get("modules", {})
+    imports: t.Dict[str, t.Optional[str]] = impact.get("imports", {})
+    config = {path.as_posix() for path in impact_config_files()} | set(impact["config"])
+    if since:
+        changed = set(changed_files(c, base=since, patterns=("*",), deleted=True))
+        config_changed = not changed.isdisjoint(config)
+        imports_changed = not changed.isdisjoint(imports)
+    else:
+        changed = {
+            path
+            for digests in (modules, *tests.values())
+            for path, digest in digests.items()
+            if file_digest(Path(path)) != digest
+        }
+        config_changed = any(
+            file_digest(Path(path)) != impact["config"].get(path) for path in config
+        )
+        imports_changed = any(
+            file_digest(Path(path)) != digest for path, digest in imports.items()
+        )
+    if config_changed:
+        print(
+            "Configuration or test helpers changed, running all tests", file=sys.stderr
+        )
+        return roots
+    if imports_changed:
+        print("Modules imported by tests changed, running all tests", file=sys.stderr)
+        return roots
+    return tests_affected_by(changed, tests, modules, roots)
+
+
+def tests_affected_by(
+    changed: t.Set[str],
+    tests: t.Dict[str, t.Dict[str, t.Optional[str]]],
+    modules: t.Dict[str, t.Optional[str]],
+    roots: t.List[str],
+) -> t.List[str]:
+    """Select tests affected by changed files according to recorded impact.
+
+    Tests executing changed files, new or changed test modules and tests which
+    failed during last run are selected.
+    """
+    # Whole modules are selected when they are new or changed
+    selected = {
+        path.as_posix()
+        for path in project_files(*roots)
+        if is_test_file(path)
+        and (path.as_posix() not in modules or path.as_posix() in changed)
+    }
+    nodeids = {
+        nodeid for nodeid, digests in tests.items() if not changed.isdisjoint(digests)
+    }
+    lastfailed = Path(".pytest_cache/v/cache/lastfailed")
+    if lastfailed.is_file():
+        nodeids.update(json.loads(lastfailed.read_text()))
+    for nodeid in nodeids:
+        module = nodeid.split("::", 1)[0]
+        if module not in selected and Path(module).is_file():
+            if any(module.startswith(root) for root in roots):
+                selected.add(nodeid)
+    return sorted(selected)
+
+
+def collect_command(cmd: str, args: t.List[str]) -> str:
+    """Command listing node ids of tests which would be run by pytest command."""
+    # Options from configuration (such as verbosity) change collection output
+    arguments = " ".join(quote(arg) for arg in args)
+    return f"{cmd} --collect-only -q -o addopts= {arguments}"
+
+
+def collect_tests(c: Context, cmd: str, args: t.List[str]) -> t.List[str]:
+    """Collect node ids of tests which would be run by pytest command."""
+    result = c.run(collect_command(cmd, args), hide=True, warn=True, in_stream=False)
+    # Exit code 5 means that no test was collected
+    if result.exited not in (0, 5):
+        raise UnexpectedExit(result)
+    return [line for line in result.stdout.splitlines() if "::" in line]
+
+
+def parse_shard(shard: str) -> t.Tuple[int, int]:
+    """Parse shard given as "i/N" and return its index (starting at 0) and count."""
+    match = re.fullmatch(r"(\d+)/(\d+)", shard)
+    if not match or not 1 <= int(match.group(1)) <= int(match.group(2)):
+        raise Exit(f"Invalid shard: {shard} (expected i/N with 1 <= i <= N)")
+    return int(match.group(1)) - 1, int(match.group(2))
+
+
+def balance_tests(tests: t.List[str], count: int) -> t.List[t.List[str]]:
+    """Split tests into shards with similar total durations.
+
+    Tests are assigned from the slowest to the fastest, each one to the shard
+    with the lowest total duration, so that shards run slowest tests first.
+    Tests without recorded duration are assumed to last the average duration.
+    """
+    durations = (
+        json.loads(DURATIONS_FILE.read_text()) if DURATIONS_FILE.is_file() else {}
+    )
+    known = [durations[test] for test in tests if test in durations]
+    default = statistics.mean(known) if known else 1.0
+    shards: t.List[t.List[str]] = [[] for _ in range(count)]
+    totals = [0.0] * count
+    for test in sorted(tests, key=lambda test: (-durations.get(test, default), test)):
+        index = totals.index(min(totals))
+        shards[index].append(test)
+        totals[index] += durations.get(test, default)
+    return shards
+
+
+def junit_key(nodeid: str) -> t.Tuple[str, str]:
+    """Class name and name of test case reported by pytest in junit reports."""
+    path, *names = nodeid.split("::")
+    module = path[:-3] if path.endswith(".py") else path
+    return ".".join([module.replace("/", "."), *names[:-1]]), names[-1]
+
+
+def record_durations(reports: t.List[Path], tests: t.List[str]) -> None:
+    """Record durations of tests found in junit reports.
+
+    Recorded durations are only replaced when they differ by more than 20% (and
+    50 ms), so that the committed file does not change on every run.
+    """
+    keys = {junit_key(test): test for test in tests}
+    recorded = (
+        json.loads(DURATIONS_FILE.read_text()) if DURATIONS_FILE.is_file() else {}
+    )
+    durations = dict(recorded)
+    for report in reports:
+        if not report.is_file():
+            continue
+        for case in ET.parse(report).getroot().iter("testcase"):
+            test = keys.get((case.get("classname", ""), case.get("name", "")))
+            if not test:
+                continue
+            duration = round(float(case.get("time", 0)), 3)
+            previous = durations.get(test)
+            if previous is None or abs(duration - previous) > max(0.2 * previous, 0.05):
+                durations[test] = duration
+    if durations != recorded:
+        DURATIONS_FILE.write_text(json.dumps(durations, indent=2, sort_keys=True))
+
+
+def merge_junit(reports: t.List[Path], output: Path) -> None:
+    """Merge test cases of junit reports into a single test suite."""
+    suite = ET.Element("testsuite", name="pytest")
+    counts = dict.fromkeys(("errors", "failures", "skipped", "tests"), 0)
+    duration = 0.0
+    for report in reports:
+        for other in ET.parse(report).getroot().iter("testsuite"):
+            for name in counts:
+                counts[name] += int(other.get(name, 0))
+            # Shards run concurrently
+            duration = max(duration, float(other.get("time", 0)))
+            suite.extend(other.iter("testcase"))
+    for name, value in counts.items():
+        suite.set(name, str(value))
+    suite.set("time", f"{duration:.3f}")
+    root = ET.Element("testsuites", name="pytest tests")
+    root.append(suite)
+    ET.ElementTree(root).write(output, encoding="utf-8", xml_declaration=True)
+
+
+def pytest_addopts(*excluded: str) -> str:
+    """Options added to pytest command line by configuration, except excluded ones."""
+    config = configparser.ConfigParser()
+    config.read("setup.cfg")
+    addopts = config.get("tool:pytest", "addopts", fallback="")
+    return " ".join(
+        option for option in split(addopts) if not option.startswith(excluded)
+    )
+
+
+def coverage_config_without_branches() -> Path:
+    """Copy of coverage configuration which does not measure branches.
+
+    The copy is written into cache under a name derived from its content.
+    """
+    config = configparser.ConfigParser(interpolation=None)
+    config.read(".coveragerc")
+    if not config.has_section("run"):
+        config.add_section("run")
+    config.set("run", "branch", "False")
+    output = io.StringIO()
+    config.write(output)
+    content = output.getvalue()
+    digest = hashlib.sha256(content.encode()).hexdigest()[:16]
+    path = CACHE_DIR / "coverage" / f"{digest}.rc"
+    if not path.is_file():
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(content)
+    return path
+
+
+def sysmon_settings() -> t.Tuple[t.Dict[str, str], t.Tuple[str, ...]]:
+    """Settings enabling sys.monitoring coverage core when supported by interpreter.
+
+    Return environment variables of pytest command, and pytest options which
+    must be removed from configuration so that coverage does not fall back to
+    line tracing: sys.monitoring does not support test contexts, and only
+    measures branches since Python 3.14 (branch coverage enabled by .coveragerc
+    is disabled as well before). Nothing is enabled nor removed before Python 3.12.
+    """
+    version = tuple(int(part) for part in venv_python_version().split(".")[:2])
+    if version < (3, 12):
+        return {}, ()
+    env = {"COVERAGE_CORE": "sysmon"}
+    if version < (3, 14):
+        # Branch coverage enabled by .coveragerc is disabled in a copy of it, used
+        # by pytest-cov (--cov-config) and by coverage commands (COVERAGE_RCFILE)
+        rcfile = coverage_config_without_branches().as_posix()
+        addopts = os.environ.get("PYTEST_ADDOPTS", "")
+        env["PYTEST_ADDOPTS"] = f"{addopts} --cov-config={quote(rcfile)}".strip()
+        env["COVERAGE_RCFILE"] = rcfile
+        return env, ("--cov-context", "--cov-branch")
+    return env, ("--cov-context",)
+
+
+def shard_commands(
+    cmd: str, arguments: t.List[str], cov: bool, excluded: t.Tuple[str, ...] = ()
+) -> t.List[str]:
+    """Commands running shards of tests, given pytest arguments of each shard."""
+    options = "-o addopts=" + quote(
+        pytest_addopts("--junitxml", "--cov-report", *excluded)
+    )
+    if cov:
+        options += " --cov-report="
+    return [
+        f"{cmd} {options} --junitxml={SHARDS_DIR.as_posix()}/junit-{index}.xml {args}"
+        for index, args in enumerate(arguments, 1)
+    ]
+
+
+def show_sharded_tests(
+    cmd: str,
+    tests: t.List[str],
+    workers: int,
+    shard: str,
+    cov: bool,
+    excluded: t.Tuple[str, ...] = (),
+) -> None:
+    """Print commands run when tests are split into shards, without running any.
+
+    Tests are only collected when running, so tests of each shard are shown
+    as placeholders.
+    """
+    if shard:
+        parse_shard(shard)
+    print(collect_command(cmd, tests))
+    if workers > 1:
+        scope = f"shard {shard} for " if shard else ""
+        arguments = [
+            f"<tests of {scope}worker {index}/{workers}>"
+            for index in range(1, workers + 1)
+        ]
+        for command in shard_commands(cmd, arguments, cov, excluded):
+            print(command)
+        return
+    if excluded:
+        cmd += f" -o addopts={quote(pytest_addopts(*excluded))}"
+    print(f"{cmd} <tests of shard {shard}>")
+
+
+def run_workers(
+    c: Context,
+    cmd: str,
+    shards: t.List[t.List[str]],
+    cov: bool,
+    excluded: t.Tuple[str, ...] = (),
+    env: t.Optional[t.Dict[str, str]] = None,
+) -> None:
+    """Run shards of tests concurrently, then merge their reports.
+
+    Each shard writes its own junit report and coverage data. Reports are
+    merged into junit.xml, and coverage data is combined in order to produce
+    coverage.xml and coverage-report as a single run would.
+    """
+    shards = [tests for tests in shards if tests]
+    commands = shard_commands(
+        cmd,
+        [" ".join(quote(test) for test in tests) for tests in shards],
+        cov,
+        excluded,
+    )
+    coverage = f"{VENV_PYTHON} -m coverage"
+    rmtree(SHARDS_DIR, ignore_errors=True)
+    for data_file in Path().glob(".coverage.*"):
+        data_file.unlink()
+
+    def run_shard(c: Context, command: str, index: int) -> None:
+        c.run(command, env={**(env or {}), "COVERAGE_FILE": f".coverage.shard-{index}"})
+
+    steps = [
+        Step(
+            f"shard {index}/{len(commands)}",
+            functools.partial(run_shard, command=command, index=index),
+        )
+        for index, command in enumerate(commands, 1)
+    ]
+    try:
+        run_steps(c, steps, jobs=len(steps))
+    finally:
+        reports = sorted(SHARDS_DIR.glob("junit-*.xml"))
+        record_durations(reports, [test for tests in shards for test in tests])
+        merge_junit(reports, Path("junit.xml"))
+        if cov:
+            c.run(f"{coverage} combine", hide=True, warn=True, env=env)
+            c.run(f"{coverage} report --show-missing", warn=True, env=env)
+            c.run(f"{coverage} xml -q -o coverage.xml", warn=True, env=env)
+            c.run(f"{coverage} html -q -d coverage-report", warn=True, env=env)
+
+
+class FileWatcher(abc.ABC):
+    """Wait for changes of files found under directories."""
+
+    name = ""
+
+    @abc.abstractmethod
+    def changes(self, timeout: t.Optional[float] = None) -> t.Set[str]:
+        """Wait for changes and return changed paths (none when timeout expired)."""
+
+    def close(self) -> None:
+        pass
+
+
+class InotifyWatcher(FileWatcher):
+    """Watch directories using inotify (Linux only), subdirectories included."""
+
+    name = "inotify"
+    # Files closed after writing, moved, created or deleted (see inotify.h)
+    MASK = 0x008 | 0x040 | 0x080 | 0x100 | 0x200
+    IN_ISDIR = 0x40000000
+    HEADER = struct.Struct("iIII")
+
+    def __init__(self, roots: t.List[str]) -> None:
+        self.libc = ctypes.CDLL(None, use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.directories: t.Dict[int, str] = {}
+        for root in roots:
+            self.add(root)
+
+    def add(self, root: str) -> None:
+        for dirpath, dirnames, _ in os.walk(root):
+            dirnames[:] = [name for name in dirnames if not is_ignored_directory(name)]
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(dirpath), self.MASK)
+            if wd >= 0:
+                self.directories[wd] = Path(dirpath).as_posix()
+
+    def changes(self, timeout: t.Optional[float] = None) -> t.Set[str]:
+        changed: t.Set[str] = set()
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return changed
+        data = os.read(self.fd, 64 * 1024)
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = self.HEADER.unpack_from(data, offset)
+            offset += self.HEADER.size
+            name = os.fsdecode(data[offset : offset + length].rstrip(b"\0"))
+            offset += length
+            if wd not in self.directories or not name:
+                continue
+            path = f"{self.directories[wd]}/{name}"
+            if not mask & self.IN_ISDIR:
+                changed.add(path)
+            elif not is_ignored_directory(name) and os.path.isdir(path):
+                # Files may be written into new directory before it is watched
+                self.add(path)
+                changed.update(file.as_posix() for file in project_files(path))
+        return changed
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+class PollingWatcher(FileWatcher):
+    """Watch directories by comparing modification times of their files."""
+
+    name = "polling"
+
+    def __init__(self, roots: t.List[str], interval: float = 0.25) -> None:
+        self.roots = roots
+        self.interval = interval
+        self.snapshot = self.scan()
+
+    def scan(self) -> t.Dict[str, t.Tuple[int, int]]:
+        snapshot: t.Dict[str, t.Tuple[int, int]] = {}
+        for path in project_files(*self.roots):
+            with contextlib.suppress(FileNotFoundError):
+                stat = path.stat()
+                snapshot[path.as_posix()] = (stat.st_mtime_ns, stat.st_size)
+        return snapshot
+
+    def changes(self, timeout: t.Optional[float] = None) -> t.Set[str]:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            snapshot = self.scan()
+            changed = {
+                path
+                for path in snapshot.keys() | self.snapshot.keys()
+                if snapshot.get(path) != self.snapshot.get(path)
+            }
+            self.snapshot = snapshot
+            if changed or (deadline is not None and time.monotonic() >= deadline):
+                return changed
+            delay = self.interval
+            if deadline is not None:
+                delay = min(delay, max(deadline - time.monotonic(), 0))
+            time.sleep(delay)
+
+
+def file_watcher(roots: t.List[str], poll: bool = False) -> FileWatcher:
+    """Watch directories using inotify when available, or by polling files."""
+    if not poll and sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(roots)
+        except (OSError, AttributeError) as exc:
+            print(f"Cannot use inotify ({exc}), polling files", file=sys.stderr)
+    return PollingWatcher(roots)
+
+
+class WatchRun(threading.Thread):
+    """Commands run concurrently after files changed, until done or cancelled.
+
+    Output of each command is printed as a whole once it is done, in the order
+    of commands, and only when it failed.
+    """
+
+    def __init__(
+        self, c: Context, changed: t.Set[str], commands: t.List[t.Tuple[str, str]]
+    ) -> None:
+        super().__init__(daemon=True)
+        self.context = c
+        self.changed = changed
+        self.commands = commands
+        self.promises: t.List[t.Tuple[str, t.Any]] = []
+        self.cancelled = threading.Event()
+        self.lock = threading.Lock()
+
+    def run(self) -> None:
+        start = time.perf_counter()
+        with self.lock:
+            if self.cancelled.is_set():
+                return
+            self.promises = [
+                (
+                    name,
+                    self.context.run(
+                        cmd, asynchronous=True, hide=True, warn=True, in_stream=False
+                    ),
+                )
+                for name, cmd in self.commands
+            ]
+        failed = []
+        for name, promise in self.promises:
+            result = promise.join()
+            if self.cancelled.is_set():
+                return
+            status = "failed" if result.failed else "ok"
+            with OUTPUT_LOCK:
+                print(f"--- {name}: {status} ({time.perf_counter() - start:.2f}s)")
+                if result.failed:
+                    failed.append(name)
+                    print(result.stdout + result.stderr, end="", flush=True)
+        summary = f"failed: {', '.join(failed)}" if failed else "passed"
+        print(
+            f"Checks {summary} in {time.perf_counter() - start:.2f}s,"
+            " watching for changes",
+            file=sys.stderr,
+        )
+
+    def cancel(self) -> bool:
+        """Kill commands unless they are done, and return whether they were."""
+        with self.lock:
+            if not self.is_alive():
+                return False
+            self.cancelled.set()
+            for _, promise in self.promises:
+                # Process may have exited already
+                with contextlib.suppress(ProcessLookupError):
+                    promise.runner.kill()
+        self.join()
+        return True
+
+
+def watch_commands(
+    changed: t.Set[str], roots: t.List[str], daemon: bool, include_tests: bool
+) -> t.List[t.Tuple[str, str]]:
+    """Commands checking changed files: affected tests, lint and type checks."""
+    commands: t.List[t.Tuple[str, str]] = []
+    impact = json.loads(IMPACT_FILE.read_text()) if IMPACT_FILE.is_file() else {}
+    config = {path.as_posix() for path in impact_config_files()}
+    imports = impact.get("imports", {})
+    # Files executed outside of tests or affecting every test run all tests
+    if not impact or not changed.isdisjoint(config) or not changed.isdisjoint(imports):
+        tests = roots
+    else:
+        tests = tests_affected_by(
+            changed, impact.get("tests", {}), impact.get("modules", {}), roots
+        )
+    if tests:
+        # Reports of tests run while watching do not replace reports of full runs
+        addopts = pytest_addopts("--junitxml", "--cov")
+        commands.append(
+            (
+                "test",
+                f"{VENV_PYTHON} -m pytest -o addopts={quote(addopts)} "
+                + " ".join(quote(name) for name in tests),
+            )
+        )
+    files = sorted(
+        path
+        for path in changed
+        if path.endswith((".py", ".pyi")) and Path(path).is_file()
+    )
+    if files:
+        paths = " ".join(quote(path) for path in files)
+        commands.append(("lint", f"{VENV_PYTHON} -m flake8 {paths}"))
+    checked = [path for path in files if include_tests or path.startswith("src/")]
+    if daemon:
+        paths = "src/ tests/" if include_tests else "src/"
+        commands.append(("check", f"{VENV_PYTHON} -m mypy.dmypy check {paths}"))
+    elif checked:
+        paths = " ".join(quote(path) for path in checked)
+        commands.append(("check", f"{VENV_PYTHON} -m mypy {paths}"))
+    return commands
+
+
+def project_name() -> str:
+    """Get project name declared in pyproject.toml"""
+    content = Path("pyproject.toml").read_text()
+    match = re.search(r'^name\s*=\s*"([^"]+)"', content, re.M)
+    return match.group(1) if match else ""
+
+
+def project_version() -> str:
+    """Get project version declared in __about__ module"""
+    content = Path("src/{{ cookiecutter.project_slug }}/__about__.py").read_text()
+    match = re.search(r'^__version__\s*=\s*"([^"]+)"', content, re.M)
+    return match.group(1) if match else ""
+
+
+def venv_python_version() -> str:
+    """Get version of virtual environment python"""
+    for line in VENV_DIR.joinpath("pyvenv.cfg").read_text().splitlines():
+        key, _, value = line.partition("=")
+        if key.strip() == "version":
+            return value.strip()
+    return ""
+
+
+def dependencies_spec() -> t.Any:
+    """Get normalised project dependencies declared in pyproject.toml"""
+    content = Path("pyproject.toml").read_text()
+    try:
+        from packaging.requirements import Requirement
+        from packaging.utils import canonicalize_name
+
+        try:
+            import tomllib
+        except ImportError:
+            import tomli as tomllib  # type: ignore[no-redef]
+    except ImportError:
+        # Without parsers, any change to pyproject.toml invalidates resolution cache
+        return {"pyproject.toml": content}
+    project = tomllib.loads(content)["project"]
+    requirements = [Requirement(spec) for spec in project.get("dependencies", [])]
+    for requirement in requirements:
+        requirement.name = canonicalize_name(requirement.name)
+    return {
+        "dependencies": sorted(str(requirement) for requirement in requirements),
+        "requires-python": project.get("requires-python"),
+    }
+
+
+def resolution_cache_file(cmd: str) -> Path:
+    """Path to cached output of pip-compile command for current inputs.
+
+    Resolution depends on declared dependencies, on the interpreter and the
+    platform (through environment markers), on package indexes and on pins
+    found in existing requirements.txt (pip-compile keeps existing pins).
+    """
+    requirements = Path("requirements.txt")
+    pins = requirements.read_text() if requirements.is_file() else ""
+    key = {
+        "spec": dependencies_spec(),
+        "command": cmd.replace(VENV_PYTHON, "python"),
+        "python": venv_python_version(),
+        "platform": [platform.system(), platform.machine()],
+        "indexes": [
+            os.environ.get(name, "")
+            for name in ("PIP_INDEX_URL", "PIP_EXTRA_INDEX_URL", "PIP_FIND_LINKS")
+        ],
+        "pins": pins.replace(f"{project_name()} (pyproject.toml)", "<project>"),
+    }
+    digest = hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+    return CACHE_DIR / "requirements" / f"{digest}.txt"
 
 
 @task
@@ -42,7 +1405,10 @@ def clean(
 
 
 @task
-def requirements(c: Context, with_hashes: bool = False, dry_run: bool = False):
+@recorded
+def requirements(
+    c: Context, with_hashes: bool = False, no_cache: bool = False, dry_run: bool = False
+):
     """Generate requirementx.txt (required to build docker image)"""
     cmd = (
         f"{VENV_PYTHON} -m piptools compile"
@@ -53,15 +1419,48 @@ def requirements(c: Context, with_hashes: bool = False, dry_run: bool = False):
     if with_hashes:
         cmd += " --generate-hashes"
     cmd += " pyproject.toml"
+    if dry_run:
+        run_or_display(c, cmd, dry_run=dry_run)
+        return
+    # Cached resolutions are shared across projects, so project name is replaced
+    project = f"{project_name()} (pyproject.toml)"
+    cache = resolution_cache_file(cmd)
+    output = Path("requirements.txt")
+    if cache.is_file() and not no_cache:
+        resolved = cache.read_text().replace("<project>", project)
+        # Leave file untouched when up to date (docker layer cache relies on mtime)
+        if not output.is_file() or output.read_text() != resolved:
+            output.write_text(resolved)
+        print(f"Restored requirements.txt from resolution cache: {cache}")
+        return
     run_or_display(c, cmd, dry_run=dry_run)
+    resolved = output.read_text().replace(project, "<project>")
+    # Key depends on existing pins, store resolution under the key of resulting
+    # pins as well so that running the task again does not resolve again
+    cache.parent.mkdir(parents=True, exist_ok=True)
+    for path in {cache, resolution_cache_file(cmd)}:
+        path.write_text(resolved)
 
 
 @task
-def build(c: Context, docs: bool = False, dry_run: bool = False):
+@recorded
+def build(
+    c: Context, docs: bool = False, no_cache: bool = False, dry_run: bool = False
+):
     """Build sdist and wheel, and optionally build documentation."""
     python_build_cmd = f"{VENV_PYTHON} -m build --no-isolation --outdir dist ."
     docs_build_cmd = f"{VENV_PYTHON} -m mkdocs build -d dist/documentation"
-    run_or_display(c, python_build_cmd, dry_run=dry_run)
+    cached_run(
+        c,
+        python_build_cmd,
+        inputs=project_files("src") + config_files("README.md", "MANIFEST.in"),
+        outputs=[
+            f"dist/*-{project_version()}.tar.gz",
+            f"dist/*-{project_version()}-*.whl",
+        ],
+        dry_run=dry_run,
+        no_cache=no_cache,
+    )
     if docs:
         if not dry_run:
             rmtree("dist/documentation", ignore_errors=True)
@@ -69,6 +1468,7 @@ def build(c: Context, docs: bool = False, dry_run: bool = False):
 
 
 @task
+@recorded
 def wheelhouse(
     c: Context, clean: bool = False, compress: bool = False, dry_run: bool = False
 ):
@@ -98,12 +1498,19 @@ def docs(c: Context, watch: bool = True, port: int = 8000, dry_run: bool = False
 
 
 @task
+@recorded
 def test(
     c: Context,
     e2e: bool = False,
     cov: bool = False,
     markers: str = "",
     pattern: str = "",
+    affected: bool = False,
+    since: str = "",
+    workers: int = 0,
+    shard: str = "",
+    sysmon: bool = False,
+    no_cache: bool = False,
     dry_run: bool = False,
 ):
     """Run tests using pytest and optionally enable coverage."""
@@ -112,48 +1519,254 @@ def test(
         cmd += f" -m {markers}"
     if pattern:
         cmd += f" -p {pattern}"
+    # Environment and options removed from configuration in order to measure
+    # coverage with sys.monitoring
+    env, excluded = sysmon_settings() if sysmon else ({}, ())
+    cov = cov or sysmon
     if cov:
         cmd += " --cov src/{{ cookiecutter.project_slug }}"
-    if e2e:
-        cmd += " tests/"
-    else:
-        cmd += " tests/unit/"
-    run_or_display(c, cmd, dry_run=dry_run)
+    # Impact of tests is only known when coverage is measured with test contexts
+    record_impact = cov and "--cov-context" not in excluded and not dry_run
+    roots = ["tests/"] if e2e else ["tests/unit/"]
+    tests = affected_tests(c, roots, since) if affected or since else roots
+    if not tests:
+        print("No test affected by changes")
+        return
+    if workers > 1 or shard:
+        if dry_run:
+            show_sharded_tests(cmd, tests, workers, shard, cov, excluded)
+            return
+        nodeids = collect_tests(c, cmd, tests)
+        if shard:
+            index, count = parse_shard(shard)
+            nodeids = tests = balance_tests(nodeids, count)[index]
+            if not tests:
+                print(f"No test in shard {shard}")
+                return
+        if workers > 1:
+            try:
+                run_workers(c, cmd, balance_tests(nodeids, workers), cov, excluded, env)
+            finally:
+                if record_impact:
+                    record_test_impact(tests, roots)
+            return
+    if excluded:
+        cmd += f" -o addopts={quote(pytest_addopts(*excluded))}"
+    cmd += " " + " ".join(quote(name) for name in tests)
+    outputs = ["junit.xml"]
+    if cov:
+        outputs += [".coverage", "coverage.xml", "coverage-report/**/*"]
+    try:
+        cached_run(
+            c,
+            cmd,
+            inputs=project_files("src", "tests") + config_files(),
+            outputs=outputs,
+            dry_run=dry_run,
+            no_cache=no_cache,
+            # Tests may fail because of external state, run them again next time
+            cache_failures=False,
+            env=env,
+        )
+    finally:
+        if shard:
+            # Durations recorded by shards of CI jobs balance next runs as well
+            record_durations([Path("junit.xml")], tests)
+        if record_impact:
+            # Tests which failed are selected again by next run of affected tests
+            record_test_impact(tests, roots)
+
+
+class CoverageReportHandler(SimpleHTTPRequestHandler):
+    """Serve coverage report files, keeping connections alive between requests."""
+
+    protocol_version = "HTTP/1.1"
+
+    def __init__(self, *args: t.Any, **kwargs: t.Any) -> None:
+        super().__init__(*args, directory="coverage-report", **kwargs)
+
+    def log_message(self, format: str, *args: t.Any) -> None:
+        pass
 
 
 @task
-def coverage(c: Context, run: bool = False, port: int = 8000, dry_run: bool = False):
+def watch(
+    c: Context,
+    e2e: bool = False,
+    include_tests: bool = False,
+    debounce: float = 0.1,
+    poll: bool = False,
+    dry_run: bool = False,
+):
+    """Run affected tests, lint and type checks on changed files whenever files change."""
+    roots = ["tests/"] if e2e else ["tests/unit/"]
+    if dry_run:
+        # Show checks which would run if every watched file changed
+        print("Watch src/ and tests/ for changes, then run:")
+        changed = {path.as_posix() for path in project_files("src", "tests")}
+        for _, command in watch_commands(changed, roots, False, include_tests):
+            print(command)
+        return
+    # Cache is shared by all projects, mypy validates cached modules using their hash
+    os.environ.setdefault("MYPY_CACHE_DIR", mypy_cache_dir().as_posix())
+    daemon = start_mypy_daemon(c)
+    watcher = file_watcher(["src", "tests"], poll=poll)
+    print(
+        f"Watching src/ and tests/ for changes ({watcher.name}), press Ctrl+C to stop",
+        file=sys.stderr,
+    )
+    current: t.Optional[WatchRun] = None
+    try:
+        while True:
+            changed = watcher.changes()
+            if current is not None and current.cancel():
+                print("Files changed, cancelling checks", file=sys.stderr)
+                # Files changed before cancelled run are checked again
+                changed |= current.changed
+            # Editors may save several files at once, wait until they are done
+            while True:
+                changes = watcher.changes(debounce)
+                if not changes:
+                    break
+                changed |= changes
+            commands = watch_commands(changed, roots, daemon, include_tests)
+            if commands:
+                current = WatchRun(c, changed, commands)
+                current.start()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if current is not None:
+            current.cancel()
+        watcher.close()
+
+
+@task
+def coverage(
+    c: Context,
+    run: bool = False,
+    port: int = 8000,
+    sysmon: bool = False,
+    dry_run: bool = False,
+):
     """Serve code coverage results and optionally run tests before serving results"""
     if run:
-        test(c, True, dry_run=dry_run)
-    cmd = f"{VENV_PYTHON} -m http.server {port} --dir coverage-report"
-    run_or_display(c, cmd, dry_run)
+        test(c, True, cov=True, sysmon=sysmon, dry_run=dry_run)
+    if dry_run:
+        print(f"Serve coverage-report on http://localhost:{port}/")
+        return
+    # Each request is handled by its own thread, so that browsers load report pages
+    # along with their assets over concurrent connections
+    with ThreadingHTTPServer(("", port), CoverageReportHandler) as server:
+        server.daemon_threads = True
+        print(f"Serving on http://localhost:{port}/", file=sys.stderr)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
 
 
 @task
-def check(c: Context, include_tests: bool = False, dry_run: bool = False):
-    """Run mypy typechecking."""
-    cmd = f"{VENV_PYTHON} -m mypy src/"
-    if include_tests:
-        cmd += " tests/"
-    run_or_display(c, cmd, dry_run=dry_run)
+@recorded
+def check(
+    c: Context,
+    include_tests: bool = False,
+    daemon: bool = False,
+    stop_daemon: bool = False,
+    no_cache: bool = False,
+    dry_run: bool = False,
+):
+    """Run mypy typechecking, optionally using mypy daemon."""
+    dmypy = f"{VENV_PYTHON} -m mypy.dmypy"
+    if stop_daemon:
+        run_or_display(c, f"{dmypy} stop", dry_run=dry_run)
+        return
+    paths = "src/ tests/" if include_tests else "src/"
+    if not dry_run:
+        # Cache is shared by all projects, mypy validates cached modules using their hash
+        os.environ.setdefault("MYPY_CACHE_DIR", mypy_cache_dir().as_posix())
+    if daemon:
+        if dry_run:
+            run_or_display(c, f"{dmypy} check {paths}", dry_run=dry_run)
+            return
+        if start_mypy_daemon(c):
+            result = c.run(f"{dmypy} check {paths}", warn=True)
+            # Exit code 2 means that daemon failed, not that typechecking failed
+            if result.exited != 2:
+                if result.exited:
+                    raise UnexpectedExit(result)
+                return
+            c.run(f"{dmypy} kill", hide=True, warn=True)
+        print("mypy daemon is not available, running mypy instead", file=sys.stderr)
+    cmd = f"{VENV_PYTHON} -m mypy {paths}"
+    inputs = project_files("src", "tests", suffixes=(".py", ".pyi")) + config_files()
+    cached_run(c, cmd, inputs, dry_run=dry_run, no_cache=no_cache)
 
 
 @task
-def format(c: Context, check: bool = False, dry_run: bool = False):
+@recorded
+def format(
+    c: Context,
+    check: bool = False,
+    changed: bool = False,
+    base: str = "",
+    staged: bool = False,
+    jobs: int = 0,
+    no_cache: bool = False,
+    dry_run: bool = False,
+):
     """Format source code using black and isort."""
     opts = " --check" if check else ""
-    run_or_display(c, f"{VENV_PYTHON} -m isort .{opts}", dry_run=dry_run)
-    run_or_display(c, f"{VENV_PYTHON} -m black .{opts}", dry_run=dry_run)
+    # Results are only cached when checking since formatting modifies inputs
+    no_cache = no_cache or not check
+    isort_cmd = f"{VENV_PYTHON} -m isort"
+    black_cmd = f"{VENV_PYTHON} -m black"
+    if changed or base or staged:
+        files = changed_files(c, base=base, staged=staged)
+        if not files:
+            return
+        inputs = [Path(name) for name in files] + config_files()
+        # Files skipped by isort configuration are skipped as in a full run
+        isort_cmd += f" --filter-files --jobs {jobs or -1}"
+        if jobs:
+            black_cmd += f" --workers {jobs}"
+        paths = " ".join(quote(name) for name in files)
+    else:
+        inputs = project_files(".", suffixes=(".py", ".pyi")) + config_files()
+        paths = "."
+    for cmd in (f"{isort_cmd} {paths}{opts}", f"{black_cmd} {paths}{opts}"):
+        cached_run(c, cmd, inputs, dry_run=dry_run, no_cache=no_cache)
 
 
 @task
-def lint(c: Context, dry_run: bool = False):
+@recorded
+def lint(
+    c: Context,
+    changed: bool = False,
+    base: str = "",
+    staged: bool = False,
+    jobs: int = 0,
+    no_cache: bool = False,
+    dry_run: bool = False,
+):
     """Lint source code using flake8."""
-    run_or_display(c, f"{VENV_PYTHON} -m flake8 .", dry_run=dry_run)
+    cmd = f"{VENV_PYTHON} -m flake8"
+    if jobs:
+        cmd += f" --jobs {jobs}"
+    if changed or base or staged:
+        files = changed_files(c, base=base, staged=staged)
+        if not files:
+            return
+        inputs = [Path(name) for name in files] + config_files()
+        cmd += " " + " ".join(quote(name) for name in files)
+    else:
+        inputs = project_files(".", suffixes=(".py", ".pyi")) + config_files()
+        cmd += " ."
+    cached_run(c, cmd, inputs, dry_run=dry_run, no_cache=no_cache)
 
 
 @task
+@recorded
 def docker(
     c: Context,
     platforms: str = "linux/amd64",
@@ -206,9 +1819,177 @@ def docker(
 
 
 @task
-def pre_push(c: Context):
+@recorded
+def bench(
+    c: Context,
+    keyword: str = "",
+    warmup: int = 1,
+    repeat: int = 5,
+    cpu: int = -1,
+    baseline: str = "",
+    ref: str = "",
+    save: str = "",
+    threshold: float = 0.2,
+    dry_run: bool = False,
+):
+    """Run benchmarks and compare results against a baseline or a git ref."""
+    cmd = f"{VENV_PYTHON} -m tests.bench.harness --warmup {warmup} --repeat {repeat}"
+    if keyword:
+        cmd += f" -k {quote(keyword)}"
+    if cpu >= 0:
+        cmd += f" --cpu {cpu}"
+    runs = BENCH_DIR / "runs"
+    output = runs / "latest.json"
+    if ref:
+        reference = runs / "ref.json"
+        result = c.run(
+            "git rev-parse -q --verify " + quote(ref + "^{commit}"),
+            hide=True,
+            warn=True,
+            in_stream=False,
+        )
+        if result.failed:
+            raise Exit(f"Unknown ref: {ref}")
+        commit = result.stdout.strip()
+        # Benchmarks of ref run on a checkout of ref, within project environment
+        worktree = Path(tempfile.gettempdir(), f"{project_name()}-bench-{commit[:12]}")
+        commands = [
+            f"git worktree add --force --detach {worktree.as_posix()} {commit}",
+            f"cd {worktree.as_posix()} && PYTHONPATH=src "
+            f"{cmd} --output {reference.resolve().as_posix()}",
+            f"git worktree remove --force {worktree.as_posix()}",
+        ]
+        if dry_run:
+            print("\n".join(commands))
+        else:
+            c.run(commands[0], hide=True, in_stream=False)
+            try:
+                if not worktree.joinpath("tests", "bench", "harness.py").is_file():
+                    raise Exit(f"No benchmark harness found at {ref}")
+                c.run(commands[1])
+            finally:
+                c.run(commands[2], hide=True, warn=True, in_stream=False)
+    else:
+        reference = BENCH_DIR / f"{baseline or 'baseline'}.json"
+        if baseline and not reference.is_file():
+            raise Exit(f"Unknown baseline: {baseline}")
+    cmd += f" --output {output.as_posix()}"
+    if reference.is_file() or (ref and dry_run):
+        cmd += f" --compare {reference.as_posix()} --threshold {threshold}"
+    if dry_run:
+        print(cmd)
+        return
+    output.unlink(missing_ok=True)
+    result = c.run(cmd, warn=True)
+    if save and output.is_file():
+        copy2(output, BENCH_DIR / f"{save}.json")
+        print(f"Results saved to {BENCH_DIR.as_posix()}/{save}.json", file=sys.stderr)
+    elif not reference.is_file():
+        print("No baseline found, use --save baseline to store one", file=sys.stderr)
+    if result.failed:
+        raise UnexpectedExit(result)
+
+
+def pre_push_steps(include_bench: bool = False, dry_run: bool = False) -> t.List[Step]:
+    """Steps run by pre-push task, along with paths they read and write."""
+    # Checks are read-only, they only write their own cache
+    sources = tuple(
+        path.as_posix()
+        for path in project_files(".", suffixes=(".py", ".pyi")) + config_files()
+    )
+    steps = [
+        Step(
+            "format",
+            lambda c: format(c, check=True, dry_run=dry_run),
+            reads=sources,
+        ),
+        Step("lint", lambda c: lint(c, dry_run=dry_run), reads=sources),
+        Step(
+            "check",
+            lambda c: check(c, include_tests=True, dry_run=dry_run),
+            reads=("src", "tests"),
+        ),
+        Step(
+            "test",
+            lambda c: test(c, dry_run=dry_run),
+            reads=("src", "tests"),
+            writes=(".pytest_cache", "junit.xml"),
+        ),
+    ]
+    if include_bench:
+        # Benchmarks run alone once other checks succeeded, so that timings are stable
+        steps.append(
+            Step(
+                "bench",
+                lambda c: bench(c, dry_run=dry_run),
+                requires=tuple(step.name for step in steps),
+                writes=(BENCH_DIR.as_posix(),),
+            )
+        )
+    return steps
+
+
+@task
+@recorded
+def pre_push(
+    c: Context, jobs: int = 0, include_bench: bool = False, dry_run: bool = False
+):
     """Ensure checks performed in CI will not fail before pushing to remote"""
-    format(c, check=True)
-    lint(c)
-    check(c, include_tests=True)
-    test(c)
+    steps = pre_push_steps(include_bench=include_bench, dry_run=dry_run)
+    if dry_run:
+        for step in steps:
+            step.action(c)
+        return
+    run_steps(c, steps, jobs=jobs)
+
+
+@task
+def stats(
+    c: Context,
+    name: str = "",
+    by_arguments: bool = False,
+    days: int = 0,
+    dry_run: bool = False,
+):
+    """Show duration percentiles and trends of tasks recorded in history
+
+    Runs which replayed results from cache are counted but are excluded from
+    percentiles and trends.
+    """
+    if dry_run:
+        scope = f"{name} runs" if name else "runs"
+        period = f" during last {days} days" if days else ""
+        print(f"Show statistics of {scope}{period} recorded in {HISTORY_FILE}")
+        return
+    if not HISTORY_FILE or not Path(HISTORY_FILE).is_file():
+        raise Exit("No task history recorded yet")
+    query = "SELECT task, arguments, wall, cpu, maxrss, exit_code, cached FROM runs"
+    query += " WHERE task LIKE ? AND started >= ? ORDER BY started"
+    since = time.time() - days * 24 * 3600 if days else 0
+    with contextlib.closing(open_history()) as connection:
+        rows = connection.execute(query, (name or "%", since)).fetchall()
+    groups: t.Dict[str, t.List[t.Tuple[float, float, t.Optional[float], int, int]]] = {}
+    for task_name, arguments, *run in rows:
+        key = f"{task_name} {arguments}".strip() if by_arguments else task_name
+        groups.setdefault(key, []).append(tuple(run))
+    print(
+        f"{'Task':<40}{'Runs':>6}{'Failed':>8}{'Cached':>8}{'p50':>9}{'p90':>9}"
+        f"{'p95':>9}{'Max':>9}{'CPU p50':>9}{'RSS (MB)':>10}{'Trend':>7}"
+    )
+    for key, runs in sorted(groups.items()):
+        failed = sum(1 for run in runs if run[3])
+        cached = sum(1 for run in runs if run[4])
+        executed = [run for run in runs if not run[4]]
+        if not executed:
+            print(f"{key:<40}{len(runs):>6}{failed:>8}{cached:>8}")
+            continue
+        walls = [run[0] for run in executed]
+        peaks = [run[2] for run in executed if run[2] is not None]
+        maxrss = f"{max(peaks):>10.1f}" if peaks else f"{'-':>10}"
+        print(
+            f"{key:<40}{len(runs):>6}{failed:>8}{cached:>8}"
+            f"{percentile(walls, 50):>8.2f}s{percentile(walls, 90):>8.2f}s"
+            f"{percentile(walls, 95):>8.2f}s{max(walls):>8.2f}s"
+            f"{percentile([run[1] for run in executed], 50):>8.2f}s"
+            f"{maxrss}{trend(walls):>7}"
+        )
@@ -0,0 +1,11 @@
+"""Example benchmarks, replace them with benchmarks of project hot paths.
+
+Functions named bench_* found in bench_*.py modules are run by the harness
+(see harness.py) without argument.
+"""
+
+from {{ cookiecutter.project_slug }} import __version__
+
+
+def bench_version_parsing() -> None:
+    tuple(int(part) if part.isdigit() else part for part in __version__.split("."))
@@ -0,0 +1,163 @@
+"""Run benchmarks and report statistics of their durations.
+
+Benchmarks are functions named bench_* found in bench_*.py modules of this
+directory, called without argument. Each benchmark is called a few times to warm
+up (filling caches and importing modules lazily), then the number of calls per
+timing is calibrated so that a timing lasts at least 0.2 seconds. Timings are
+repeated, and the minimum, median and standard deviation of the duration of a
+call are reported. Garbage collection is disabled while timing.
+
+Results can be written to a JSON file, and compared against results of a
+previous run: benchmarks whose minimum and median durations both exceed the
+reference by more than the threshold are reported as regressions, and exit code
+is 1.
+
+Run with `python -m tests.bench.harness` from project root.
+"""
+
+import argparse
+import importlib
+import json
+import os
+import platform
+import statistics
+import sys
+import timeit
+import typing as t
+from pathlib import Path
+
+BENCH_DIR = Path(__file__).parent
+
+
+def machine() -> t.Dict[str, t.Any]:
+    """Describe the machine on which benchmarks run (references must match it)."""
+    return {
+        "platform": sys.platform,
+        "machine": platform.machine(),
+        "python": platform.python_version(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def collect(keyword: str = "") -> t.Dict[str, t.Callable[[], object]]:
+    """Import benchmark modules and return benchmarks whose name contains keyword."""
+    benchmarks: t.Dict[str, t.Callable[[], object]] = {}
+    for path in sorted(BENCH_DIR.glob("bench_*.py")):
+        module = importlib.import_module(f"{__package__}.{path.stem}")
+        for name, func in vars(module).items():
+            if name.startswith("bench_") and callable(func):
+                if keyword in f"{path.stem}.{name}":
+                    benchmarks[f"{path.stem}.{name}"] = func
+    return benchmarks
+
+
+def measure(
+    func: t.Callable[[], object], warmup: int, repeat: int
+) -> t.Dict[str, float]:
+    """Measure duration of a call to func (in seconds)."""
+    for _ in range(warmup):
+        func()
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    timings = [timing / number for timing in timer.repeat(repeat, number)]
+    return {
+        "min": min(timings),
+        "median": statistics.median(timings),
+        "stddev": statistics.stdev(timings) if len(timings) > 1 else 0.0,
+        "number": number,
+        "repeat": repeat,
+    }
+
+
+def format_duration(seconds: float) -> str:
+    for unit, scale in (("s", 1.0), ("ms", 1e-3), ("us", 1e-6)):
+        if seconds >= scale:
+            return f"{seconds / scale:.2f} {unit}"
+    return f"{seconds / 1e-9:.2f} ns"
+
+
+def compare(
+    results: t.Dict[str, t.Any], reference: t.Dict[str, t.Any], threshold: float
+) -> t.List[str]:
+    """Print changes against reference results and return regressed benchmarks."""
+    regressions: t.List[str] = []
+    if reference["machine"] != results["machine"]:
+        print(
+            "Reference was recorded on another machine: "
+            f"{reference['machine']} != {results['machine']}",
+            file=sys.stderr,
+        )
+    print(f"\n{'Benchmark':<50}{'Median':>12}{'Reference':>12}{'Change':>10}")
+    for name, stats in results["benchmarks"].items():
+        other = reference["benchmarks"].get(name)
+        if other is None:
+            print(f"{name:<50}{format_duration(stats['median']):>12}{'-':>12}")
+            continue
+        change = stats["median"] / other["median"] - 1
+        regressed = change > threshold and stats["min"] > other["min"] * (1 + threshold)
+        print(
+            f"{name:<50}{format_duration(stats['median']):>12}"
+            f"{format_duration(other['median']):>12}{change:>+10.1%}"
+            + ("  REGRESSION" if regressed else "")
+        )
+        if regressed:
+            regressions.append(name)
+    return regressions
+
+
+def main(args: t.Optional[t.Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "-k", "--keyword", default="", help="Only run benchmarks containing keyword"
+    )
+    parser.add_argument(
+        "--warmup", type=int, default=1, help="Calls made before timing benchmarks"
+    )
+    parser.add_argument(
+        "-r", "--repeat", type=int, default=5, help="Timings taken per benchmark"
+    )
+    parser.add_argument(
+        "--cpu", type=int, help="Pin process to this CPU (Linux only) to reduce noise"
+    )
+    parser.add_argument("-o", "--output", type=Path, help="Write results to JSON file")
+    parser.add_argument(
+        "--compare", type=Path, help="Compare against results found in JSON file"
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.2,
+        help="Fail when a benchmark exceeds reference by more than this ratio",
+    )
+    options = parser.parse_args(args)
+    if options.repeat < 1:
+        parser.error("--repeat must be at least 1")
+
+    if options.cpu is not None:
+        if not hasattr(os, "sched_setaffinity"):
+            parser.error("CPU pinning is not supported on this platform")
+        os.sched_setaffinity(0, {options.cpu})
+    results: t.Dict[str, t.Any] = {"machine": machine(), "benchmarks": {}}
+    print(f"{'Benchmark':<50}{'Min':>12}{'Median':>12}{'Stddev':>12}")
+    for name, func in collect(options.keyword).items():
+        stats = measure(func, options.warmup, options.repeat)
+        results["benchmarks"][name] = stats
+        print(
+            f"{name:<50}{format_duration(stats['min']):>12}"
+            f"{format_duration(stats['median']):>12}"
+            f"{format_duration(stats['stddev']):>12}"
+        )
+    if options.output:
+        options.output.parent.mkdir(parents=True, exist_ok=True)
+        options.output.write_text(json.dumps(results, indent=2, sort_keys=True))
+    if options.compare is None:
+        return 0
+    reference = json.loads(options.compare.read_text())
+    regressions = compare(results, reference, options.threshold)
+    for name in regressions:
+        print(f"REGRESSION {name}: threshold {options.threshold:.0%}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())